@@ -0,0 +1,51 @@
+import argparse
+import json
+import sys
+import time
+
+from loguru import logger
+
+from src.batch import read_manifest, run_batch, summarize, format_summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Geo-references several video and GPX pairs in parallel')
+    parser.add_argument('manifest',
+                        type=str,
+                        help='CSV or JSON file with a job per video. The `video` and `gpx` columns are required, '
+                             'the rest are the options of main.py with underscores, e.g. `sync_error`')
+    parser.add_argument('-o', '--output-path',
+                        type=str, default=None,
+                        help='output path of the jobs that do not set their own `output_path`')
+    parser.add_argument('-j', '--processes',
+                        type=int, default=None,
+                        help='Number of jobs processed in parallel. By default, the number of CPUs')
+    parser.add_argument('-r', '--resume',
+                        action='store_true',
+                        help='resume the jobs from the checkpoints of a previous batch')
+    parser.add_argument('-s', '--summary',
+                        type=str, default=None,
+                        help='path of a JSON file where the summary of the batch is written')
+    parser.add_argument('-d', '--debug',
+                        action='store_true',
+                        help='execute in debug mode')
+    opt = parser.parse_args()
+
+    if not opt.debug:
+        logger.remove()
+        logger.add(sys.stderr, level="INFO")
+
+    defaults = {'resume': opt.resume}
+    if opt.output_path:
+        defaults['output_path'] = opt.output_path
+    jobs = read_manifest(opt.manifest, defaults)
+
+    start = time.perf_counter()
+    results = run_batch(jobs, opt.processes)
+    summary = summarize(results, time.perf_counter() - start)
+    logger.info('Batch summary:\n{}', format_summary(summary))
+
+    if opt.summary:
+        with open(opt.summary, 'w') as summary_file:
+            json.dump(summary, summary_file, indent=2)
+
+    sys.exit(1 if summary['failed'] else 0)
@@ -0,0 +1,226 @@
+""" Measures the speed and the peak memory of the geo-referencing hot path on synthetic inputs.
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.geo_referencing --width 1920 --height 1080 --frames 600 --workers 4 > before.json
+
+A deterministic video, written with `cv2.VideoWriter`, and a GPX track recorded during it are generated
+in a temporary folder. Then every case runs in its own interpreter, so the peak RSS of one does not
+affect the others, and the best of `--repeat` runs is reported:
+ - `gpx_parsing`: reads the GPX file into a track.
+ - `matching`: matches the frame times with the track, and interpolates them if `--interpolation` is set.
+ - `geo_reference`: extracts and tags the frames of the whole video.
+ - `extract_n_frames`: extracts the frames of the whole video without GPS information.
+
+The same arguments generate the same inputs, so the JSON of two commits can be compared directly.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from benchmarks.gpx_parsing import write_synthetic_gpx
+
+CASES = ('gpx_parsing', 'matching', 'geo_reference', 'extract_n_frames')
+
+VIDEO_START = datetime.datetime(2021, 5, 1, 10, 0, 0)
+
+# Side of the squares of the synthetic texture, in pixels of a 1920 pixels wide frame
+TEXTURE_CELL = 16
+
+
+def write_synthetic_video(path: Path, num_frames: int, width: int, height: int, fps: float, seed: int = 0) -> None:
+    """ Writes a video panning over a random texture, which is expensive to encode as a real scene is.
+
+    :param path: path of the video, `.mp4`.
+    :param num_frames: number of frames.
+    :param width: width of the frames.
+    :param height: height of the frames.
+    :param fps: frame rate of the container.
+    :param seed: seed of the texture.
+    """
+    rng = np.random.default_rng(seed)
+    cell = max(1, TEXTURE_CELL * width // 1920)
+    cells = rng.integers(0, 256, size=(2 * height // cell + 1, 2 * width // cell + 1, 3), dtype=np.uint8)
+    texture = cv2.resize(cells, (cells.shape[1] * cell, cells.shape[0] * cell), interpolation=cv2.INTER_NEAREST)
+    texture = cv2.GaussianBlur(texture, (0, 0), 1)
+
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f'The video {path} could not be written.')
+    max_x, max_y = texture.shape[1] - width, texture.shape[0] - height
+    for i in range(num_frames):
+        # Diagonal pan bouncing on the borders of the texture
+        x = (7 * i) % (2 * max_x) if max_x else 0
+        y = (3 * i) % (2 * max_y) if max_y else 0
+        x, y = min(x, 2 * max_x - x), min(y, 2 * max_y - y)
+        writer.write(np.ascontiguousarray(texture[y:y + height, x:x + width]))
+    writer.release()
+
+
+def generate_inputs(directory: Path, opt: argparse.Namespace) -> tuple:
+    """ Generates the video and the GPX file of the benchmark.
+
+    The video is named with its start time, as the action cam does, and the track covers it with a
+    margin at both sides. The GPX times are UTC, so they are shifted by the time zone of the machine.
+    """
+    from src.cam_geo_referencer import VIDEO_TIME_FORMAT
+    from src.gpx_reader import local_utc_offset
+
+    video_path = Path(directory, f'{VIDEO_START.strftime(VIDEO_TIME_FORMAT)}.mp4')
+    write_synthetic_video(video_path, opt.frames, opt.width, opt.height, opt.fps, opt.seed)
+
+    margin = 60
+    duration = opt.frames * opt.time_lapse + 2 * margin
+    gpx_start = VIDEO_START - datetime.timedelta(seconds=margin + local_utc_offset())
+    gpx_path = Path(directory, 'track.gpx')
+    write_synthetic_gpx(gpx_path, int(duration * opt.gpx_rate), rate=opt.gpx_rate, start=gpx_start,
+                        gap_every=opt.gap_every, gap_length=opt.gap_length)
+    return video_path, gpx_path
+
+
+def run_case(case: str, opt: argparse.Namespace) -> dict:
+    """ Runs a case once and returns the measurements. """
+    from loguru import logger
+    logger.remove()
+
+    from src.cam_geo_referencer import ActionCamGeoReferencer, VIDEO_TIME_FORMAT
+    from src.gpx_matcher import GpxMatcher
+    from src.gpx_reader import read_gpx
+    from src.gpx_track import to_epoch
+
+    result = {'case': case}
+    if case == 'gpx_parsing':
+        start = time.perf_counter()
+        track = read_gpx(opt.gpx)
+        elapsed = time.perf_counter() - start
+        result.update(points=len(track), points_per_second=round(len(track) / elapsed, 1))
+
+    elif case == 'matching':
+        track = read_gpx(opt.gpx)
+        video_start = to_epoch(datetime.datetime.strptime(Path(opt.video).stem, VIDEO_TIME_FORMAT))
+        frame_times = video_start + opt.time_lapse * np.arange(opt.frames)
+        start = time.perf_counter()
+        if opt.interpolation:
+            positions = track.interpolate(frame_times, opt.max_gap, opt.interpolation)
+        else:
+            positions = track.take(GpxMatcher(track).match(frame_times))
+        elapsed = time.perf_counter() - start
+        result.update(frames=len(frame_times), located=int(np.count_nonzero(positions.valid)),
+                      frames_per_second=round(len(frame_times) / elapsed, 1))
+
+    else:
+        converter = ActionCamGeoReferencer(opt.video, opt.gpx, time_lapse=opt.time_lapse, output_path=opt.output,
+                                           decoder=opt.decoder, show_progress=False)
+        start = time.perf_counter()
+        if case == 'geo_reference':
+            converter.geo_reference(workers=opt.workers, interpolation=opt.interpolation, max_gap=opt.max_gap,
+                                    frame_interval=opt.frame_interval)
+        else:
+            converter.extract_n_frames(opt.frames)
+        elapsed = time.perf_counter() - start
+        writer = converter.frame_writer
+        result.update(frames=opt.frames, frames_written=writer.frames_written, bytes_written=writer.bytes_written,
+                      frames_per_second=round(opt.frames / elapsed, 2))
+
+    result.update(seconds=round(elapsed, 4),
+                  peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1))
+    return result
+
+
+def run_isolated(case: str, opt: argparse.Namespace, video_path: Path, gpx_path: Path, output: Path) -> dict:
+    """ Runs a case in a new interpreter and returns its measurements or its error. """
+    arguments = [sys.executable, '-m', 'benchmarks.geo_referencing', '--run', case, '--video', str(video_path),
+                 '--gpx', str(gpx_path), '--output', str(output)]
+    for name in ('frames', 'time_lapse', 'workers', 'frame_interval', 'max_gap', 'decoder', 'interpolation'):
+        value = getattr(opt, name)
+        if value is not None:
+            arguments += [f'--{name.replace("_", "-")}', str(value)]
+
+    process = subprocess.run(arguments, capture_output=True, text=True)
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines() or ['unknown error']
+        return {'case': case, 'error': lines[-1]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def environment() -> dict:
+    """ Versions and machine the results were measured with. """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit,
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1920, help='width of the synthetic video')
+    parser.add_argument('--height', type=int, default=1080, help='height of the synthetic video')
+    parser.add_argument('--fps', type=float, default=30.0, help='frame rate of the container of the synthetic video')
+    parser.add_argument('--frames', type=int, default=300, help='number of frames of the synthetic video')
+    parser.add_argument('--time-lapse', type=float, default=1.0, help='seconds between frames of the video')
+    parser.add_argument('--gpx-rate', type=float, default=1.0, help='GPX points per second')
+    parser.add_argument('--gap-every', type=float, default=0, help='seconds of track between GPX gaps, 0 for none')
+    parser.add_argument('--gap-length', type=float, default=0, help='seconds without GPX points of every gap')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic texture')
+    parser.add_argument('--cases', nargs='+', default=list(CASES), choices=CASES)
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every case, the fastest one is reported')
+    parser.add_argument('--workers', type=int, default=0, help='workers of geo_reference')
+    parser.add_argument('--frame-interval', type=float, default=0, help='frame interval of geo_reference')
+    parser.add_argument('--interpolation', type=str, default=None, choices=('linear', 'great-circle'))
+    parser.add_argument('--max-gap', type=float, default=5.0)
+    parser.add_argument('--decoder', type=str, default='opencv')
+    parser.add_argument('--keep', type=str, default=None, help='folder where the inputs and outputs are kept')
+    parser.add_argument('--run', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--video', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--gpx', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--output', type=str, default=None, help=argparse.SUPPRESS)
+    opt = parser.parse_args()
+
+    if opt.run:
+        print(json.dumps(run_case(opt.run, opt)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        directory = Path(opt.keep or tmp_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        video_path, gpx_path = generate_inputs(directory, opt)
+
+        results = []
+        for case in opt.cases:
+            runs = [run_isolated(case, opt, video_path, gpx_path, Path(directory, 'output', f'{case}_{i}'))
+                    for i in range(max(1, opt.repeat))]
+            failed = [run for run in runs if 'error' in run]
+            if failed:
+                results.append(failed[0])
+                continue
+            best = min(runs, key=lambda run: run['seconds'])
+            best['all_seconds'] = [run['seconds'] for run in runs]
+            results.append(best)
+
+    inputs = {name: getattr(opt, name) for name in ('width', 'height', 'fps', 'frames', 'time_lapse', 'gpx_rate',
+                                                     'gap_every', 'gap_length', 'seed', 'workers', 'frame_interval',
+                                                     'interpolation', 'max_gap', 'decoder', 'repeat')}
+    print(json.dumps({'environment': environment(), 'inputs': inputs, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+""" Compares the speed and the peak memory of the GPX parsers.
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.gpx_parsing --points 1000000
+
+Every parser runs in its own interpreter so the peak RSS of one does not affect the others.
+"""
+import argparse
+import datetime
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PARSERS = ('read_gpx', 'mapillary', 'gpxpy')
+
+
+def write_synthetic_gpx(path: Path, num_points: int, rate: float = 1.0, segments: int = 4,
+                        start: datetime.datetime = datetime.datetime(2021, 5, 1, 8, 0, 0), gap_every: float = 0,
+                        gap_length: float = 0) -> None:
+    """ Writes a GPX file with `num_points` points split in several segments.
+
+    :param gap_every: seconds of track between two gaps without points, 0 for no gaps.
+    :param gap_length: seconds without points of every gap.
+    """
+    points_per_segment = max(1, num_points // segments)
+    with open(path, 'w') as gpx_file:
+        gpx_file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                       '<gpx version="1.1" creator="benchmark" xmlns="http://www.topografix.com/GPX/1/1">\n'
+                       '<trk><name>benchmark</name>\n<trkseg>\n')
+        for i in range(num_points):
+            if i and i % points_per_segment == 0:
+                gpx_file.write('</trkseg>\n<trkseg>\n')
+            seconds = i / rate
+            if gap_every > 0 and gap_length > 0 and seconds % (gap_every + gap_length) >= gap_every:
+                continue
+            timestamp = start + datetime.timedelta(seconds=seconds)
+            gpx_file.write(f'<trkpt lat="{40.0 + i * 1e-6:.7f}" lon="{-3.0 - i * 1e-6:.7f}">'
+                           f'<ele>{600 + (i % 100) * 0.1:.1f}</ele>'
+                           f'<time>{timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]}Z</time></trkpt>\n')
+        gpx_file.write('</trkseg>\n</trk>\n</gpx>\n')
+
+
+def run_parser(parser: str, path: str) -> dict:
+    """ Parses the file with the given parser and returns the measurements. """
+    start = time.perf_counter()
+    if parser == 'read_gpx':
+        from src.gpx_reader import read_gpx
+        num_points = len(read_gpx(path))
+    elif parser == 'mapillary':
+        from mapillary_tools.gps_parser import get_lat_lon_time_from_gpx
+        num_points = len(get_lat_lon_time_from_gpx(path))
+    else:
+        import gpxpy
+        with open(path) as gpx_file:
+            gpx = gpxpy.parse(gpx_file)
+        num_points = sum(len(segment.points) for track in gpx.tracks for segment in track.segments)
+    elapsed = time.perf_counter() - start
+
+    return {'parser': parser,
+            'points': num_points,
+            'seconds': round(elapsed, 4),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=200000, help='number of points of the synthetic GPX')
+    parser.add_argument('--gpx', type=str, default=None, help='existing GPX file to use instead')
+    parser.add_argument('--parsers', nargs='+', default=list(PARSERS), choices=PARSERS)
+    parser.add_argument('--run', type=str, default=None, help=argparse.SUPPRESS)
+    opt = parser.parse_args()
+
+    if opt.run:
+        print(json.dumps(run_parser(opt.run, opt.gpx)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gpx_path = opt.gpx
+        if not gpx_path:
+            gpx_path = str(Path(tmp_dir, 'synthetic.gpx'))
+            write_synthetic_gpx(Path(gpx_path), opt.points)
+
+        results = []
+        for name in opt.parsers:
+            process = subprocess.run([sys.executable, '-m', 'benchmarks.gpx_parsing', '--run', name, '--gpx', gpx_path],
+                                     capture_output=True, text=True)
+            if process.returncode != 0:
+                results.append({'parser': name, 'error': process.stderr.strip().splitlines()[-1]})
+            else:
+                results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    print(json.dumps({'gpx': opt.gpx or f'synthetic ({opt.points} points)', 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,21 @@
 # Press the green button in the gutter to run the script.
 import argparse
-import subprocess
 import sys
 
 from loguru import logger
 
 from src.cam_geo_referencer import ActionCamGeoReferencer
+from src.coverage import CoverageIndex
+from src.frame_pipeline import FrameCollector
+from src.frame_quality import DEFAULT_MIN_SHARPNESS, DEFAULT_MIN_BRIGHTNESS
+from src.frame_writer import ENCODING_PROFILES, DEFAULT_ENCODING_PROFILE, parse_crop
+from src.gpx_cache import GpxCache
+from src.gpx_library import resolve_gpx_path
+from src.gpx_track import INTERPOLATION_MODES
+from src.stage_metrics import StageMetrics
+from src.sync_estimator import DEFAULT_MAX_OFFSET
+from src.upload_stage import upload_frames
+from src.video_decoder import DECODER_BACKENDS, OPENCV_BACKEND
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -14,7 +24,8 @@ if __name__ == '__main__':
                         help='path of the video to be processed')
     parser.add_argument('gpx',
                         type=str,
-                        help='path of the GPX file to be processed')
+                        help='path of the GPX file to be processed or of a folder with GPX files, where the one '
+                             'recorded during the video is chosen')
     parser.add_argument('-o', '--output-path',
                         type=str, default=None,
                         help='path of the GPX file to be processed')
@@ -25,7 +36,48 @@ if __name__ == '__main__':
                         help='only extracts the video frames')
     parser.add_argument('-u', '--upload',
                         action='store_true',
-                        help='upload to Mapillary and Karta View')
+                        help='upload to Mapillary and Karta View at the same time once the video is processed. '
+                             'Karta View is uploaded from this process, Mapillary with the `mapillary_tools '
+                             'process_and_upload` command, which has to be installed')
+    parser.add_argument('--spread',
+                        action='store_true',
+                        help='with --extract, extract the frames evenly spaced across the whole video instead of '
+                             'from its start, seeking to every frame')
+    parser.add_argument('--stream-upload',
+                        action='store_true',
+                        help='upload every frame to Karta View as soon as it is written, while the rest of the video '
+                             'is processed')
+    parser.add_argument('--delete-uploaded',
+                        action='store_true',
+                        help='delete the frames once they are uploaded to Karta View with --stream-upload')
+    parser.add_argument('--container',
+                        action='store_true',
+                        help='append the frames to a single uncompressed tar file, frames.tar, with an index of their '
+                             'offsets, instead of writing a file per frame. The Karta View upload scripts read the '
+                             'frames from it')
+    parser.add_argument('--no-gpx-cache',
+                        action='store_true',
+                        help='parse the GPX file without using the cache of parsed tracks')
+    parser.add_argument('--clear-gpx-cache',
+                        action='store_true',
+                        help='remove all the parsed tracks from the cache before processing')
+    parser.add_argument('--no-record-coverage',
+                        action='store_true',
+                        help='do not record the road cells of the frames in the local coverage grid used by '
+                             '--skip-covered-days, ~/.local/share/action_cam_2_street_view/coverage.npz. By default, '
+                             'it is updated after every completed run')
+    parser.add_argument('-r', '--resume',
+                        action='store_true',
+                        help='continue an interrupted run with the same options from the checkpoint in the output '
+                             'path, skipping the frames already written')
+    parser.add_argument('--no-estimate-sync',
+                        action='store_true',
+                        help='do not estimate the synchronization error when --sync-error is not given, use 0 seconds. '
+                             'By default, it is estimated correlating the motion in the video with the speed in the '
+                             'GPX file, decoding the start of the video once before processing it')
+    parser.add_argument('--stats',
+                        action='store_true',
+                        help='measure the time spent in every processing stage and print a summary table at the end')
     parser.add_argument('-d', '--debug',
                         action='store_true',
                         help='execute in debug mode')
@@ -35,21 +87,108 @@ if __name__ == '__main__':
                         type=int, default=1,
                         help='time between frames in the video')
     parser.add_argument('-se', '--sync-error',
-                        type=int, default=0,
-                        help='synchronization error between the video and gpx file in seconds')
+                        type=float, default=None,
+                        help='synchronization error between the video and gpx file in seconds. By default, it is '
+                             'estimated from the video, or 0 with --no-estimate-sync')
+    parser.add_argument('--max-sync-error',
+                        type=float, default=DEFAULT_MAX_OFFSET,
+                        help='maximum synchronization error searched when it is estimated, in seconds')
     parser.add_argument('-f', '--num-frames',
                         type=int, default=50,
                         help='Number of frames to extract from the video file. Only when --extract is True')
+    parser.add_argument('--offsets',
+                        type=float, nargs='+', default=None,
+                        help='Seconds of video time of the frames to extract with --extract, seeking to every frame, '
+                             'instead of --num-frames')
     parser.add_argument('-sf', '--skip-frames',
                         type=int, default=0,
                         help='Number of frames to skip from the video file')
     parser.add_argument('-sp', '--skip-points',
                         type=int, default=0,
                         help='Number of points to skip from the GPX file')
+    parser.add_argument('-w', '--workers',
+                        type=int, default=0,
+                        help='Number of threads encoding frames and writing their EXIF while the video is decoded. '
+                             'With --spread or --offsets, number of processes seeking the frames. By default, 0, '
+                             'the frames are processed sequentially')
+    parser.add_argument('--segments',
+                        type=int, default=0,
+                        help='Number of processes decoding a segment of the video each, starting at a keyframe. The '
+                             'frames written are the same as with a single decoder. By default, 0, the video is '
+                             'decoded in a single process')
+    parser.add_argument('-i', '--interpolation',
+                        type=str, default=None, choices=INTERPOLATION_MODES,
+                        help='Interpolate the position of every frame between the GPX points instead of '
+                             'using the closest point')
+    parser.add_argument('--max-gap',
+                        type=float, default=5.0,
+                        help='Maximum seconds between two GPX points to interpolate a position between them')
+    parser.add_argument('-fi', '--frame-interval',
+                        type=float, default=0,
+                        help='Minimum seconds of video time between extracted frames. The frames in between '
+                             'are skipped without decoding them')
+    parser.add_argument('-md', '--min-distance',
+                        type=float, default=0,
+                        help='Minimum meters travelled between extracted frames. Avoids extracting the frames '
+                             'recorded while the camera is stopped')
+    parser.add_argument('--skip-covered-days',
+                        type=float, default=None,
+                        help='Skip the frames on road cells of about 20 meters already captured by other videos in '
+                             'a similar heading at most this number of days apart, according to the local coverage '
+                             'grid, which is updated with the frames of every run once the video is completely '
+                             'processed. The cells of the same video never count, so running it again or resuming it '
+                             'extracts the same frames')
+    parser.add_argument('-dt', '--duplicate-threshold',
+                        type=int, default=None,
+                        help='Drop the frames whose perceptual hash differs in at most this number of bits, out of '
+                             '64, from the last extracted frame. Around 4 drops the frames recorded while stopped')
+    parser.add_argument('-sw', '--sharpest-window',
+                        type=int, default=0,
+                        help='Also decode this number of frames at each side of every extracted frame and keep only '
+                             'the sharpest one that is well exposed. By default, 0, the frames are kept as selected')
+    parser.add_argument('--min-sharpness',
+                        type=float, default=DEFAULT_MIN_SHARPNESS,
+                        help='Minimum variance of the Laplacian of the frames chosen with --sharpest-window')
+    parser.add_argument('--min-brightness',
+                        type=float, default=DEFAULT_MIN_BRIGHTNESS,
+                        help='Minimum mean luminance, from 0 to 255, of the frames chosen with --sharpest-window')
+    parser.add_argument('--decoder',
+                        type=str, default=OPENCV_BACKEND, choices=DECODER_BACKENDS,
+                        help='Video decoder backend. The ffmpeg backend requires PyAV')
+    parser.add_argument('--decoder-threads',
+                        type=int, default=0,
+                        help='Number of decoding threads of the ffmpeg decoder. By default, chosen by ffmpeg')
+    parser.add_argument('--decoder-max-size',
+                        type=int, default=None,
+                        help='Maximum size of the longest side of the frames decoded by the ffmpeg decoder')
+    parser.add_argument('-p', '--profile',
+                        type=str, default=DEFAULT_ENCODING_PROFILE, choices=ENCODING_PROFILES.keys(),
+                        help='Encoding profile of the extracted frames: JPEG quality, maximum size and Huffman '
+                             'options. The average size and encoding time per frame are reported at the end')
+    parser.add_argument('--crop',
+                        type=parse_crop, default=None,
+                        help='Rectangle of the frames to keep as `x,y,width,height`, e.g. to remove the hood')
+    parser.add_argument('--stats-json',
+                        type=str, default=None,
+                        help='write the time spent in every processing stage and the frame counters to this JSON '
+                             'file. Implies --stats')
     parser.add_argument('--user',
                         type=str, default='adrigrillo',
                         help='Mapillary upload user')
     opt = parser.parse_args()
+    if (opt.spread or opt.offsets) and not opt.extract:
+        parser.error('--spread and --offsets require --extract')
+    if opt.skip_covered_days is not None and opt.no_record_coverage:
+        parser.error('--skip-covered-days cannot be used with --no-record-coverage')
+    if opt.container and opt.upload:
+        parser.error('--container cannot be used with --upload, Mapillary needs the frames as files. Use '
+                     '--stream-upload to upload the frames of the container to Karta View')
+    if opt.container and opt.delete_uploaded:
+        parser.error('--delete-uploaded cannot be used with --container, the frames cannot be removed from it')
+    if opt.delete_uploaded and not opt.stream_upload:
+        parser.error('--delete-uploaded requires --stream-upload')
+    if opt.delete_uploaded and opt.upload:
+        parser.error('--delete-uploaded cannot be used with --upload, the frames are needed by Mapillary')
 
     if not opt.debug:
         logger.remove()
@@ -57,39 +196,78 @@ if __name__ == '__main__':
     else:
         logger.debug('Executing in debug mode.')
 
+    gpx_cache = None
+    if not opt.no_gpx_cache:
+        gpx_cache = GpxCache()
+        if opt.clear_gpx_cache:
+            gpx_cache.clear()
+
+    metrics = StageMetrics(enabled=opt.stats or opt.stats_json is not None)
+
+    gpx_path = resolve_gpx_path(opt.video, opt.gpx, opt.time_lapse, opt.sync_error or 0, gpx_cache)
+
     converter = ActionCamGeoReferencer(video_path=opt.video,
-                                       gpx_path=opt.gpx,
+                                       gpx_path=gpx_path,
                                        time_lapse=opt.time_lapse,
-                                       output_path=opt.output_path)
+                                       output_path=opt.output_path,
+                                       gpx_cache=gpx_cache,
+                                       decoder=opt.decoder,
+                                       decoder_threads=opt.decoder_threads,
+                                       decoder_max_size=opt.decoder_max_size,
+                                       encoding_profile=ENCODING_PROFILES[opt.profile].with_crop(opt.crop),
+                                       metrics=metrics,
+                                       container=opt.container)
 
+    uploaded = True
     if opt.extract:
-        converter.extract_n_frames(opt.num_frames, opt.skip_frames)
+        converter.extract_n_frames(opt.num_frames, opt.skip_frames, frame_interval=opt.frame_interval,
+                                   spread=opt.spread, offsets=opt.offsets, workers=opt.workers)
 
     else:
+        sync_error = opt.sync_error
+        if sync_error is None:
+            sync_error = 0 if opt.no_estimate_sync else converter.estimate_sync_error(opt.max_sync_error)
+
+        # The frames uploaded after the processing are collected with their position
+        collector = FrameCollector() if opt.upload and not opt.stream_upload else None
+        frame_consumer = collector
+        if opt.stream_upload:
+            # Imported only when needed, it requires the dependencies of the upload scripts
+            from src.kartaview_upload import KartaViewStreamUploader
+            frame_consumer = KartaViewStreamUploader(converter.output_path, delete_uploaded=opt.delete_uploaded)
+
         converter.geo_reference(
-            sync_error=opt.sync_error,
+            sync_error=sync_error,
             discard_start_frames=opt.skip_frames,
-            discard_gpx_points=opt.skip_points
+            discard_gpx_points=opt.skip_points,
+            workers=opt.workers,
+            interpolation=opt.interpolation,
+            max_gap=opt.max_gap,
+            frame_interval=opt.frame_interval,
+            min_distance=opt.min_distance,
+            resume=opt.resume,
+            duplicate_threshold=opt.duplicate_threshold,
+            sharpest_window=opt.sharpest_window,
+            min_sharpness=opt.min_sharpness,
+            min_brightness=opt.min_brightness,
+            frame_consumer=frame_consumer,
+            segments=opt.segments,
+            coverage=None if opt.no_record_coverage else CoverageIndex(),
+            skip_covered_days=opt.skip_covered_days
         )
 
+        if opt.stream_upload:
+            # The failed uploads are logged when the uploader is closed
+            uploaded = frame_consumer.succeeded
         if opt.upload:
-            logger.info('Uploading processed video `{}` to Mapillary with user {}.', converter.output_path, opt.user)
-            res = subprocess.run(f'mapillary_tools process_and_upload '
-                                 f'--import_path {converter.output_path} '
-                                 f'--user_name {opt.user}',
-                                 shell=True)
-
-            if res.returncode == 0:
-                logger.info('Successfully uploaded to Mapillary.')
-            else:
-                logger.error('Error uploading data to Mapillary. Check the logs.')
-
-            logger.info('Uploading processed video `{}` to Karta View.', converter.output_path)
-            res = subprocess.run(f'python upload-scripts/osc_tools.py upload '
-                                 f'-p {converter.output_path}',
-                                 shell=True)
-
-            if res.returncode == 0:
-                logger.info('Successfully uploaded to Karta View.')
-            else:
-                logger.error('Error uploading data to Karta View. Check the logs.')
+            # The frames already streamed to Karta View are only uploaded to Mapillary
+            _, all_uploaded = upload_frames(str(converter.output_path), collector, mapillary_user=opt.user,
+                                            kartaview=not opt.stream_upload)
+            uploaded = uploaded and all_uploaded
+
+    if metrics.enabled:
+        logger.info('Time per stage:\n{}', metrics.summary())
+        if opt.stats_json:
+            metrics.write_json(opt.stats_json)
+    if not uploaded:
+        sys.exit(1)
@@ -0,0 +1,30 @@
+import contextlib
+import os
+from pathlib import Path
+from typing import IO, Iterator, Union
+
+
+@contextlib.contextmanager
+def atomic_write(path: Union[str, Path], mode: str = 'w', sync: bool = False) -> Iterator[IO]:
+    """ Opens a temporary file next to `path` that replaces it when the block ends without errors.
+
+    The temporary file has the id of the process in its name, so several processes can write the same
+    file at the same time and the readers always find a complete file, the one written last.
+
+    :param path: path of the written file.
+    :param mode: mode to open the temporary file, `w` or `wb`.
+    :param sync: flushes the file to the disk before replacing the previous one, so it survives a crash.
+    """
+    path = Path(path)
+    temporal_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    try:
+        with open(temporal_path, mode) as output_file:
+            yield output_file
+            if sync:
+                output_file.flush()
+                os.fsync(output_file.fileno())
+        os.replace(temporal_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temporal_path)
+        raise
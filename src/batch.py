@@ -0,0 +1,228 @@
+import csv
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from loguru import logger
+
+from src.cam_geo_referencer import ActionCamGeoReferencer
+from src.coverage import CoverageIndex
+from src.frame_quality import DEFAULT_MIN_SHARPNESS, DEFAULT_MIN_BRIGHTNESS
+from src.frame_writer import ENCODING_PROFILES, DEFAULT_ENCODING_PROFILE, parse_crop
+from src.gpx_cache import GpxCache
+from src.gpx_library import resolve_gpx_path
+from src.sync_estimator import DEFAULT_MAX_OFFSET
+from src.video_decoder import OPENCV_BACKEND
+
+
+def _parse_bool(value: str) -> bool:
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+# Options accepted in the manifest, with the same names as the arguments of `main.py`, and their parsers
+JOB_OPTIONS: Dict[str, Callable[[str], Any]] = {
+    'video': str,
+    # A GPX file or a folder with GPX files
+    'gpx': str,
+    'output_path': str,
+    'time_lapse': int,
+    # Estimated from the video when it is not given, or 0 with `no_estimate_sync`
+    'sync_error': float,
+    'skip_frames': int,
+    'skip_points': int,
+    'workers': int,
+    'interpolation': str,
+    'max_gap': float,
+    'frame_interval': float,
+    'min_distance': float,
+    'duplicate_threshold': int,
+    'sharpest_window': int,
+    'min_sharpness': float,
+    'min_brightness': float,
+    'skip_covered_days': float,
+    'decoder': str,
+    'decoder_threads': int,
+    'decoder_max_size': int,
+    'profile': str,
+    'crop': parse_crop,
+    'container': _parse_bool,
+    'resume': _parse_bool,
+    'no_gpx_cache': _parse_bool,
+    'no_record_coverage': _parse_bool,
+    'max_sync_error': float,
+    'no_estimate_sync': _parse_bool,
+}
+
+REQUIRED_OPTIONS = ('video', 'gpx')
+
+DONE_STATUS = 'done'
+FAILED_STATUS = 'failed'
+
+
+def read_manifest(path: Union[str, Path], defaults: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """ Reads the jobs of a batch from a CSV or JSON manifest.
+
+    A CSV manifest has a header with the names of the options, `video` and `gpx` are required and the
+    rest, see `JOB_OPTIONS`, are optional. Empty cells take the default value. A JSON manifest is a list
+    of objects with the same keys. Relative paths in the manifest are resolved from its folder.
+
+    :param path: path of the manifest.
+    :param defaults: values of the options not given in the manifest.
+    :return: options of every job.
+    """
+    path = Path(path)
+    with open(path, newline='') as manifest_file:
+        if path.suffix.lower() == '.json':
+            rows = json.load(manifest_file)
+        else:
+            rows = list(csv.DictReader(manifest_file))
+
+    jobs = []
+    for number, row in enumerate(rows, start=1):
+        unknown = set(row) - set(JOB_OPTIONS)
+        if unknown:
+            raise ValueError(f'Unknown options {sorted(unknown)} in the job {number} of {path}. '
+                             f'Available options: {list(JOB_OPTIONS)}.')
+
+        job = dict(defaults or {})
+        for name, value in row.items():
+            if value is None or value == '':
+                continue
+            job[name] = JOB_OPTIONS[name](value) if isinstance(value, str) else value
+            if name in ('video', 'gpx', 'output_path') and not Path(job[name]).is_absolute():
+                job[name] = str(Path(path.parent, job[name]))
+
+        missing = [name for name in REQUIRED_OPTIONS if name not in job]
+        if missing:
+            raise ValueError(f'The job {number} of {path} does not have {missing}.')
+        if job.get('profile', DEFAULT_ENCODING_PROFILE) not in ENCODING_PROFILES:
+            raise ValueError(f'Unknown encoding profile `{job["profile"]}` in the job {number} of {path}.')
+        if job.get('skip_covered_days') is not None and job.get('no_record_coverage'):
+            raise ValueError(f'The job {number} of {path} has `skip_covered_days` and `no_record_coverage`.')
+        jobs.append(job)
+
+    logger.info('Read {} jobs from the manifest {}.', len(jobs), path)
+    return jobs
+
+
+def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """ Geo-references the video of a job. Any error is returned in the result instead of raised.
+
+    :param job: options of the job, see `JOB_OPTIONS`.
+    :return: status, frames written, bytes written, seconds and error of the job.
+    """
+    start = time.perf_counter()
+    result = {'video': job['video'], 'gpx': job['gpx'], 'status': DONE_STATUS, 'frames': 0, 'bytes': 0,
+              'seconds': 0.0, 'error': None}
+    converter = None
+    try:
+        gpx_cache = None if job.get('no_gpx_cache') else GpxCache()
+        gpx_path = resolve_gpx_path(job['video'], job['gpx'], job.get('time_lapse', 1), job.get('sync_error', 0),
+                                    gpx_cache)
+        profile = ENCODING_PROFILES[job.get('profile', DEFAULT_ENCODING_PROFILE)].with_crop(job.get('crop'))
+        converter = ActionCamGeoReferencer(video_path=job['video'],
+                                           gpx_path=gpx_path,
+                                           time_lapse=job.get('time_lapse', 1),
+                                           output_path=job.get('output_path'),
+                                           gpx_cache=gpx_cache,
+                                           decoder=job.get('decoder', OPENCV_BACKEND),
+                                           decoder_threads=job.get('decoder_threads', 0),
+                                           decoder_max_size=job.get('decoder_max_size'),
+                                           encoding_profile=profile,
+                                           show_progress=False,
+                                           container=job.get('container', False))
+        sync_error = job.get('sync_error')
+        if sync_error is None:
+            sync_error = 0 if job.get('no_estimate_sync') \
+                else converter.estimate_sync_error(job.get('max_sync_error', DEFAULT_MAX_OFFSET))
+        coverage = None if job.get('no_record_coverage') else CoverageIndex()
+        converter.geo_reference(sync_error=sync_error,
+                                discard_start_frames=job.get('skip_frames', 0),
+                                discard_gpx_points=job.get('skip_points', 0),
+                                workers=job.get('workers', 0),
+                                interpolation=job.get('interpolation'),
+                                max_gap=job.get('max_gap', 5.0),
+                                frame_interval=job.get('frame_interval', 0),
+                                min_distance=job.get('min_distance', 0),
+                                resume=job.get('resume', False),
+                                duplicate_threshold=job.get('duplicate_threshold'),
+                                sharpest_window=job.get('sharpest_window', 0),
+                                min_sharpness=job.get('min_sharpness', DEFAULT_MIN_SHARPNESS),
+                                min_brightness=job.get('min_brightness', DEFAULT_MIN_BRIGHTNESS),
+                                coverage=coverage,
+                                skip_covered_days=job.get('skip_covered_days'))
+    except Exception as e:
+        logger.debug(traceback.format_exc())
+        result.update(status=FAILED_STATUS, error=f'{type(e).__name__}: {e}')
+
+    if converter is not None:
+        result.update(frames=converter.frame_writer.frames_written, bytes=converter.frame_writer.bytes_written,
+                      output_path=str(converter.output_path))
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_batch(jobs: List[Dict[str, Any]], processes: Optional[int] = None) -> List[Dict[str, Any]]:
+    """ Runs the jobs in a pool of processes. The failure of a job does not stop the others.
+
+    :param jobs: options of every job, see `read_manifest`.
+    :param processes: number of processes. By default, the number of CPUs.
+    :return: result of every job, in the same order as the jobs.
+    """
+    processes = max(1, min(processes or os.cpu_count() or 1, len(jobs) or 1))
+    logger.info('Processing {} jobs with {} processes.', len(jobs), processes)
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(run_job, job): i for i, job in enumerate(jobs)}
+        for finished, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                # A worker died, e.g. killed by the OOM killer, taking the pending jobs with it
+                result = {'video': jobs[i]['video'], 'gpx': jobs[i]['gpx'], 'status': FAILED_STATUS, 'frames': 0,
+                          'bytes': 0, 'seconds': 0.0, 'error': f'The worker process died: {e}'}
+            results[i] = result
+
+            if result['status'] == DONE_STATUS:
+                logger.info('[{}/{}] {} done: {} frames, {:.1f} MB in {:.1f} s.', finished, len(jobs),
+                            result['video'], result['frames'], result['bytes'] / 1e6, result['seconds'])
+            else:
+                logger.error('[{}/{}] {} failed: {}', finished, len(jobs), result['video'], result['error'])
+    return results
+
+
+def summarize(results: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+    """ Aggregates the results of a batch.
+
+    :param results: results of the jobs.
+    :param seconds: wall-clock seconds of the batch.
+    """
+    frames = sum(result['frames'] for result in results)
+    return {'jobs': len(results),
+            'done': sum(result['status'] == DONE_STATUS for result in results),
+            'failed': sum(result['status'] == FAILED_STATUS for result in results),
+            'frames': frames,
+            'bytes': sum(result['bytes'] for result in results),
+            'job_seconds': round(sum(result['seconds'] for result in results), 3),
+            'seconds': round(seconds, 3),
+            'frames_per_second': round(frames / seconds, 2) if seconds > 0 else 0.0,
+            'results': results}
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    """ Formats the summary of a batch as a table with a row per job. """
+    lines = [f'{"status":<8} {"frames":>8} {"MB":>10} {"seconds":>9}  video']
+    for result in summary['results']:
+        lines.append(f'{result["status"]:<8} {result["frames"]:>8} {result["bytes"] / 1e6:>10.1f} '
+                     f'{result["seconds"]:>9.1f}  {result["video"]}')
+    lines.append(f'{summary["done"]} of {summary["jobs"]} jobs done, {summary["failed"]} failed. '
+                 f'{summary["frames"]} frames and {summary["bytes"] / 1e6:.1f} MB written in '
+                 f'{summary["seconds"]:.1f} s ({summary["frames_per_second"]} frames/s, {summary["job_seconds"]:.1f} s of processing).')
+    return '\n'.join(lines)
@@ -1,24 +1,155 @@
 # This is a sample Python script.
 import datetime
+import functools
+import itertools
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
 
-import cv2
 import numpy as np
 from loguru import logger
-from mapillary_tools.exif_write import ExifEdit
-from mapillary_tools.gps_parser import get_lat_lon_time_from_gpx
 from tqdm import tqdm
 
+from src.checkpoint import Checkpoint
+from src.coverage import CoverageIndex, frame_headings, video_source
+from src.frame_container import FrameContainer, FRAMES_CONTAINER_NAME
+from src.frame_pipeline import FrameConsumer, FramePipeline, FrameJob
+from src.frame_quality import DuplicateFilter, SharpestFrameSelector, assign_windows, dhash, DEFAULT_MIN_SHARPNESS, \
+    DEFAULT_MIN_BRIGHTNESS
+from src.frame_sampler import FrameBufferPool, FrameSelector, sample_frames, seek_frames, split_segments, \
+    spread_frames
+from src.frame_writer import FrameWriter, EncodingProfile
+from src.gpx_cache import GpxCache
+from src.gpx_matcher import GpxMatcher
+from src.gpx_reader import read_gpx
+from src.gpx_track import GpxTrack, GpxPoint, FramePositions, from_epoch, to_epoch
+from src.stage_metrics import StageMetrics
+from src.sync_estimator import estimate_sync_error, DEFAULT_MAX_OFFSET, MIN_CORRELATION, SIGNAL_FRAME_WIDTH
+from src.video_decoder import VideoDecoder, keyframes, open_decoder, OPENCV_BACKEND, FFMPEG_BACKEND
+
 NEW_FRAME_EXTRACTED_STR = 'New frame extracted: {}.'
 
 VIDEO_TIME_FORMAT = '%Y_%m%d_%H%M%S_%f'
 
 
+def frame_file_name(frame_time: float) -> str:
+    """ File name of the frame taken at the given time, in seconds since the epoch. """
+    return f'{from_epoch(frame_time).strftime(VIDEO_TIME_FORMAT)}.jpg'
+
+
+def extract_frames_at(video_path: str, frames: Sequence[Tuple[int, str]], decoder: str = OPENCV_BACKEND,
+                      decoder_threads: int = 0, decoder_max_size: Optional[int] = None,
+                      encoding_profile: Optional[EncodingProfile] = None) -> Dict[str, Any]:
+    """ Seeks to the given frames of a video and writes them without GPS information.
+
+    It opens its own decoder, so several processes can extract different frames of the same video.
+
+    :param video_path: path of the video.
+    :param frames: sorted (frame number, image path) of the frames to extract.
+    :param decoder: decoder backend.
+    :param decoder_threads: number of decoding threads of the `ffmpeg` backend.
+    :param decoder_max_size: maximum size of the longest side of the frames of the `ffmpeg` backend.
+    :param encoding_profile: encoding profile applied to the frames.
+    :return: frame numbers extracted and bytes and encoding seconds of the written frames.
+    """
+    frame_writer = FrameWriter(encoding_profile)
+    paths = dict(frames)
+    extracted: List[int] = []
+    pool = FrameBufferPool(1)
+    cap = open_decoder(video_path, decoder, decoder_threads, decoder_max_size)
+    try:
+        for frame_num, image in seek_frames(cap, [frame_num for frame_num, _ in frames], pool):
+            frame_writer.write_image(paths[frame_num], image)
+            pool.release(image)
+            extracted.append(frame_num)
+            logger.debug(NEW_FRAME_EXTRACTED_STR, frame_num)
+    finally:
+        cap.release()
+    return {'frames': extracted, 'bytes': frame_writer.bytes_written, 'encode_seconds': frame_writer.encode_seconds}
+
+
+def reference_segment(video_path: str, output_path: str, first_frame: int, frame_times: np.ndarray,
+                      decoded: np.ndarray, positions: FramePositions, windows: Optional[np.ndarray] = None,
+                      min_sharpness: float = DEFAULT_MIN_SHARPNESS, min_brightness: float = DEFAULT_MIN_BRIGHTNESS,
+                      hashes: bool = False, decoder: str = OPENCV_BACKEND, decoder_threads: int = 0,
+                      decoder_max_size: Optional[int] = None,
+                      encoding_profile: Optional[EncodingProfile] = None) -> Dict[str, Any]:
+    """ Writes the geo-referenced frames of a segment of a video, see `ActionCamGeoReferencer.geo_reference`.
+
+    It opens its own decoder, so several processes can reference different segments of the same video.
+    The positions are already located, so the GPX track is not needed.
+
+    :param video_path: path of the video.
+    :param output_path: folder of the frames.
+    :param first_frame: frame number of the first frame of the segment.
+    :param frame_times: time of every frame of the segment in seconds since the epoch.
+    :param decoded: boolean mask with the frames of the segment to decode.
+    :param positions: position of every frame of the segment.
+    :param windows: sharpest frame window of every frame of the segment, or None to write every decoded frame.
+    :param min_sharpness: minimum variance of the Laplacian of the frames chosen in every window.
+    :param min_brightness: minimum mean luminance of the frames chosen in every window.
+    :param hashes: computes the perceptual hash of the written frames, to drop the duplicates afterwards.
+    :param decoder: decoder backend.
+    :param decoder_threads: number of decoding threads of the `ffmpeg` backend.
+    :param decoder_max_size: maximum size of the longest side of the frames of the `ffmpeg` backend.
+    :param encoding_profile: encoding profile applied to the frames.
+    :return: written frames as (frame number, path, bytes, time, position, hash), counters and statistics of the
+     frame writer and of the sharpest frame selector.
+    """
+    frame_writer = FrameWriter(encoding_profile)
+    pool = FrameBufferPool(2)
+    sharpest_selector = None
+    if windows is not None:
+        sharpest_selector = SharpestFrameSelector(min_sharpness, min_brightness,
+                                                  on_discard=lambda item: pool.release(item[3]))
+    written: List[Tuple[int, str, int, float, GpxPoint, Optional[int]]] = []
+    counters = {'skipped': 0, 'unmatched': 0, 'matched': 0}
+
+    def emit(frame_num: int, frame_time: float, gpx_point: GpxPoint, image: np.ndarray) -> None:
+        image_path = str(Path(output_path, frame_file_name(frame_time)))
+        num_bytes = frame_writer.write(image_path, image, from_epoch(frame_time), gpx_point)
+        written.append((frame_num, image_path, num_bytes, frame_time, gpx_point, dhash(image) if hashes else None))
+        pool.release(image)
+
+    cap = open_decoder(video_path, decoder, decoder_threads, decoder_max_size)
+    try:
+        cap.seek(first_frame)
+        # The frames after the end of the mask belong to the next segment
+        for position, image in itertools.islice(sample_frames(cap, decoded, pool), len(decoded)):
+            if image is None:
+                counters['skipped'] += 1
+                continue
+            gpx_point = positions.point(position)
+            if not gpx_point:
+                pool.release(image)
+                counters['unmatched'] += 1
+                continue
+            counters['matched'] += 1
+
+            item = (first_frame + position, float(frame_times[position]), gpx_point, image)
+            chosen = item if sharpest_selector is None else sharpest_selector.offer(windows[position], item, image)
+            if chosen is not None:
+                emit(*chosen)
+        if sharpest_selector is not None:
+            chosen = sharpest_selector.flush()
+            if chosen is not None:
+                emit(*chosen)
+    finally:
+        cap.release()
+
+    return {'frames': len(decoded), 'written': written, 'counters': counters,
+            'encode_seconds': frame_writer.encode_seconds,
+            'windows': sharpest_selector.windows if sharpest_selector is not None else 0,
+            'rejected_windows': sharpest_selector.rejected_windows if sharpest_selector is not None else 0}
+
+
 class ActionCamGeoReferencer:
 
-    def __init__(self, video_path: str, gpx_path: str, time_lapse: int = 1, output_path: str = None):
+    def __init__(self, video_path: str, gpx_path: str, time_lapse: int = 1, output_path: str = None,
+                 gpx_cache: Optional[GpxCache] = None, decoder: str = OPENCV_BACKEND, decoder_threads: int = 0,
+                 decoder_max_size: Optional[int] = None, encoding_profile: Optional[EncodingProfile] = None,
+                 show_progress: bool = True, metrics: Optional[StageMetrics] = None, container: bool = False):
         self.video_path = Path(video_path)
         if not self.video_path.is_file():
             raise FileNotFoundError(f'The video could not be found. Search path: {video_path}.')
@@ -26,9 +157,26 @@ class ActionCamGeoReferencer:
         self.gpx_path = Path(gpx_path)
         if not self.gpx_path.is_file():
             raise FileNotFoundError(f'The gpx file could not be found. Search path: {gpx_path}.')
-        self.gpx_data = self.parse_gpx()
+        self.gpx_cache = gpx_cache
+        self.gpx_track = self.parse_gpx()
+        self.gpx_matcher = GpxMatcher(self.gpx_track)
 
         self.time_lapse = time_lapse
+        # Disabled metrics cost a couple of attribute lookups per frame
+        self.metrics = metrics if metrics is not None else StageMetrics(enabled=False)
+
+        self.decoder = decoder
+        self.decoder_threads = decoder_threads
+        self.decoder_max_size = decoder_max_size
+        self.show_progress = show_progress
+
+        if encoding_profile is not None and encoding_profile.crop is not None:
+            # Checked before processing, an invalid crop would fail when encoding the first frame
+            cap = self.open_video()
+            try:
+                encoding_profile.check_crop(*cap.frame_size)
+            finally:
+                cap.release()
 
         if not output_path:
             self.output_path = Path(self.video_path.parent.parent, 'output', self.video_path.stem)
@@ -39,63 +187,83 @@ class ActionCamGeoReferencer:
         if not self.output_path.exists():
             os.makedirs(self.output_path)
 
-    @staticmethod
-    def save_image(path: str, image: np.ndarray, jpg_quality: int = 100) -> None:
-        """ Saves the image allowing to adjust the quality of the saving.
+        # The frames are appended to a single file instead of written to a file each
+        self.frame_container = FrameContainer(Path(self.output_path, FRAMES_CONTAINER_NAME)) if container else None
+        self.frame_writer = FrameWriter(encoding_profile, metrics=self.metrics, container=self.frame_container)
 
-        :param path: path where the image will be saved.
-        :param image: image data.
-        :param jpg_quality: int between 0 and 100 where higher means better. Default is 95.
-        """
-        logger.trace('Saving image in `{}`', path)
-        if 0 <= jpg_quality <= 100:
-            cv2.imwrite(path, image, [int(cv2.IMWRITE_JPEG_QUALITY), jpg_quality])
-        else:
-            cv2.imwrite(path, image)
-
-    def parse_gpx(self) -> List[Tuple[datetime.datetime, float, float, float]]:
-        return get_lat_lon_time_from_gpx(self.gpx_path)
-
-    def get_matching_gpx_point(self, timestamp: datetime.datetime) -> Optional[Tuple[datetime.datetime,
-                                                                                     float, float, float]]:
-        index, best_index = 0, None
-        time_diff = datetime.timedelta(seconds=1)
-        diff_reduced = True
-        while diff_reduced and index < len(self.gpx_data):
-            gpx_timestamp = self.gpx_data[index][0]
-
-            # Always the later time minus the earlier one
-            check_next = False
-            if timestamp <= gpx_timestamp:
-                diff = gpx_timestamp - timestamp
-            else:
-                diff = timestamp - gpx_timestamp
-                check_next = True
-
-            logger.trace('Difference between timestamps: {}.{} seconds.', diff.seconds, diff.microseconds)
+    def open_video(self) -> VideoDecoder:
+        """ Opens the video with the decoder backend selected in the constructor. """
+        return open_decoder(self.video_path, self.decoder, self.decoder_threads, self.decoder_max_size)
 
-            if time_diff >= diff:
-                logger.debug('Reduced time difference between frame and gpx. New time: {} seconds.', diff.seconds)
-                time_diff = diff
-                diff_reduced = True
-                best_index = index
-            elif not check_next:
-                logger.trace('Time difference not reduced. Exiting from while.')
-                diff_reduced = False
+    def frame_path(self, frame_time: float) -> Path:
+        """ Path of the frame taken at the given time, in seconds since the epoch. """
+        if self.frame_container is not None:
+            return self.frame_container.frame_path(frame_file_name(frame_time))
+        return Path(self.output_path, frame_file_name(frame_time))
 
-            index += 1
+    def parse_gpx(self) -> GpxTrack:
+        if self.gpx_cache is not None:
+            return self.gpx_cache.read(self.gpx_path)
+        return read_gpx(self.gpx_path)
 
-        if best_index is not None:
-            # Remove elements before the taken point
-            self.gpx_data = self.gpx_data[best_index:]
+    def estimate_sync_error(self, max_offset: float = DEFAULT_MAX_OFFSET,
+                            min_correlation: float = MIN_CORRELATION) -> float:
+        """ Estimates the `sync_error` of the video correlating its motion with the speed of the GPX track.
 
-            logger.debug('Suitable GPX point found.')
-            return self.gpx_data.pop(0)
-        else:
-            logger.debug('No suitable GPX point found.')
-            return None
+        A single pass over the start of the video is made decoding a frame per second into a thumbnail,
+        see `src.sync_estimator`.
 
-    def geo_reference(self, sync_error: float = 0, discard_start_frames: int = 0, discard_gpx_points: int = 0) -> None:
+        :param max_offset: maximum synchronization error searched, in seconds.
+        :param min_correlation: minimum correlation to accept the estimation.
+        :return: the estimated synchronization error in seconds, or 0 if it is not reliable.
+        """
+        video_creation_time = datetime.datetime.strptime(self.video_path.stem, VIDEO_TIME_FORMAT)
+        # The ffmpeg decoder can produce the thumbnails directly
+        max_size = SIGNAL_FRAME_WIDTH if self.decoder == FFMPEG_BACKEND else None
+        cap = open_decoder(self.video_path, self.decoder, self.decoder_threads, max_size)
+        try:
+            sync_error, correlation = estimate_sync_error(cap, self.gpx_track, to_epoch(video_creation_time),
+                                                          self.time_lapse, max_offset)
+        finally:
+            cap.release()
+
+        if correlation < min_correlation:
+            logger.warning('The synchronization error could not be estimated reliably (correlation {:.2f}), '
+                           'using 0 seconds.', correlation)
+            return 0.0
+        logger.info('Estimated synchronization error of {:.2f} seconds (correlation {:.2f}).', sync_error, correlation)
+        return round(sync_error, 3)
+
+    def locate_frames(self, frame_times: np.ndarray, interpolation: Optional[str] = None,
+                      max_gap: float = 5.0) -> FramePositions:
+        """ Computes the position of a batch of frames.
+
+        By default, every frame takes the coordinates of its matching GPX point, see `GpxMatcher`.
+        With an interpolation mode, the position of every frame is interpolated between the GPX points
+        around its timestamp.
+
+        :param frame_times: timestamps of the frames in seconds since the epoch.
+        :param interpolation: `linear`, `great-circle` or None to match the frames with the GPX points.
+        :param max_gap: maximum seconds between the GPX points used to interpolate a position.
+        """
+        if not interpolation:
+            return self.gpx_track.take(self.gpx_matcher.match(frame_times))
+
+        positions = self.gpx_track.interpolate(frame_times, max_gap, interpolation)
+        if self.gpx_matcher.cursor > 0:
+            # Discarded GPX points cannot be used for the interpolation
+            first_time = self.gpx_track.times[min(self.gpx_matcher.cursor, len(self.gpx_track) - 1)]
+            positions.valid &= np.asarray(frame_times) >= first_time
+        return positions
+
+    def geo_reference(self, sync_error: float = 0, discard_start_frames: int = 0, discard_gpx_points: int = 0,
+                      workers: int = 0, interpolation: Optional[str] = None, max_gap: float = 5.0,
+                      frame_interval: float = 0, min_distance: float = 0, resume: bool = False,
+                      duplicate_threshold: Optional[int] = None, sharpest_window: int = 0,
+                      min_sharpness: float = DEFAULT_MIN_SHARPNESS,
+                      min_brightness: float = DEFAULT_MIN_BRIGHTNESS,
+                      frame_consumer: Optional[FrameConsumer] = None, segments: int = 0,
+                      coverage: Optional[CoverageIndex] = None, skip_covered_days: Optional[float] = None) -> None:
         """ Read the video from the action cam frame by frame adding the GPS information.
 
         The GPS data is retrieved by matching the point from the GPX file with the lowest
@@ -116,81 +284,485 @@ class ActionCamGeoReferencer:
          It could be a negative number.
         :param discard_start_frames: number of frames to discard from the video.
         :param discard_gpx_points: number of GPX points to discard from the file.
+        :param workers: number of threads used to encode the frames and to write their EXIF while the
+         video is decoded. With 0, the frames are decoded, encoded and tagged sequentially.
+        :param interpolation: `linear` or `great-circle` to interpolate the position of every frame
+         instead of taking the coordinates of the closest GPX point.
+        :param max_gap: maximum seconds between two GPX points to interpolate a position between them.
+        :param frame_interval: minimum seconds of video time between two extracted frames. The frames
+         that are not extracted are skipped without decoding them.
+        :param min_distance: minimum meters travelled, according to the GPX track, between two
+         extracted frames. Useful to avoid extracting the frames recorded while stopped.
+        :param resume: continues a previous run with the same parameters from the checkpoint in the
+         output folder, skipping the frames already written.
+        :param duplicate_threshold: drops the frames whose perceptual hash differs in at most this number
+         of bits, out of 64, from the last extracted frame. None to keep them. After resuming, the first
+         frame is always kept.
+        :param sharpest_window: number of frames at each side of every frame to extract that are also
+         decoded, emitting only the sharpest one that is not too dark. 0 to emit the frames as selected.
+        :param min_sharpness: minimum variance of the Laplacian of the frames emitted with `sharpest_window`.
+        :param min_brightness: minimum mean luminance, from 0 to 255, of the frames emitted with `sharpest_window`.
+        :param frame_consumer: receives every frame as soon as it is written, e.g. to upload it while the
+         rest of the video is processed. It is closed when the processing ends.
+        :param segments: number of processes decoding the video at the same time, each one a segment of it
+         starting at a keyframe. The frames are merged in order, so the result is the same as with a single
+         decoder. With 0 or 1, the video is decoded in this process.
+        :param coverage: grid of the road cells already captured. The cells of the frames are added to it and
+         saved when the video is completely processed.
+        :param skip_covered_days: skips the frames whose cell was captured by another video in a similar heading
+         at most this number of days apart from them, according to `coverage`. None to extract them.
         """
-        # Get the start time from the video file name
+        metrics = self.metrics
+        started_total = metrics.start()
+        checkpoint = Checkpoint(self.output_path, self.checkpoint_parameters(
+            sync_error=sync_error, discard_start_frames=discard_start_frames, discard_gpx_points=discard_gpx_points,
+            interpolation=interpolation, max_gap=max_gap, frame_interval=frame_interval, min_distance=min_distance,
+            duplicate_threshold=duplicate_threshold, sharpest_window=sharpest_window, min_sharpness=min_sharpness,
+            min_brightness=min_brightness, skip_covered_days=skip_covered_days if coverage is not None else None),
+            container=self.frame_container)
+        removed = frame_consumer.removed_frames() if frame_consumer is not None else ()
+        if resume and checkpoint.restore(removed) and checkpoint.finished:
+            logger.info('The video was already processed, {} frames in {}.', len(checkpoint.frames), self.output_path)
+            if frame_consumer is not None:
+                frame_consumer.close(complete=True)
+            return
+        if not checkpoint.frames:
+            # Resets the manifest and the container of any previous run
+            checkpoint.write()
+            if self.frame_container is not None:
+                self.frame_container.reset()
+        if segments > 1 and self.frame_container is not None:
+            logger.warning('The frames of a container are written by a single process, the video is not decoded '
+                           'in segments.')
+            segments = 0
+
+        # Get the start time from the video file name. The frame times are seconds since the epoch,
+        # they are only converted to dates when the frames are written
         video_creation_time = datetime.datetime.strptime(self.video_path.stem, VIDEO_TIME_FORMAT)
-        if sync_error != 0:
-            video_creation_time += datetime.timedelta(seconds=sync_error)
+        video_start = to_epoch(video_creation_time) + sync_error
 
         # Remove the gpx points desired
         if discard_gpx_points > 0:
-            self.gpx_data = self.gpx_data[discard_gpx_points:]
+            self.gpx_matcher.skip(discard_gpx_points)
 
         # Go through the video using matching timestamp for frame and gpx
         frame_num = 0
-        cap = cv2.VideoCapture(str(self.video_path))
+        cap = self.open_video()
         if discard_start_frames > 0:
             frame_num = discard_start_frames - 1
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+            cap.seek(frame_num)
 
-        number_of_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        number_of_frames = cap.frame_count
         logger.info('The video has {} frames from which {} are skipped.', number_of_frames, discard_start_frames)
-        pbar = tqdm(total=number_of_frames - discard_start_frames, unit='frames')
-        success, image = cap.read()
-        while success:
-            # 1. Calculate frame timestamp
-            frame_timestamp = video_creation_time + datetime.timedelta(seconds=self.time_lapse * frame_num)
-
-            # 2. Match with gpx and add data
-            gpx_point = self.get_matching_gpx_point(frame_timestamp)
-            if not gpx_point:
-                success, image = cap.read()
-                logger.debug(NEW_FRAME_EXTRACTED_STR, success)
-                frame_num += 1
-                continue
+        pbar = tqdm(total=number_of_frames - discard_start_frames, unit='frames', disable=not self.show_progress)
+
+        # Locate all the frames announced by the container in a single pass
+        first_frame = frame_num
+        frame_times = video_start + self.time_lapse * np.arange(first_frame, number_of_frames)
+        started = metrics.start()
+        positions = self.locate_frames(frame_times, interpolation, max_gap)
+        metrics.stop('match', started)
+
+        # The direction of travel is stored in the coverage grid and sent with the frames to the consumer
+        headings = frame_headings(positions) if coverage is not None or frame_consumer is not None else None
+
+        # The frames on the road cells already captured recently in the same direction are not extracted
+        candidates, coverage_keys = positions.valid, None
+        if coverage is not None:
+            started = metrics.start()
+            source = video_source(self.video_path)
+            coverage_keys, near_keys = coverage.cell_keys(positions, headings)
+            if skip_covered_days is not None:
+                covered = coverage.covered(coverage_keys, near_keys, frame_times, skip_covered_days, source)
+                candidates = positions.valid & ~covered
+                metrics.count('covered', int(np.count_nonzero(covered)))
+                logger.info('{} frames are on roads captured at most {} days apart from them, they are skipped.',
+                            int(np.count_nonzero(covered)), skip_covered_days)
+            metrics.stop('coverage', started)
+
+        # Only the frames that will be emitted are decoded, the rest are just grabbed
+        started = metrics.start()
+        selector = FrameSelector(frame_interval, min_distance)
+        selected = selector.select(frame_times, self.gpx_track.distance_at(frame_times), candidates)
+        metrics.stop('select', started)
+        logger.info('{} frames of the video will be extracted.', int(np.count_nonzero(selected)))
+
+        # The neighbours of the selected frames are decoded too to choose the sharpest one
+        windows, sharpest_selector, decoded = None, None, selected
+        if sharpest_window > 0:
+            windows = assign_windows(selected, candidates, sharpest_window)
+            sharpest_selector = SharpestFrameSelector(min_sharpness, min_brightness)
+            decoded = windows >= 0
+            logger.info('{} frames will be decoded to choose the sharpest ones.', int(np.count_nonzero(decoded)))
+
+        # The frames before the checkpoint are already written, the decoder seeks straight past them
+        start = max(0, checkpoint.next_frame - first_frame)
+        if windows is not None and 0 < start <= len(windows) and windows[start - 1] >= 0:
+            # The rest of the window of the last written frame was already considered
+            start = int(np.flatnonzero(windows == windows[start - 1])[-1]) + 1
+        if start > 0:
+            logger.info('Resuming from frame {}, {} frames were already written.', first_frame + start,
+                        len(checkpoint.frames))
+            cap.seek(first_frame + start)
+            pbar.update(start)
+            metrics.count('resumed', start)
+
+        duplicate_filter = DuplicateFilter(duplicate_threshold) if duplicate_threshold is not None else None
+
+        def finished(frame_num: int, image_path: str, num_bytes: int, frame_time: float, gpx_point: GpxPoint) -> None:
+            started = metrics.start()
+            checkpoint.add(frame_num, image_path, num_bytes)
+            metrics.stop('checkpoint', started)
+            if frame_consumer is not None:
+                started = metrics.start()
+                position = frame_num - first_frame
+                heading = headings[position] if position < len(headings) else np.nan
+                frame_consumer.submit(len(checkpoint.frames) - 1, str(image_path), frame_time, gpx_point,
+                                      None if np.isnan(heading) else float(heading))
+                metrics.stop('consumer', started)
+
+        # The decoded images are reused once they are encoded or discarded. One is being decoded, another
+        # one can be kept as the sharpest of its window and the rest can be waiting in the pipeline
+        pool = FrameBufferPool(2)
+        pipeline = None
+        if workers > 0:
+            pipeline = FramePipeline(encode=functools.partial(self._encode_job, pool=pool),
+                                     write_exif=self._write_exif_job, workers=workers,
+                                     on_done=lambda job: finished(*job.result, *job.payload[3:]))
+            pool.size += pipeline.capacity
+        if sharpest_selector is not None:
+            sharpest_selector.on_discard = lambda item: pool.release(item[3])
+
+        def emit(frame_num: int, frame_time: float, gpx_point: GpxPoint, image: np.ndarray) -> None:
+            if duplicate_filter is not None:
+                started = metrics.start()
+                accepted = duplicate_filter.accept(image)
+                metrics.stop('dedup', started)
+                if not accepted:
+                    pool.release(image)
+                    return
 
             # 3. Save image and add exif data
-            image_path = Path(self.output_path, f'{frame_timestamp.strftime(VIDEO_TIME_FORMAT)}.jpg')
-            self.save_image(str(image_path), image)
-
-            image_exif = ExifEdit(str(image_path))
-            image_exif.add_date_time_original(frame_timestamp)
-            image_exif.add_lat_lon(gpx_point[1], gpx_point[2])
-            image_exif.add_altitude(gpx_point[3])
-            image_exif.add_orientation(1)
-            image_exif.add_camera_make_model("apeman", "a80")
-            image_exif.write()
-
-            success, image = cap.read()
-            logger.debug(NEW_FRAME_EXTRACTED_STR, success)
-            frame_num += 1
-            pbar.update(1)
-
+            image_path = self.frame_path(frame_time)
+            if pipeline is not None:
+                # Time blocked while the workers are busy
+                started = metrics.start()
+                pipeline.submit((frame_num, str(image_path), image, frame_time, gpx_point))
+                metrics.stop('queue_wait', started)
+            else:
+                num_bytes = self.frame_writer.write(str(image_path), image, from_epoch(frame_time), gpx_point)
+                pool.release(image)
+                finished(frame_num, str(image_path), num_bytes, frame_time, gpx_point)
+
+        complete = False
+        try:
+            if segments > 1 and start < len(decoded):
+                started = metrics.start()
+                for result in self.reference_segments(segments, first_frame, start, frame_times, decoded, positions,
+                                                      windows, min_sharpness, min_brightness,
+                                                      hashes=duplicate_filter is not None):
+                    pbar.update(result['frames'])
+                    for name, value in result['counters'].items():
+                        metrics.count(name, value)
+                    if sharpest_selector is not None:
+                        sharpest_selector.windows += result['windows']
+                        sharpest_selector.rejected_windows += result['rejected_windows']
+                    self.frame_writer.add_statistics(0, 0, result['encode_seconds'])
+
+                    for frame_num, image_path, num_bytes, frame_time, gpx_point, image_hash in result['written']:
+                        # The duplicates are dropped in the same order as in a single process
+                        if duplicate_filter is not None and not duplicate_filter.accept_hash(image_hash):
+                            os.remove(image_path)
+                            continue
+                        self.frame_writer.add_statistics(1, num_bytes, 0.0)
+                        finished(frame_num, image_path, num_bytes, frame_time, gpx_point)
+                metrics.stop('segments', started)
+
+                # Only the frames after the ones announced by the container are left
+                start = len(decoded)
+                cap.seek(first_frame + start)
+
+            for position, image in metrics.timed(sample_frames(cap, decoded[start:], pool), 'decode', 'grab'):
+                position += start
+                frame_num = first_frame + position
+                pbar.update(1)
+                if image is None:
+                    metrics.count('skipped')
+                    continue
+                logger.debug(NEW_FRAME_EXTRACTED_STR, frame_num)
+
+                # 1. Calculate frame timestamp
+                frame_time = video_start + self.time_lapse * frame_num
+
+                # 2. Match with gpx and add data
+                if position < len(positions):
+                    gpx_point = positions.point(position)
+                else:
+                    # The frame count of the container was lower than the real number of frames
+                    gpx_point = self.locate_frames(np.array([frame_time]), interpolation, max_gap).point(0)
+                    if gpx_point and not selector.accept(frame_time,
+                                                         self.gpx_track.distance_at(np.array([frame_time]))[0]):
+                        pool.release(image)
+                        metrics.count('skipped')
+                        continue
+                if not gpx_point:
+                    pool.release(image)
+                    metrics.count('unmatched')
+                    continue
+                metrics.count('matched')
+
+                if sharpest_selector is None:
+                    emit(frame_num, frame_time, gpx_point, image)
+                    continue
+                # The frames after the end of the mask are windows on their own
+                window = windows[position] if position < len(windows) else len(windows) + position
+                started = metrics.start()
+                chosen = sharpest_selector.offer(window, (frame_num, frame_time, gpx_point, image), image)
+                metrics.stop('sharpness', started)
+                if chosen is not None:
+                    emit(*chosen)
+
+            if sharpest_selector is not None:
+                chosen = sharpest_selector.flush()
+                if chosen is not None:
+                    emit(*chosen)
+            complete = True
+        finally:
+            try:
+                if pipeline is not None:
+                    pipeline.close()
+            finally:
+                if self.frame_container is not None:
+                    self.frame_container.close()
+                # The frames finished until the interruption are kept for a later resume
+                checkpoint.write()
+                cap.release()
+                if frame_consumer is not None:
+                    frame_consumer.close(complete)
+
+        checkpoint.finish()
+        if coverage is not None:
+            # Every frame of the video, also the ones written before resuming
+            for frame_num, _, _ in checkpoint.frames:
+                if 0 <= frame_num - first_frame < len(coverage_keys):
+                    coverage.add(int(coverage_keys[frame_num - first_frame]), frame_times[frame_num - first_frame],
+                                 source)
+            coverage.save()
         pbar.close()
+        metrics.stop('total', started_total)
+        logger.info(self.frame_writer.summary())
+        if duplicate_filter is not None:
+            metrics.count('duplicates', duplicate_filter.dropped)
+            logger.info('{} near-duplicate frames dropped.', duplicate_filter.dropped)
+        if sharpest_selector is not None:
+            metrics.count('rejected_windows', sharpest_selector.rejected_windows)
+            logger.info('{} of {} windows rejected because all their frames were blurred or badly exposed.',
+                        sharpest_selector.rejected_windows, sharpest_selector.windows)
+
+    def reference_segments(self, segments: int, first_frame: int, start: int, frame_times: np.ndarray,
+                           decoded: np.ndarray, positions: FramePositions, windows: Optional[np.ndarray] = None,
+                           min_sharpness: float = DEFAULT_MIN_SHARPNESS, min_brightness: float = DEFAULT_MIN_BRIGHTNESS,
+                           hashes: bool = False) -> Iterator[Dict[str, Any]]:
+        """ Geo-references the located frames in segments, each one in its own process, see `reference_segment`.
+
+        :param segments: number of segments and processes.
+        :param first_frame: frame number of the first position of the arrays.
+        :param start: first position to process.
+        :param frame_times: time of every frame in seconds since the epoch.
+        :param decoded: boolean mask with the frames to decode.
+        :param positions: position of every frame.
+        :param windows: sharpest frame window of every frame, or None.
+        :param min_sharpness: minimum variance of the Laplacian of the frames chosen in every window.
+        :param min_brightness: minimum mean luminance of the frames chosen in every window.
+        :param hashes: computes the perceptual hash of the written frames.
+        :return: iterator of the results of the segments, in the order of the video.
+        """
+        frame_keyframes = keyframes(self.video_path)
+        if frame_keyframes is None:
+            logger.info('PyAV is not installed, the segments are not aligned to keyframes.')
+        else:
+            frame_keyframes = frame_keyframes - first_frame
+        bounds = split_segments(start, len(decoded), segments, frame_keyframes, windows)
+        logger.info('Processing the video in {} segments starting at the frames {}.', len(bounds),
+                    ', '.join(str(first_frame + segment_start) for segment_start, _ in bounds))
+
+        options = dict(min_sharpness=min_sharpness, min_brightness=min_brightness, hashes=hashes,
+                       decoder=self.decoder, decoder_threads=self.decoder_threads,
+                       decoder_max_size=self.decoder_max_size, encoding_profile=self.frame_writer.profile)
+        with ProcessPoolExecutor(max_workers=len(bounds)) as executor:
+            futures = [executor.submit(reference_segment, str(self.video_path), str(self.output_path),
+                                       first_frame + segment_start, frame_times[segment_start:segment_stop],
+                                       decoded[segment_start:segment_stop],
+                                       positions.segment(segment_start, segment_stop),
+                                       windows[segment_start:segment_stop] if windows is not None else None,
+                                       **options)
+                       for segment_start, segment_stop in bounds]
+            # The frames of a segment are only merged after the ones of the previous segments
+            for future in futures:
+                yield future.result()
+
+    def _encode_job(self, job: FrameJob, pool: Optional[FrameBufferPool] = None) -> None:
+        frame_num, path, image, frame_time, gpx_point = job.payload
+        # The decoded image is replaced by the much smaller encoded one while it waits for the EXIF stage
+        try:
+            job.payload = (frame_num, path, self.frame_writer.encode(image), frame_time, gpx_point)
+        finally:
+            if pool is not None:
+                pool.release(image)
+
+    def _write_exif_job(self, job: FrameJob) -> None:
+        frame_num, path, jpeg, frame_time, gpx_point = job.payload
+        num_bytes = self.frame_writer.write_encoded(path, jpeg, from_epoch(frame_time), gpx_point)
+        job.payload = (frame_num, path, None, frame_time, gpx_point)
+        job.result = (frame_num, path, num_bytes)
+
+    def checkpoint_parameters(self, **options) -> dict:
+        """ Parameters that change the frames written by `geo_reference`, stored in the checkpoint.
+
+        :param options: options of `geo_reference` that change its output.
+        """
+        parameters = {'video': self.video_path.name,
+                      'video_size': self.video_path.stat().st_size,
+                      'gpx': self.gpx_path.name,
+                      'gpx_size': self.gpx_path.stat().st_size,
+                      'time_lapse': self.time_lapse,
+                      'decoder_max_size': self.decoder_max_size,
+                      'encoding': vars(self.frame_writer.profile),
+                      **options}
+        if self.frame_container is not None:
+            # The loose frames of a previous run are not in the container
+            parameters['container'] = True
+        return parameters
+
+    def extract_n_frames(self, num_frames: int, discard_start_frames: int = 0, frame_interval: float = 0,
+                         spread: bool = False, offsets: Optional[Sequence[float]] = None, workers: int = 0) -> None:
+        """ Extracts frames from the video without adding GPS information.
+
+        :param num_frames: number of frames to extract.
+        :param discard_start_frames: number of frames to discard from the video.
+        :param frame_interval: seconds of video time between two extracted frames. The frames in
+         between are skipped without decoding them. With 0, consecutive frames are extracted.
+        :param spread: extracts the frames evenly spaced across the whole video instead of from its start.
+         Every frame is reached with a seek, so the time does not depend on the length of the video.
+        :param offsets: seconds of video time of the frames to extract with a seek, instead of `num_frames`.
+        :param workers: number of processes seeking the frames with `spread` or `offsets`. With 0, they
+         are extracted in this process.
+        """
+        if spread or offsets is not None:
+            self.extract_spread_frames(self.spread_frame_nums(num_frames, discard_start_frames, offsets), workers)
+            return
 
-    def extract_n_frames(self, num_frames: int, discard_start_frames: int = 0) -> None:
-        video_creation_time = datetime.datetime.strptime(self.video_path.stem, VIDEO_TIME_FORMAT)
-        pbar = tqdm(total=num_frames, unit='frames')
+        video_start = to_epoch(datetime.datetime.strptime(self.video_path.stem, VIDEO_TIME_FORMAT))
+        started_total = self.metrics.start()
+        if self.frame_container is not None:
+            self.frame_container.reset()
+        pbar = tqdm(total=num_frames, unit='frames', disable=not self.show_progress)
 
         # Go through the video
         frame_num = 0
-        cap = cv2.VideoCapture(str(self.video_path))
+        cap = self.open_video()
         if discard_start_frames > 0:
             frame_num = discard_start_frames - 1
-            num_frames += discard_start_frames - 1
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
-
-        success, image = cap.read()
-        while success and frame_num < num_frames:
-            frame_timestamp = video_creation_time + datetime.timedelta(seconds=self.time_lapse * frame_num)
+            cap.seek(frame_num)
+
+        frame_step = max(1, int(round(frame_interval / self.time_lapse))) if frame_interval > 0 else 1
+        selected = np.zeros(max(0, (num_frames - 1) * frame_step + 1), dtype=bool)
+        selected[::frame_step] = True
+
+        # The frames are written before decoding the next one, so the same image is always decoded into
+        pool = FrameBufferPool(1)
+        first_frame = frame_num
+        for position, image in self.metrics.timed(sample_frames(cap, selected, pool), 'decode', 'grab'):
+            if position >= len(selected):
+                break
+            if image is None:
+                continue
+            frame_num = first_frame + position
+            frame_time = video_start + self.time_lapse * frame_num
 
-            # 3. Save image and add exif data
-            image_path = Path(self.output_path, f'{frame_timestamp.strftime(VIDEO_TIME_FORMAT)}.jpg')
-            self.save_image(str(image_path), image)
+            # 3. Save image
+            image_path = self.frame_path(frame_time)
+            self.frame_writer.write_image(str(image_path), image)
+            pool.release(image)
 
-            success, image = cap.read()
-            logger.debug(NEW_FRAME_EXTRACTED_STR, success)
-            frame_num += 1
+            logger.debug(NEW_FRAME_EXTRACTED_STR, frame_num)
             pbar.update(1)
 
+        cap.release()
+        if self.frame_container is not None:
+            self.frame_container.close()
+        pbar.close()
+        self.metrics.stop('total', started_total)
+        logger.info(self.frame_writer.summary())
+
+    def spread_frame_nums(self, num_frames: int, discard_start_frames: int = 0,
+                          offsets: Optional[Sequence[float]] = None) -> List[int]:
+        """ Frame numbers of the frames extracted evenly spaced or at the given offsets.
+
+        :param num_frames: number of frames evenly spaced across the video.
+        :param discard_start_frames: number of frames to discard from the video.
+        :param offsets: seconds of video time of the frames, instead of spacing them evenly.
+        """
+        cap = self.open_video()
+        frame_count = cap.frame_count
+        cap.release()
+        if offsets is not None:
+            frame_nums = {int(round(offset / self.time_lapse)) for offset in offsets}
+            return sorted(frame_num for frame_num in frame_nums if discard_start_frames <= frame_num < frame_count)
+        return spread_frames(discard_start_frames, frame_count, num_frames).tolist()
+
+    def extract_spread_frames(self, frame_nums: Sequence[int], workers: int = 0) -> None:
+        """ Extracts the given frames seeking to each one, in this process or split across worker processes.
+
+        :param frame_nums: sorted frame numbers to extract.
+        :param workers: number of processes, each one with its own decoder. With 0, the frames are
+         extracted in this process.
+        """
+        video_start = to_epoch(datetime.datetime.strptime(self.video_path.stem, VIDEO_TIME_FORMAT))
+        started_total = self.metrics.start()
+        if self.frame_container is not None:
+            self.frame_container.reset()
+            if workers > 0:
+                logger.warning('The frames of a container are written by a single process, the workers are not used.')
+                workers = 0
+        frames = [(frame_num, str(self.frame_path(video_start + self.time_lapse * frame_num)))
+                  for frame_num in frame_nums]
+        logger.info('{} frames of the video will be extracted seeking to each one.', len(frames))
+        pbar = tqdm(total=len(frames), unit='frames', disable=not self.show_progress)
+
+        extracted = 0
+        if workers <= 0 or len(frames) <= 1:
+            pool = FrameBufferPool(1)
+            paths = dict(frames)
+            cap = self.open_video()
+            try:
+                for frame_num, image in self.metrics.timed(seek_frames(cap, frame_nums, pool), 'decode', 'grab'):
+                    self.frame_writer.write_image(paths[frame_num], image)
+                    pool.release(image)
+                    extracted += 1
+                    logger.debug(NEW_FRAME_EXTRACTED_STR, frame_num)
+                    pbar.update(1)
+            finally:
+                cap.release()
+        else:
+            # Every process seeks forward through a contiguous part of the video
+            chunks = [chunk.tolist() for chunk in np.array_split(np.arange(len(frames)), min(workers, len(frames)))]
+            options = dict(decoder=self.decoder, decoder_threads=self.decoder_threads,
+                           decoder_max_size=self.decoder_max_size, encoding_profile=self.frame_writer.profile)
+            with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+                futures = [executor.submit(extract_frames_at, str(self.video_path),
+                                           [frames[i] for i in chunk], **options) for chunk in chunks]
+                for future in as_completed(futures):
+                    result = future.result()
+                    self.frame_writer.add_statistics(len(result['frames']), result['bytes'],
+                                                     result['encode_seconds'])
+                    extracted += len(result['frames'])
+                    pbar.update(len(result['frames']))
+
+        if self.frame_container is not None:
+            self.frame_container.close()
         pbar.close()
+        if extracted < len(frames):
+            logger.warning('{} of the {} frames could not be decoded.', len(frames) - extracted, len(frames))
+        self.metrics.stop('total', started_total)
+        logger.info(self.frame_writer.summary())
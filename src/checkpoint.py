@@ -0,0 +1,163 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Container, Dict, List, Optional, Tuple, Union
+
+from loguru import logger
+
+from src.atomic_file import atomic_write
+from src.frame_container import FrameContainer
+
+CHECKPOINT_FILE_NAME = 'checkpoint.json'
+CHECKPOINT_FRAMES_FILE_NAME = 'checkpoint.frames'
+CHECKPOINT_VERSION = 1
+
+CHECKPOINT_BATCH_SIZE = 200
+CHECKPOINT_INTERVAL = 10.0
+
+
+class Checkpoint:
+    """ Manifest of the frames already written in an output folder, used to resume interrupted runs.
+
+    The manifest is made of two files:
+     - `checkpoint.frames`: append-only log with a `frame_num, file name, bytes` line per written frame.
+     - `checkpoint.json`: processing parameters, next frame to process and the length of the log that
+       is known to be complete. It is replaced atomically after every batch.
+
+    Anything appended to the log after the last replacement of the JSON file is ignored when loading,
+    so a crash in the middle of a batch only loses that batch. The frames are expected to be added in
+    increasing order, which is the order in which the frame pipeline finishes them.
+    """
+
+    def __init__(self, directory: Union[str, Path], parameters: Dict[str, Any],
+                 batch_size: int = CHECKPOINT_BATCH_SIZE, interval: float = CHECKPOINT_INTERVAL,
+                 container: Optional[FrameContainer] = None):
+        """
+        :param directory: output folder of the frames, where the manifest is stored.
+        :param parameters: parameters that change the output. A manifest written with different
+         parameters is not resumed.
+        :param batch_size: maximum number of frames added between two writes of the manifest.
+        :param interval: maximum seconds between two writes of the manifest.
+        :param container: container where the frames are written, instead of a file per frame.
+        """
+        self.directory = Path(directory)
+        self.container = container
+        # The JSON round trip normalizes the parameters, e.g. tuples to lists, to compare them when loading
+        self.parameters = json.loads(json.dumps(parameters))
+        self.batch_size = batch_size
+        self.interval = interval
+
+        self.next_frame = 0
+        self.finished = False
+        self.frames: List[Tuple[int, str, int]] = []
+
+        self._pending: List[str] = []
+        self._frames_size = 0
+        self._last_write = time.monotonic()
+
+    @property
+    def manifest_path(self) -> Path:
+        return Path(self.directory, CHECKPOINT_FILE_NAME)
+
+    @property
+    def frames_path(self) -> Path:
+        return Path(self.directory, CHECKPOINT_FRAMES_FILE_NAME)
+
+    def restore(self, removed: Container[int] = ()) -> bool:
+        """ Loads the manifest of a previous run with the same parameters.
+
+        The frames whose file is missing or has a different size are processed again, together with
+        all the following ones.
+
+        :param removed: positions, in the order they were added, of the frames whose file was removed
+         on purpose, e.g. after uploading it. They are not processed again.
+        :return: True if there is previous work to resume.
+        """
+        try:
+            with open(self.manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            logger.info('No checkpoint found in {}, starting from the beginning.', self.directory)
+            return False
+
+        if manifest.get('version') != CHECKPOINT_VERSION or manifest.get('parameters') != self.parameters:
+            logger.warning('The checkpoint in {} was written with different parameters, starting from the beginning.',
+                           self.directory)
+            return False
+
+        frames_size = manifest['frames_size']
+        try:
+            with open(self.frames_path, 'rb') as frames_file:
+                lines = frames_file.read(frames_size).decode().splitlines()
+        except OSError:
+            lines = []
+
+        for line in lines:
+            frame_num, file_name, num_bytes = line.split('\t')
+            frame_num, num_bytes = int(frame_num), int(num_bytes)
+            if not self._intact(file_name, num_bytes) and len(self.frames) not in removed:
+                logger.warning('The frame {} in {} is missing or incomplete, resuming from it.', frame_num, file_name)
+                self.next_frame = frame_num
+                self.finished = False
+                self._frames_size = sum(len(f'{f}\t{n}\t{b}\n'.encode()) for f, n, b in self.frames)
+                return True
+            self.frames.append((frame_num, file_name, num_bytes))
+
+        self.next_frame = manifest['next_frame']
+        self.finished = manifest['finished']
+        self._frames_size = frames_size
+        return True
+
+    def _intact(self, file_name: str, num_bytes: int) -> bool:
+        """ Whether a frame was completely written. """
+        if self.container is not None:
+            return self.container.size(file_name) == num_bytes
+        frame_path = Path(self.directory, file_name)
+        return frame_path.is_file() and frame_path.stat().st_size == num_bytes
+
+    def add(self, frame_num: int, path: Union[str, Path], num_bytes: int) -> None:
+        """ Records a frame written to the output folder. The manifest is written in batches.
+
+        :param frame_num: number of the frame in the video.
+        :param path: path of the written frame.
+        :param num_bytes: size of the written file.
+        """
+        file_name = Path(path).name
+        self.frames.append((frame_num, file_name, num_bytes))
+        self._pending.append(f'{frame_num}\t{file_name}\t{num_bytes}\n')
+        self.next_frame = frame_num + 1
+
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._last_write >= self.interval:
+            self.write()
+
+    def finish(self) -> None:
+        """ Marks the processing as completed and writes the manifest. """
+        self.finished = True
+        self.write()
+
+    def write(self) -> None:
+        """ Appends the pending frames to the log and replaces the manifest. """
+        os.makedirs(self.directory, exist_ok=True)
+        data = ''.join(self._pending).encode()
+        mode = 'r+b' if self.frames_path.is_file() else 'wb'
+        with open(self.frames_path, mode) as frames_file:
+            # Lines appended by an interrupted write are discarded
+            frames_file.seek(self._frames_size)
+            frames_file.truncate()
+            frames_file.write(data)
+            frames_file.flush()
+            os.fsync(frames_file.fileno())
+        self._frames_size += len(data)
+        self._pending = []
+
+        manifest = {'version': CHECKPOINT_VERSION,
+                    'parameters': self.parameters,
+                    'next_frame': self.next_frame,
+                    'finished': self.finished,
+                    'frames': len(self.frames),
+                    'frames_size': self._frames_size}
+        with atomic_write(self.manifest_path, sync=True) as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        self._last_write = time.monotonic()
+        logger.trace('Checkpoint written with {} frames, next frame {}.', len(self.frames), self.next_frame)
@@ -0,0 +1,182 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, Tuple, Union
+
+import numpy as np
+from loguru import logger
+
+from src.atomic_file import atomic_write
+from src.gpx_track import FramePositions, bearing, haversine
+
+DEFAULT_COVERAGE_PATH = Path(os.environ.get('XDG_DATA_HOME', Path.home() / '.local' / 'share'),
+                             'action_cam_2_street_view', 'coverage.npz')
+
+COVERAGE_VERSION = 2
+
+# Side of the cells of the grid, in meters
+DEFAULT_CELL_SIZE = 20.0
+# Directions of travel told apart in every cell, 8 are 45 degrees each
+DEFAULT_HEADING_BUCKETS = 8
+
+# Meters of a degree of latitude
+METERS_PER_DEGREE = 111_320.0
+SECONDS_PER_DAY = 86400
+# Below this distance between the neighbours of a frame the camera is stopped, it keeps the last heading
+MIN_HEADING_DISTANCE = 1.0
+
+
+def video_source(video_path: Union[str, Path]) -> int:
+    """ Identifier of a video in the grid, from its name and size, so the cells it captured are told apart. """
+    video_path = Path(video_path)
+    digest = hashlib.blake2b(f'{video_path.name}:{video_path.stat().st_size}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+def frame_headings(positions: FramePositions) -> np.ndarray:
+    """ Direction of travel, in degrees clockwise from the north, of every frame of a batch.
+
+    The heading of a frame is the bearing from the previous located frame to the next one. The frames
+    recorded while stopped keep the heading of the last frame in motion, and it is NaN for the frames
+    without a position or before the camera moves.
+    """
+    headings = np.full(len(positions), np.nan)
+    located = np.flatnonzero(positions.valid)
+    if len(located) < 2:
+        return headings
+
+    latitudes, longitudes = positions.latitudes[located], positions.longitudes[located]
+    before = np.maximum(np.arange(len(located)) - 1, 0)
+    after = np.minimum(np.arange(len(located)) + 1, len(located) - 1)
+    moving = haversine(latitudes[before], longitudes[before], latitudes[after], longitudes[after]) \
+        >= MIN_HEADING_DISTANCE
+    directions = bearing(latitudes[before], longitudes[before], latitudes[after], longitudes[after])
+
+    last_moving = np.maximum.accumulate(np.where(moving, np.arange(len(located)), -1))
+    headings[located] = np.where(last_moving >= 0, directions[np.maximum(last_moving, 0)], np.nan)
+    return headings
+
+
+class CoverageIndex:
+    """ Persistent grid of the road cells already captured, with the day of the last capture per heading.
+
+    The world is divided in cells of about `cell_size` meters and every cell in `heading_buckets` directions
+    of travel, so the two directions of a road are different entries. Every entry is a 64 bit integer key
+    mapped to the last day, in days since the epoch, a frame was written in it and the video it came from,
+    see `video_source`. The frames of a video are never covered by its own entries, so processing it
+    again or resuming it is not affected by its previous runs.
+
+    The whole grid is loaded into a dictionary when it is created, so looking up a frame is a constant
+    time operation, and it is stored as a `.npz` file with the keys, days and sources arrays. Saving merges the
+    cells written by other processes since the grid was loaded, e.g. the other jobs of a batch.
+    """
+
+    def __init__(self, path: Union[str, Path] = DEFAULT_COVERAGE_PATH, cell_size: float = DEFAULT_CELL_SIZE,
+                 heading_buckets: int = DEFAULT_HEADING_BUCKETS):
+        """
+        :param path: path of the `.npz` file of the grid.
+        :param cell_size: side of the cells in meters.
+        :param heading_buckets: number of directions of travel of every cell.
+        """
+        self.path = Path(path)
+        self.cell_size = cell_size
+        self.heading_buckets = heading_buckets
+        self.columns = int(np.ceil(360 * METERS_PER_DEGREE / cell_size)) + 1
+        self.cells = self._read()
+        self._modified = False
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def cell_keys(self, positions: FramePositions, headings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ Keys of the cell and heading of every frame of a batch.
+
+        Besides the key of its heading, every frame gets the key of the neighbouring heading closest to it,
+        so two frames headed just at both sides of the border of two buckets are in the same direction.
+
+        :param positions: positions of the frames.
+        :param headings: heading of every frame, see `frame_headings`.
+        :return: key of every frame and key of its neighbouring heading, -1 for the frames without a
+         position or a heading.
+        """
+        known = positions.valid & ~np.isnan(headings)
+        latitudes, longitudes = positions.latitudes[known], positions.longitudes[known]
+
+        rows = np.floor((latitudes + 90) * METERS_PER_DEGREE / self.cell_size).astype(np.int64)
+        # The columns are as wide as the cells at the centre of their row
+        row_latitudes = (rows + 0.5) * self.cell_size / METERS_PER_DEGREE - 90
+        columns = np.floor((longitudes + 180) * METERS_PER_DEGREE * np.cos(np.radians(row_latitudes))
+                           / self.cell_size).astype(np.int64)
+        cells = (rows * self.columns + columns) * self.heading_buckets
+
+        buckets = headings[known] * self.heading_buckets / 360
+        nearest = np.where(buckets % 1 < 0.5, np.floor(buckets) - 1, np.floor(buckets) + 1)
+        buckets = np.floor(buckets).astype(np.int64) % self.heading_buckets
+        nearest = nearest.astype(np.int64) % self.heading_buckets
+
+        keys, near_keys = np.full(len(positions), -1, dtype=np.int64), np.full(len(positions), -1, dtype=np.int64)
+        keys[known] = cells + buckets
+        near_keys[known] = cells + nearest
+        return keys, near_keys
+
+    def covered(self, keys: np.ndarray, near_keys: np.ndarray, frame_times: np.ndarray, max_days: float,
+                source: int) -> np.ndarray:
+        """ Which frames are in a cell captured by another video in a similar heading at most `max_days` days apart.
+
+        :param keys: key of every frame, see `cell_keys`.
+        :param near_keys: key of the neighbouring heading of every frame.
+        :param frame_times: time of every frame in seconds since the epoch.
+        :param max_days: maximum days between the frame and the last capture of its cell.
+        :param source: video of the frames, see `video_source`.
+        """
+        covered = np.zeros(len(keys), dtype=bool)
+        days = np.floor(np.asarray(frame_times) / SECONDS_PER_DAY).astype(np.int64)
+        for i in np.flatnonzero(keys >= 0).tolist():
+            for key in (int(keys[i]), int(near_keys[i])):
+                day, captured_by = self.cells.get(key, (None, None))
+                if day is not None and captured_by != source and abs(int(days[i]) - day) <= max_days:
+                    covered[i] = True
+                    break
+        return covered
+
+    def add(self, key: int, frame_time: float, source: int) -> None:
+        """ Records a frame of a video written in the cell and heading of a key. Negative keys are ignored. """
+        if key < 0:
+            return
+        day = int(frame_time // SECONDS_PER_DAY)
+        if self.cells.get(key, (day - 1, None))[0] < day:
+            self.cells[int(key)] = (day, source)
+            self._modified = True
+
+    def save(self) -> None:
+        """ Writes the grid, merged with the cells saved by other processes since it was loaded. """
+        if not self._modified:
+            return
+        for key, (day, source) in self._read().items():
+            if self.cells.get(key, (day - 1, None))[0] < day:
+                self.cells[key] = (day, source)
+
+        os.makedirs(self.path.parent, exist_ok=True)
+        with atomic_write(self.path, 'wb') as coverage_file:
+            np.savez(coverage_file, version=COVERAGE_VERSION, cell_size=self.cell_size,
+                     heading_buckets=self.heading_buckets,
+                     keys=np.fromiter(self.cells.keys(), dtype=np.int64, count=len(self.cells)),
+                     days=np.fromiter((day for day, _ in self.cells.values()), dtype=np.int64, count=len(self.cells)),
+                     sources=np.fromiter((source for _, source in self.cells.values()), dtype=np.int64,
+                                         count=len(self.cells)))
+        self._modified = False
+        logger.debug('Saved {} covered cells to {}.', len(self.cells), self.path)
+
+    def _read(self) -> Dict[int, Tuple[int, int]]:
+        if not self.path.is_file():
+            return {}
+        try:
+            with np.load(self.path) as data:
+                if int(data['version']) != COVERAGE_VERSION or float(data['cell_size']) != self.cell_size \
+                        or int(data['heading_buckets']) != self.heading_buckets:
+                    logger.warning('The coverage grid {} has other cells, it is replaced.', self.path)
+                    return {}
+                return dict(zip(data['keys'].tolist(), zip(data['days'].tolist(), data['sources'].tolist())))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning('Ignoring corrupted coverage grid {}: {}', self.path, e)
+            return {}
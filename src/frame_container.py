@@ -0,0 +1,205 @@
+import importlib
+import io
+import os
+import tarfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from loguru import logger
+
+from src.atomic_file import atomic_write
+
+FRAMES_CONTAINER_NAME = 'frames.tar'
+INDEX_SUFFIX = '.idx'
+
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+# Two empty blocks mark the end of a tar archive
+TAR_END_OF_ARCHIVE = bytes(2 * TAR_BLOCK_SIZE)
+
+
+def _padding(size: int) -> int:
+    return -size % TAR_BLOCK_SIZE
+
+
+class FrameContainer:
+    """ Frames of a sequence appended to a single uncompressed tar file, with an index of their offsets.
+
+    Writing a frame appends its tar header and its data to `frames.tar` and a `name, offset, size`
+    line to `frames.tar.idx`, so a sequence is two files instead of one per frame. The index gives
+    random access to any frame without reading the rest of the archive, and the archive is a standard
+    tar file that any tool can list or extract. When the index is missing, it is rebuilt reading the
+    tar headers.
+
+    The frames are addressed as if the archive was a folder, `<output>/frames.tar/<name>.jpg`, which is
+    how the upload scripts read them. When a frame is written twice, e.g. after resuming a run, the last
+    copy is the one read. Frames can be appended from several threads and read while the archive is written.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        :param path: path of the tar file. The index is written next to it.
+        """
+        self.path = Path(path)
+        self.index_path = self.path.with_name(f'{self.path.name}{INDEX_SUFFIX}')
+
+        self._entries: Dict[str, Tuple[int, int]] = {}
+        self._end = 0
+        self._index_size = 0
+        self._tar_file: Optional[io.BufferedRandom] = None
+        self._index_file: Optional[io.BufferedWriter] = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    @property
+    def names(self) -> List[str]:
+        """ Names of the frames sorted by name, which is chronological for the frames of a video. """
+        with self._lock:
+            return sorted(self._entries)
+
+    def frame_path(self, name: str) -> Path:
+        """ Path that addresses a frame of the container. """
+        return Path(self.path, name)
+
+    def size(self, name: str) -> Optional[int]:
+        """ Bytes of a frame or None if it is not in the container. """
+        entry = self._entries.get(name)
+        return entry[1] if entry is not None else None
+
+    def read(self, key: Union[int, str]) -> bytes:
+        """ Reads a frame.
+
+        :param key: name of the frame or its position in `names`.
+        """
+        name = self.names[key] if isinstance(key, int) else key
+        entry = self._entries.get(name)
+        if entry is None:
+            raise KeyError(f'The frame {name} is not in {self.path}.')
+        offset, size = entry
+        with open(self.path, 'rb') as tar_file:
+            tar_file.seek(offset)
+            data = tar_file.read(size)
+        if len(data) != size:
+            raise IOError(f'The frame {name} of {self.path} is incomplete.')
+        return data
+
+    def open(self, key: Union[int, str]) -> io.BytesIO:
+        """ Reads a frame into a file object, e.g. to upload it. """
+        return io.BytesIO(self.read(key))
+
+    def append(self, name: str, chunks: Sequence[Union[bytes, memoryview]]) -> int:
+        """ Appends a frame made of several chunks of data.
+
+        :param name: name of the frame, without folders.
+        :param chunks: data of the frame, written one after the other.
+        :return: number of bytes of the frame.
+        """
+        size = sum(len(chunk) for chunk in chunks)
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mode = 0o644
+        info.mtime = int(time.time())
+        header = info.tobuf(format=tarfile.USTAR_FORMAT)
+
+        with self._lock:
+            tar_file = self._open_for_append()
+            tar_file.seek(self._end)
+            tar_file.write(header)
+            for chunk in chunks:
+                tar_file.write(chunk)
+            tar_file.write(bytes(_padding(size)))
+            # The data is flushed before indexing it, so it can be read as soon as it is in the index
+            tar_file.flush()
+
+            offset = self._end + len(header)
+            line = f'{name}\t{offset}\t{size}\n'.encode()
+            self._index_file.write(line)
+            self._index_file.flush()
+            self._index_size += len(line)
+            self._end = offset + size + _padding(size)
+            self._entries[name] = (offset, size)
+        return size
+
+    def reset(self) -> None:
+        """ Removes all the frames. """
+        with self._lock:
+            self._close_files()
+            for path in (self.path, self.index_path):
+                if path.exists():
+                    os.remove(path)
+            self._entries = {}
+            self._end = 0
+            self._index_size = 0
+
+    def close(self) -> None:
+        """ Ends the archive, so the tar tools do not warn about it. Frames can be appended again later. """
+        with self._lock:
+            if self._tar_file is not None:
+                self._tar_file.seek(self._end)
+                self._tar_file.write(TAR_END_OF_ARCHIVE)
+                self._tar_file.truncate()
+            self._close_files()
+
+    def _open_for_append(self) -> io.BufferedRandom:
+        if self._tar_file is None:
+            os.makedirs(self.path.parent, exist_ok=True)
+            self._tar_file = open(self.path, 'r+b' if self.path.is_file() else 'w+b')
+            # Drops the end of the archive and anything written after the last indexed frame
+            self._tar_file.truncate(self._end)
+            self._index_file = open(self.index_path, 'r+b' if self.index_path.is_file() else 'w+b')
+            self._index_file.truncate(self._index_size)
+            self._index_file.seek(self._index_size)
+        return self._tar_file
+
+    def _close_files(self) -> None:
+        for container_file in (self._tar_file, self._index_file):
+            if container_file is not None:
+                container_file.close()
+        self._tar_file = self._index_file = None
+
+    def _load(self) -> None:
+        """ Reads the index of an existing container. """
+        if not self.path.is_file():
+            return
+        tar_size = self.path.stat().st_size
+
+        try:
+            with open(self.index_path, 'rb') as index_file:
+                data = index_file.read()
+        except OSError:
+            data = b''
+        # A line without its end was being written when the process stopped
+        data = data[:data.rfind(b'\n') + 1]
+        for line in data.decode().splitlines():
+            name, offset, size = line.split('\t')
+            offset, size = int(offset), int(size)
+            if offset + size > tar_size:
+                logger.warning('The container {} ends before the frame {}, the rest of its index is ignored.',
+                               self.path, name)
+                break
+            self._entries[name] = (offset, size)
+            self._end = max(self._end, offset + size + _padding(size))
+            self._index_size += len(line.encode()) + 1
+
+        if not self._entries and tar_size > 0:
+            self._rebuild_index(tar_size)
+
+    def _rebuild_index(self, tar_size: int) -> None:
+        """ Indexes the frames reading the tar headers, e.g. of an archive copied without its index. """
+        # The upload scripts read the containers without an index with the same scanner
+        sequence_container = importlib.import_module('upload-scripts').sequence_container
+
+        logger.info('Indexing the frames of {}.', self.path)
+        self._entries, self._end = sequence_container.scan_headers(str(self.path), {}, 0, tar_size)
+        lines = [f'{name}\t{offset}\t{size}\n' for name, (offset, size) in self._entries.items()]
+        with atomic_write(self.index_path) as index_file:
+            index_file.writelines(lines)
+        self._index_size = sum(len(line.encode()) for line in lines)
+
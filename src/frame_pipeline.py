@@ -0,0 +1,198 @@
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+_STOP = object()
+
+
+class FrameJob:
+    """ Unit of work travelling through the frame pipeline.
+
+    :param index: position of the frame in the emission order.
+    :param payload: arbitrary data needed by the stages, e.g. the image, the timestamp and the GPX point.
+    """
+
+    def __init__(self, index: int, payload: Any):
+        self.index = index
+        self.payload = payload
+        self.result: Any = None
+
+
+class FrameConsumer:
+    """ Receives the frames written by `geo_reference` as soon as each one is finished.
+
+    The frames are submitted in order with consecutive indexes, continuing from the frames already
+    written when a run is resumed, so a consumer can process them while the video is still decoded.
+    """
+
+    def removed_frames(self) -> Set[int]:
+        """ Indexes of the frames whose file was removed by the consumer, e.g. after uploading it. """
+        return set()
+
+    def submit(self, index: int, path: str, frame_timestamp: Any, gpx_point: Any,
+               heading: Optional[float] = None) -> None:
+        """ Hands a finished frame to the consumer.
+
+        :param index: position of the frame among the written frames.
+        :param path: path of the written frame.
+        :param frame_timestamp: time of the frame, in seconds since the epoch.
+        :param gpx_point: position of the frame as (time, latitude, longitude, altitude).
+        :param heading: direction of travel in degrees clockwise from the north, None when it is unknown.
+        """
+        raise NotImplementedError
+
+    def close(self, complete: bool) -> None:
+        """ Waits until the submitted frames are processed.
+
+        :param complete: whether every frame of the video was submitted or the run was interrupted.
+        """
+
+
+class FrameCollector(FrameConsumer):
+    """ Keeps the list of submitted frames, e.g. to upload them once the processing ends. """
+
+    def __init__(self):
+        self.frames: List[Tuple[int, str, Any, Any, Optional[float]]] = []
+
+    @property
+    def complete(self) -> bool:
+        """ Whether the list starts at the first frame, which is not the case after resuming a run. """
+        return bool(self.frames) and self.frames[0][0] == 0
+
+    def submit(self, index: int, path: str, frame_timestamp: Any, gpx_point: Any,
+               heading: Optional[float] = None) -> None:
+        self.frames.append((index, path, frame_timestamp, gpx_point, heading))
+
+
+class FramePipeline:
+    """ Bounded multi-stage pipeline used to encode frames and write their EXIF in worker threads.
+
+    The decoder stays in the calling thread and feeds jobs with `submit`, which blocks while the
+    encode queue is full so the decoder cannot get ahead of the workers and fill the memory with
+    decoded frames. Every job goes through the `encode` stage and then through the `write_exif`
+    stage, each one served by its own pool of threads. OpenCV releases the GIL while encoding so
+    the threads run the encoding in parallel.
+
+    Finished jobs are handed to `on_done` in the same order they were submitted, regardless of the
+    order in which the workers complete them.
+    """
+
+    def __init__(self, encode: Callable[[FrameJob], None], write_exif: Callable[[FrameJob], None],
+                 workers: int = 2, exif_workers: Optional[int] = None, queue_size: Optional[int] = None,
+                 on_done: Optional[Callable[[FrameJob], None]] = None):
+        """
+        :param encode: function executed by the encode workers for each job.
+        :param write_exif: function executed by the EXIF workers for each job after encoding it.
+        :param workers: number of encode workers.
+        :param exif_workers: number of EXIF workers. By default, the same as `workers`.
+        :param queue_size: maximum number of jobs waiting in each queue. By default, twice the workers.
+        :param on_done: function called, in submission order, for every finished job.
+        """
+        self.workers = max(1, workers)
+        self.exif_workers = max(1, exif_workers if exif_workers else self.workers)
+        queue_size = queue_size if queue_size else 2 * self.workers
+
+        self._encode = encode
+        self._write_exif = write_exif
+        self._on_done = on_done
+
+        # Jobs that can be waiting or being encoded at the same time
+        self.capacity = queue_size + self.workers
+
+        self._encode_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._exif_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+        self._lock = threading.Lock()
+        self._finished: Dict[int, FrameJob] = {}
+        self._next_index = 0
+        self._submitted = 0
+        self._error: Optional[BaseException] = None
+
+        self._encode_threads = [threading.Thread(target=self._run_stage,
+                                                 args=(self._encode_queue, self._encode, self._exif_queue),
+                                                 name=f'encode-{i}', daemon=True)
+                                for i in range(self.workers)]
+        self._exif_threads = [threading.Thread(target=self._run_stage,
+                                               args=(self._exif_queue, self._write_exif, None),
+                                               name=f'exif-{i}', daemon=True)
+                              for i in range(self.exif_workers)]
+        for thread in self._encode_threads + self._exif_threads:
+            thread.start()
+
+        logger.debug('Frame pipeline started with {} encode and {} EXIF workers.', self.workers, self.exif_workers)
+
+    def __enter__(self) -> 'FramePipeline':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def submit(self, payload: Any) -> FrameJob:
+        """ Adds a new job to the pipeline. Blocks while the pipeline is full.
+
+        :param payload: data of the frame to be processed by the stages.
+        :return: the job created for the payload.
+        """
+        self._raise_if_failed()
+        job = FrameJob(self._submitted, payload)
+        self._submitted += 1
+        self._encode_queue.put(job)
+        return job
+
+    def close(self) -> None:
+        """ Waits until every submitted job is finished and stops the workers. """
+        for _ in self._encode_threads:
+            self._encode_queue.put(_STOP)
+        for thread in self._encode_threads:
+            thread.join()
+
+        for _ in self._exif_threads:
+            self._exif_queue.put(_STOP)
+        for thread in self._exif_threads:
+            thread.join()
+
+        self._raise_if_failed()
+
+    def _run_stage(self, input_queue: queue.Queue, function: Callable[[FrameJob], None],
+                   output_queue: Optional[queue.Queue]) -> None:
+        while True:
+            job = input_queue.get()
+            if job is _STOP:
+                return
+
+            # After a failure the remaining jobs are drained so the decoder never blocks forever
+            if self._error is None:
+                try:
+                    function(job)
+                except BaseException as e:
+                    logger.error('Error processing frame {}: {}', job.index, e)
+                    with self._lock:
+                        if self._error is None:
+                            self._error = e
+
+            if output_queue is not None:
+                output_queue.put(job)
+            else:
+                self._finish(job)
+
+    def _finish(self, job: FrameJob) -> None:
+        with self._lock:
+            self._finished[job.index] = job
+            while self._next_index in self._finished:
+                done = self._finished.pop(self._next_index)
+                self._next_index += 1
+                if self._on_done is not None and self._error is None:
+                    # An error of the callback stops the pipeline as the one of a stage, instead of killing
+                    # the worker and leaving the queues full
+                    try:
+                        self._on_done(done)
+                    except BaseException as e:
+                        logger.error('Error finishing frame {}: {}', done.index, e)
+                        self._error = e
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise RuntimeError('The frame pipeline stopped due to an error in a worker.') from self._error
+
@@ -0,0 +1,208 @@
+from typing import Callable, Optional, Tuple
+
+import cv2
+import numpy as np
+from loguru import logger
+
+HASH_SIZE = 8
+
+# Pixels sampled per hash cell before the area interpolation
+HASH_SAMPLES_PER_CELL = 8
+
+
+def thumbnail(image: np.ndarray, size: Tuple[int, int], samples_per_cell: int = HASH_SAMPLES_PER_CELL) -> np.ndarray:
+    """ Reduces a BGR image to a tiny grayscale image.
+
+    The image is first subsampled with a stride, which is a view and costs nothing, and the result is
+    reduced with an area interpolation. Resizing a 4K frame directly with `INTER_AREA` takes tens of
+    milliseconds while this takes a fraction of one.
+
+    :param image: BGR image.
+    :param size: (width, height) of the thumbnail.
+    :param samples_per_cell: pixels kept per thumbnail pixel in each axis before the interpolation.
+    """
+    width, height = size
+    row_step = max(1, image.shape[0] // (height * samples_per_cell))
+    column_step = max(1, image.shape[1] // (width * samples_per_cell))
+    small = cv2.resize(image[::row_step, ::column_step], size, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+
+def dhash(image: np.ndarray, hash_size: int = HASH_SIZE) -> int:
+    """ Difference hash of an image: one bit per pair of horizontally adjacent pixels of a thumbnail.
+
+    :param image: BGR image.
+    :param hash_size: side of the grid of bits, the hash has `hash_size ** 2` bits.
+    """
+    small = thumbnail(image, (hash_size + 1, hash_size))
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(hash_a: int, hash_b: int) -> int:
+    """ Number of different bits between two hashes. """
+    return bin(hash_a ^ hash_b).count('1')
+
+
+class DuplicateFilter:
+    """ Drops the frames that look the same as the last kept frame, e.g. while the camera is stopped.
+
+    Two frames are considered near-duplicates when the Hamming distance between their difference
+    hashes is not bigger than `threshold`.
+    """
+
+    def __init__(self, threshold: int = 4, hash_size: int = HASH_SIZE):
+        """
+        :param threshold: maximum number of different bits, out of `hash_size ** 2`, of a duplicate.
+        :param hash_size: side of the grid of bits of the hash.
+        """
+        self.threshold = threshold
+        self.hash_size = hash_size
+        self.last_hash: Optional[int] = None
+        self.kept = 0
+        self.dropped = 0
+
+    def accept(self, image: np.ndarray) -> bool:
+        """ Returns whether the frame is kept. A kept frame becomes the reference for the next ones. """
+        return self.accept_hash(dhash(image, self.hash_size))
+
+    def accept_hash(self, image_hash: int) -> bool:
+        """ Same as `accept` with the hash of the frame already computed, e.g. by another process. """
+        if self.last_hash is not None and hamming_distance(image_hash, self.last_hash) <= self.threshold:
+            self.dropped += 1
+            logger.trace('Near-duplicate frame dropped.')
+            return False
+
+        self.last_hash = image_hash
+        self.kept += 1
+        return True
+
+
+# Size and default thresholds of the quality check
+QUALITY_THUMBNAIL_WIDTH = 320
+DEFAULT_MIN_SHARPNESS = 20.0
+DEFAULT_MIN_BRIGHTNESS = 40.0
+DARK_LEVEL = 20
+BRIGHT_LEVEL = 250
+MAX_DARK_FRACTION = 0.6
+MAX_BRIGHT_FRACTION = 0.5
+
+
+def frame_quality(image: np.ndarray) -> Tuple[float, float, float, float]:
+    """ Measures the sharpness and the exposure of a frame on a downscaled grayscale copy.
+
+    :param image: BGR image.
+    :return: variance of the Laplacian, mean luminance, fraction of dark pixels and fraction of
+     saturated pixels.
+    """
+    width = min(QUALITY_THUMBNAIL_WIDTH, image.shape[1])
+    height = max(1, int(round(image.shape[0] * width / image.shape[1])))
+    gray = thumbnail(image, (width, height), samples_per_cell=2)
+
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+    histogram = np.bincount(gray.ravel(), minlength=256)
+    total = max(1, gray.size)
+    brightness = float(np.dot(histogram, np.arange(256)) / total)
+    dark_fraction = float(histogram[:DARK_LEVEL].sum() / total)
+    bright_fraction = float(histogram[BRIGHT_LEVEL:].sum() / total)
+    return sharpness, brightness, dark_fraction, bright_fraction
+
+
+def assign_windows(selected: np.ndarray, candidates: np.ndarray, radius: int) -> np.ndarray:
+    """ Assigns the candidate frames around every selected frame to its window.
+
+    Every candidate frame belongs to the window of the closest selected frame, if it is at most
+    `radius` frames away, so the windows never overlap and they are sorted as the frames.
+
+    :param selected: boolean mask with the frames to emit.
+    :param candidates: boolean mask with the frames that can replace them, e.g. with a known position.
+    :param radius: maximum number of frames between a candidate and its selected frame.
+    :return: index of the window of every frame, -1 for the frames out of any window.
+    """
+    windows = np.full(len(selected), -1, dtype=np.int64)
+    emitted = np.flatnonzero(selected)
+    positions = np.flatnonzero(candidates | selected)
+    if len(emitted) == 0 or len(positions) == 0:
+        return windows
+
+    right = np.clip(np.searchsorted(emitted, positions), 0, len(emitted) - 1)
+    left = np.clip(right - 1, 0, len(emitted) - 1)
+    nearest = np.where(np.abs(positions - emitted[left]) <= np.abs(emitted[right] - positions), left, right)
+    within = np.abs(emitted[nearest] - positions) <= radius
+    windows[positions[within]] = nearest[within]
+    return windows
+
+
+class SharpestFrameSelector:
+    """ Keeps only the best frame of every window of candidates and rejects the blurred or dark ones.
+
+    The frames are offered in order together with their window. Every frame is scored by the
+    variance of its Laplacian, and the frames too dark, too saturated or not sharp enough are
+    discarded. When a window ends, its sharpest valid frame is returned, or nothing if every frame
+    of the window was discarded.
+    """
+
+    def __init__(self, min_sharpness: float = DEFAULT_MIN_SHARPNESS, min_brightness: float = DEFAULT_MIN_BRIGHTNESS,
+                 max_dark_fraction: float = MAX_DARK_FRACTION, max_bright_fraction: float = MAX_BRIGHT_FRACTION,
+                 on_discard: Optional[Callable[[object], None]] = None):
+        """
+        :param min_sharpness: minimum variance of the Laplacian of the downscaled frame.
+        :param min_brightness: minimum mean luminance, between 0 and 255.
+        :param max_dark_fraction: maximum fraction of almost black pixels.
+        :param max_bright_fraction: maximum fraction of saturated pixels.
+        :param on_discard: called with every item that will not be returned, e.g. to reuse its image.
+        """
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_dark_fraction = max_dark_fraction
+        self.max_bright_fraction = max_bright_fraction
+        self.on_discard = on_discard
+
+        self.windows = 0
+        self.rejected_windows = 0
+        self._window: Optional[int] = None
+        self._best: Optional[object] = None
+        self._best_sharpness = -1.0
+
+    def accepts(self, image: np.ndarray) -> Tuple[bool, float]:
+        """ Scores a frame.
+
+        :return: whether the frame passes the thresholds and its sharpness.
+        """
+        sharpness, brightness, dark_fraction, bright_fraction = frame_quality(image)
+        valid = sharpness >= self.min_sharpness and brightness >= self.min_brightness and \
+            dark_fraction <= self.max_dark_fraction and bright_fraction <= self.max_bright_fraction
+        return valid, sharpness
+
+    def offer(self, window: int, item: object, image: np.ndarray) -> Optional[object]:
+        """ Adds a frame to its window.
+
+        :param window: window of the frame. The windows must be offered in order.
+        :param item: data returned if the frame is chosen.
+        :param image: image of the frame.
+        :return: the item chosen in the previous window, if the frame starts a new window.
+        """
+        chosen = None
+        if window != self._window:
+            chosen = self.flush()
+            self._window = window
+
+        valid, sharpness = self.accepts(image)
+        if valid and sharpness > self._best_sharpness:
+            item, self._best, self._best_sharpness = self._best, item, sharpness
+        if item is not None and self.on_discard is not None:
+            self.on_discard(item)
+        return chosen
+
+    def flush(self) -> Optional[object]:
+        """ Finishes the current window and returns its chosen item, if any. """
+        if self._window is None:
+            return None
+
+        chosen = self._best
+        self.windows += 1
+        if chosen is None:
+            self.rejected_windows += 1
+            logger.debug('Every frame of the window {} was blurred or badly exposed.', self._window)
+        self._window, self._best, self._best_sharpness = None, None, -1.0
+        return chosen
@@ -0,0 +1,299 @@
+import threading
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.video_decoder import VideoDecoder
+
+# Frames up to this distance after the current position are reached decoding forward instead of seeking,
+# as a seek decodes again from the previous keyframe
+MAX_FORWARD_GRABS = 30
+
+
+def select_by_interval(frame_times: np.ndarray, candidates: np.ndarray, interval: float,
+                       start_time: Optional[float] = None) -> np.ndarray:
+    """ Keeps at most one frame every `interval` seconds.
+
+    The time is split in slots of `interval` seconds starting at `start_time` and the first
+    candidate frame of every slot is selected.
+
+    :param frame_times: timestamps of the frames in seconds.
+    :param candidates: boolean mask with the frames that can be selected.
+    :param interval: length of the slots in seconds. With 0 every candidate is selected.
+    :param start_time: start of the first slot. By default, the time of the first frame.
+    :return: boolean mask with the selected frames.
+    """
+    if interval <= 0 or len(frame_times) == 0:
+        return candidates.copy()
+
+    if start_time is None:
+        start_time = frame_times[0]
+    slots = np.floor((frame_times - start_time) / interval).astype(np.int64)
+
+    selected = np.zeros(len(frame_times), dtype=bool)
+    candidate_indexes = np.flatnonzero(candidates)
+    _, first = np.unique(slots[candidate_indexes], return_index=True)
+    selected[candidate_indexes[first]] = True
+    return selected
+
+
+def select_by_distance(distances: np.ndarray, candidates: np.ndarray, min_distance: float,
+                       last_distance: Optional[float] = None) -> np.ndarray:
+    """ Keeps only the frames separated by at least `min_distance` meters from the previous selected one.
+
+    :param distances: non-decreasing distance travelled until every frame in meters.
+    :param candidates: boolean mask with the frames that can be selected.
+    :param min_distance: minimum distance between two selected frames. With 0 every candidate is selected.
+    :param last_distance: distance of the last frame selected before this batch, if any.
+    :return: boolean mask with the selected frames.
+    """
+    if min_distance <= 0:
+        return candidates.copy()
+
+    candidate_indexes = np.flatnonzero(candidates)
+    candidate_distances = distances[candidate_indexes]
+    selected = np.zeros(len(candidates), dtype=bool)
+
+    position = 0
+    if last_distance is not None:
+        position = int(np.searchsorted(candidate_distances, last_distance + min_distance, side='left'))
+    while position < len(candidate_indexes):
+        selected[candidate_indexes[position]] = True
+        position = int(np.searchsorted(candidate_distances, candidate_distances[position] + min_distance,
+                                       side='left'))
+    return selected
+
+
+class FrameSelector:
+    """ Chooses which of the located frames are extracted.
+
+    A frame is extracted when the camera travelled at least `min_distance` meters since the
+    previous extracted frame and it is the first one in its slot of `interval` seconds.
+    """
+
+    def __init__(self, interval: float = 0, min_distance: float = 0):
+        """
+        :param interval: length in seconds of the slots with at most one frame. 0 to disable it.
+        :param min_distance: minimum meters between two extracted frames. 0 to disable it.
+        """
+        self.interval = interval
+        self.min_distance = min_distance
+        self._slot_start: Optional[float] = None
+        self._last_slot: Optional[int] = None
+        self._last_distance: Optional[float] = None
+
+    def select(self, frame_times: np.ndarray, distances: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """ Selects the frames to extract from a batch of consecutive frames.
+
+        :param frame_times: timestamps of the frames in seconds.
+        :param distances: distance travelled until every frame in meters.
+        :param candidates: boolean mask with the frames with a known position.
+        :return: boolean mask with the frames to extract.
+        """
+        if len(frame_times) == 0:
+            return candidates.copy()
+        if self._slot_start is None:
+            self._slot_start = frame_times[0]
+
+        if self.interval > 0 and self.min_distance > 0:
+            selected = self._select_by_slot_and_distance(frame_times, distances, candidates)
+        elif self.interval > 0:
+            selected = select_by_interval(frame_times, candidates, self.interval, self._slot_start)
+            if self._last_slot is not None:
+                slots = np.floor((frame_times - self._slot_start) / self.interval)
+                selected &= slots > self._last_slot
+        else:
+            selected = select_by_distance(distances, candidates, self.min_distance, self._last_distance)
+
+        chosen = np.flatnonzero(selected)
+        if len(chosen):
+            self._remember(frame_times[chosen[-1]], distances[chosen[-1]])
+        return selected
+
+    def accept(self, frame_time: float, distance: float) -> bool:
+        """ Decides if a single frame, after the ones already selected, is extracted. """
+        if self._slot_start is None:
+            self._slot_start = frame_time
+        if self._last_distance is not None and distance - self._last_distance < self.min_distance:
+            return False
+        if self.interval > 0 and self._last_slot is not None and \
+                (frame_time - self._slot_start) // self.interval <= self._last_slot:
+            return False
+
+        self._remember(frame_time, distance)
+        return True
+
+    def _select_by_slot_and_distance(self, frame_times: np.ndarray, distances: np.ndarray,
+                                     candidates: np.ndarray) -> np.ndarray:
+        """ Selects the frames as `accept` does, chaining every frame to the last one extracted.
+
+        The slots and the distances of the candidates never decrease, so the next frame extracted is the
+        first one after both the end of the slot and the minimum distance of the last one.
+        """
+        candidate_indexes = np.flatnonzero(candidates)
+        candidate_distances = distances[candidate_indexes]
+        candidate_slots = np.floor((frame_times[candidate_indexes] - self._slot_start) / self.interval)
+        selected = np.zeros(len(candidates), dtype=bool)
+
+        def next_position(last_slot: Optional[float], last_distance: Optional[float]) -> int:
+            position = 0
+            if last_slot is not None:
+                position = int(np.searchsorted(candidate_slots, last_slot + 1, side='left'))
+            if last_distance is not None:
+                position = max(position, int(np.searchsorted(candidate_distances, last_distance + self.min_distance,
+                                                              side='left')))
+            return position
+
+        position = next_position(self._last_slot, self._last_distance)
+        while position < len(candidate_indexes):
+            selected[candidate_indexes[position]] = True
+            position = next_position(candidate_slots[position], candidate_distances[position])
+        return selected
+
+    def _remember(self, frame_time: float, distance: float) -> None:
+        self._last_distance = float(distance)
+        if self.interval > 0:
+            self._last_slot = int((frame_time - self._slot_start) // self.interval)
+
+
+class FrameBufferPool:
+    """ Bounded set of images that are decoded into again once they are released.
+
+    Every decoded image of a 4K video takes around 25 MB, so allocating one per frame churns the
+    allocator and makes the RSS jump. With a pool, the decoder reuses the images released by the
+    later stages and the memory stays constant however long the video is.
+
+    `acquire` never blocks: when every image is in use it returns None and the decoder allocates a
+    new image, which is kept when it is released if the pool is not full. The images must not be
+    used after releasing them.
+    """
+
+    def __init__(self, size: int):
+        """
+        :param size: maximum number of released images kept for reuse.
+        """
+        self.size = max(1, size)
+        self._free: List[np.ndarray] = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Optional[np.ndarray]:
+        with self._lock:
+            return self._free.pop() if self._free else None
+
+    def release(self, image: Optional[np.ndarray]) -> None:
+        if image is None:
+            return
+        with self._lock:
+            if len(self._free) < self.size:
+                self._free.append(image)
+
+
+def sample_frames(cap: VideoDecoder, selected: np.ndarray,
+                  pool: Optional[FrameBufferPool] = None) -> Iterator[Tuple[int, Optional[np.ndarray]]]:
+    """ Iterates over the frames of a video retrieving only the images of the selected ones.
+
+    The frames that are not selected are advanced with `grab`, which skips the conversion of the
+    frame to a BGR image and its copy. The frames after the end of the mask are always retrieved.
+
+    :param cap: opened decoder positioned at the first frame of the mask.
+    :param selected: boolean mask with the frames to decode.
+    :param pool: images to decode into. The caller releases every returned image once it is done with it.
+    :return: iterator of (position in the mask, image) where the image is None for skipped frames.
+    """
+    position = 0
+    while True:
+        if position < len(selected) and not selected[position]:
+            if not cap.grab():
+                return
+            yield position, None
+        else:
+            buffer = pool.acquire() if pool is not None else None
+            success, image = cap.read(buffer)
+            if not success:
+                if pool is not None:
+                    pool.release(buffer)
+                return
+            yield position, image
+        position += 1
+
+
+def split_segments(start: int, stop: int, segments: int, keyframes: Optional[np.ndarray] = None,
+                   windows: Optional[np.ndarray] = None) -> List[Tuple[int, int]]:
+    """ Splits a range of frames in segments of similar length that can be processed independently.
+
+    Every boundary is moved to the closest keyframe, so the decoder of a segment starts decoding at
+    its first frame, and then after the end of the sharpest frame window it cuts, if any, so every
+    window is considered by a single segment.
+
+    :param start: first position of the range.
+    :param stop: end of the range, not included.
+    :param segments: number of segments.
+    :param keyframes: sorted positions of the keyframes. None to split at any frame.
+    :param windows: sharpest frame window of every position, see `assign_windows`, or None.
+    :return: (start, stop) of every segment, fewer than `segments` when several boundaries meet.
+    """
+    bounds = np.linspace(start, stop, max(1, segments) + 1).round().astype(np.int64)[1:-1]
+    if keyframes is not None and len(keyframes) and len(bounds):
+        after = np.clip(np.searchsorted(keyframes, bounds), 0, len(keyframes) - 1)
+        before = np.clip(after - 1, 0, len(keyframes) - 1)
+        closer = np.abs(keyframes[before] - bounds) <= np.abs(keyframes[after] - bounds)
+        bounds = np.where(closer, keyframes[before], keyframes[after])
+
+    cuts = []
+    for bound in bounds.tolist():
+        if windows is not None and start < bound < min(stop, len(windows)) and windows[bound - 1] >= 0 and \
+                windows[bound] == windows[bound - 1]:
+            bound = int(np.flatnonzero(windows == windows[bound])[-1]) + 1
+        if start < bound < stop and (not cuts or bound > cuts[-1]):
+            cuts.append(bound)
+    return list(zip([start] + cuts, cuts + [stop]))
+
+
+def spread_frames(first_frame: int, frame_count: int, num_frames: int) -> np.ndarray:
+    """ Chooses frames evenly spaced across a video.
+
+    The video is split in `num_frames` segments of the same length and the frame in the middle of
+    every segment is chosen, so the first and last frames, often black or cut, are avoided.
+
+    :param first_frame: first frame that can be chosen.
+    :param frame_count: number of frames of the video.
+    :param num_frames: number of frames to choose.
+    :return: sorted frame numbers, fewer than `num_frames` when the video is shorter.
+    """
+    if num_frames <= 0 or frame_count <= first_frame:
+        return np.zeros(0, dtype=np.int64)
+    span = frame_count - first_frame
+    return np.unique(first_frame + ((np.arange(num_frames) + 0.5) * span / num_frames).astype(np.int64))
+
+
+def seek_frames(cap: VideoDecoder, frame_nums: Sequence[int],
+                pool: Optional[FrameBufferPool] = None) -> Iterator[Tuple[int, np.ndarray]]:
+    """ Decodes only the given frames of a video, seeking to each one.
+
+    Every frame is reached with a seek to its previous keyframe and a short forward decode, so the
+    time depends on the number of frames and not on the length of the video. The frames close after
+    the previous one are reached decoding forward.
+
+    :param cap: opened decoder positioned at the first frame of the video.
+    :param frame_nums: sorted frame numbers to decode.
+    :param pool: images to decode into. The caller releases every returned image once it is done with it.
+    :return: iterator of (frame number, image). The frames that could not be decoded are not returned.
+    """
+    # Frame returned by the next grab, None when unknown after a failed read
+    position: Optional[int] = 0
+    for frame_num in frame_nums:
+        if position is None or not 0 <= frame_num - position <= MAX_FORWARD_GRABS:
+            cap.seek(frame_num)
+            position = frame_num
+        while position < frame_num and cap.grab():
+            position += 1
+
+        buffer = pool.acquire() if pool is not None else None
+        success, image = cap.read(buffer) if position == frame_num else (False, None)
+        if not success:
+            if pool is not None:
+                pool.release(buffer)
+            position = None
+            continue
+        position += 1
+        yield frame_num, image
@@ -0,0 +1,277 @@
+import datetime
+import math
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+import piexif
+from loguru import logger
+
+from src.frame_container import FrameContainer
+from src.gpx_track import GpxPoint
+from src.stage_metrics import StageMetrics
+
+CAMERA_MAKE = 'apeman'
+CAMERA_MODEL = 'a80'
+
+EXIF_TIME_FORMAT = '%Y:%m:%d %H:%M:%S.%f'
+
+JPEG_SOI = b'\xff\xd8'
+JPEG_APP0 = b'\xff\xe0'
+JPEG_APP1 = b'\xff\xe1'
+
+
+class EncodingProfile:
+    """ Transformations and JPEG options applied to the frames before writing them.
+
+    The frame is cropped first, then resized so its long edge is not bigger than `max_size` and
+    finally encoded with the given quality and Huffman options.
+    """
+
+    def __init__(self, name: str, jpg_quality: int = 100, max_size: Optional[int] = None,
+                 crop: Optional[Tuple[int, int, int, int]] = None, progressive: bool = False,
+                 optimize: bool = False):
+        """
+        :param name: name of the profile.
+        :param jpg_quality: int between 0 and 100 where higher means better.
+        :param max_size: maximum size in pixels of the long edge of the frame. None to keep the size.
+        :param crop: rectangle of the frame to keep as (x, y, width, height). None to keep the whole frame.
+        :param progressive: writes progressive JPEG files.
+        :param optimize: computes optimal Huffman tables, which reduces the size without losing quality.
+        """
+        self.name = name
+        self.jpg_quality = jpg_quality
+        self.max_size = max_size
+        self.crop = crop
+        self.progressive = progressive
+        self.optimize = optimize
+
+    def with_crop(self, crop: Optional[Tuple[int, int, int, int]]) -> 'EncodingProfile':
+        """ Returns a copy of the profile cropping the given rectangle. """
+        return EncodingProfile(self.name, self.jpg_quality, self.max_size, crop, self.progressive, self.optimize)
+
+    def check_crop(self, width: int, height: int) -> None:
+        """ Raises a `ValueError` if the crop of the profile is not inside frames of the given size. """
+        if self.crop is None:
+            return
+        x, y, crop_width, crop_height = self.crop
+        if x < 0 or y < 0 or x + crop_width > width or y + crop_height > height:
+            raise ValueError(f'The crop `{x},{y},{crop_width},{crop_height}` is not inside the {width}x{height} '
+                             f'frames of the video.')
+
+    def encode_params(self) -> List[int]:
+        params = []
+        if 0 <= self.jpg_quality <= 100:
+            params += [int(cv2.IMWRITE_JPEG_QUALITY), self.jpg_quality]
+        if self.progressive:
+            params += [int(cv2.IMWRITE_JPEG_PROGRESSIVE), 1]
+        if self.optimize:
+            params += [int(cv2.IMWRITE_JPEG_OPTIMIZE), 1]
+        return params
+
+    def transform(self, image: np.ndarray) -> np.ndarray:
+        """ Applies the crop and the resize of the profile to the decoded frame. """
+        if self.crop is not None:
+            x, y, width, height = self.crop
+            image = image[max(0, y):y + height, max(0, x):x + width]
+
+        if self.max_size:
+            long_edge = max(image.shape[:2])
+            if long_edge > self.max_size:
+                scale = self.max_size / long_edge
+                size = (max(1, int(round(image.shape[1] * scale))), max(1, int(round(image.shape[0] * scale))))
+                image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return image
+
+    def __repr__(self) -> str:
+        return f'EncodingProfile({self.name}, quality={self.jpg_quality}, max_size={self.max_size}, ' \
+               f'crop={self.crop}, progressive={self.progressive}, optimize={self.optimize})'
+
+
+ENCODING_PROFILES: Dict[str, EncodingProfile] = {
+    # Same output as the original implementation
+    'original': EncodingProfile('original', jpg_quality=100),
+    'high': EncodingProfile('high', jpg_quality=95, optimize=True),
+    'upload': EncodingProfile('upload', jpg_quality=90, max_size=2560, optimize=True),
+    'compact': EncodingProfile('compact', jpg_quality=85, max_size=1920, progressive=True, optimize=True),
+}
+
+DEFAULT_ENCODING_PROFILE = 'original'
+
+
+def parse_crop(text: str) -> Tuple[int, int, int, int]:
+    """ Parses a crop rectangle written as `x,y,width,height`. """
+    values = [int(value) for value in text.split(',')]
+    if len(values) != 4 or values[2] <= 0 or values[3] <= 0:
+        raise ValueError(f'The crop must be `x,y,width,height` with positive width and height. Received: {text}.')
+    return values[0], values[1], values[2], values[3]
+
+
+def decimal_to_dms(value: float, precision: int) -> Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int]]:
+    """ Converts decimal degrees to the degrees, minutes and seconds rationals of the EXIF GPS tags. """
+    degrees = math.floor(value)
+    minutes = math.floor((value - degrees) * 60)
+    seconds = math.floor((value - degrees - minutes / 60) * 3600 * precision)
+    return (degrees, 1), (minutes, 1), (seconds, precision)
+
+
+def build_exif_segment(frame_timestamp: datetime.datetime, gpx_point: GpxPoint, make: str = CAMERA_MAKE,
+                       model: str = CAMERA_MODEL) -> bytes:
+    """ Builds the APP1 segment with the EXIF of a frame.
+
+    The tags and their encoding are the same ones written by `mapillary_tools.exif_write.ExifEdit`,
+    so the images can be read back by mapillary_tools and by the upload-scripts.
+
+    :param frame_timestamp: timestamp of the frame.
+    :param gpx_point: position of the frame as (time, latitude, longitude, altitude).
+    :param make: camera make.
+    :param model: camera model.
+    :return: the complete segment, including its marker and length.
+    """
+    _, latitude, longitude, altitude = gpx_point
+    gps = {piexif.GPSIFD.GPSLatitudeRef: 'N' if latitude > 0 else 'S',
+           piexif.GPSIFD.GPSLongitudeRef: 'E' if longitude > 0 else 'W',
+           piexif.GPSIFD.GPSLongitude: decimal_to_dms(abs(longitude), 10 ** 7),
+           piexif.GPSIFD.GPSLatitude: decimal_to_dms(abs(latitude), 10 ** 7)}
+    if not math.isnan(altitude):
+        gps[piexif.GPSIFD.GPSAltitude] = (int(abs(altitude) * 100), 100)
+        gps[piexif.GPSIFD.GPSAltitudeRef] = 0 if altitude > 0 else 1
+
+    exif = {'0th': {piexif.ImageIFD.Orientation: 1,
+                    piexif.ImageIFD.Make: make,
+                    piexif.ImageIFD.Model: model},
+            'Exif': {piexif.ExifIFD.DateTimeOriginal: frame_timestamp.strftime(EXIF_TIME_FORMAT)[:-3]},
+            'GPS': gps,
+            'Interop': {},
+            '1st': {},
+            'thumbnail': None}
+    exif_bytes = piexif.dump(exif)
+    return JPEG_APP1 + struct.pack('>H', len(exif_bytes) + 2) + exif_bytes
+
+
+class FrameWriter:
+    """ Writes geo-referenced frames as JPEG files with their EXIF in a single write.
+
+    The frame is encoded in memory and the EXIF segment is spliced right after the start of the
+    image, replacing the JFIF segment as `piexif.insert` does, so the file is written once and
+    never read back.
+    """
+
+    def __init__(self, profile: Optional[EncodingProfile] = None, make: str = CAMERA_MAKE,
+                 model: str = CAMERA_MODEL, metrics: Optional[StageMetrics] = None,
+                 container: Optional[FrameContainer] = None):
+        """
+        :param profile: encoding profile applied to the frames. By default, the `original` profile.
+        :param make: camera make written in the EXIF.
+        :param model: camera model written in the EXIF.
+        :param metrics: records the time spent encoding, building the EXIF and writing every frame.
+        :param container: appends the frames to this container, by the name of their path, instead of
+         writing a file per frame.
+        """
+        self.profile = profile if profile is not None else ENCODING_PROFILES[DEFAULT_ENCODING_PROFILE]
+        self.encode_params = self.profile.encode_params()
+        self.make = make
+        self.model = model
+        self.metrics = metrics if metrics is not None else StageMetrics(enabled=False)
+        self.container = container
+
+        # Statistics, updated from several threads in the pipelined mode
+        self._lock = threading.Lock()
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.encode_seconds = 0.0
+
+    def encode(self, image: np.ndarray) -> np.ndarray:
+        """ Applies the profile to the image and encodes it as JPEG in memory. """
+        start = time.perf_counter()
+        success, jpeg = cv2.imencode('.jpg', self.profile.transform(image), self.encode_params)
+        if not success:
+            raise ValueError('The frame could not be encoded as JPEG.')
+        elapsed = time.perf_counter() - start
+        self.metrics.stop('encode', start)
+        with self._lock:
+            self.encode_seconds += elapsed
+        return jpeg
+
+    def write_image(self, path: str, image: np.ndarray) -> int:
+        """ Encodes the image and writes it without EXIF.
+
+        :return: number of bytes written.
+        """
+        jpeg = self.encode(image)
+        logger.trace('Saving image in `{}`', path)
+        started = self.metrics.start()
+        self._store(path, [memoryview(jpeg).cast('B')])
+        self.metrics.stop('write', started)
+        self._count(len(jpeg))
+        return len(jpeg)
+
+    def summary(self) -> str:
+        """ Describes the average size and encoding time of the frames written so far. """
+        frames = max(1, self.frames_written)
+        return f'Encoding profile `{self.profile.name}`: {self.frames_written} frames, ' \
+               f'{self.bytes_written / frames / 1024:.1f} KiB/frame, ' \
+               f'{self.encode_seconds / frames * 1000:.2f} ms/frame encoding.'
+
+    def add_statistics(self, frames: int, num_bytes: int, encode_seconds: float) -> None:
+        """ Adds the frames written by another writer, e.g. one of a worker process. """
+        with self._lock:
+            self.frames_written += frames
+            self.bytes_written += num_bytes
+            self.encode_seconds += encode_seconds
+        self.metrics.count('frames_written', frames)
+        self.metrics.count('bytes_written', num_bytes)
+
+    def _store(self, path: Union[str, Path], chunks: Sequence[Union[bytes, memoryview]]) -> None:
+        if self.container is not None:
+            self.container.append(Path(path).name, chunks)
+            return
+        with open(path, 'wb') as output_file:
+            for chunk in chunks:
+                output_file.write(chunk)
+
+    def _count(self, num_bytes: int) -> None:
+        with self._lock:
+            self.frames_written += 1
+            self.bytes_written += num_bytes
+        self.metrics.count('frames_written')
+        self.metrics.count('bytes_written', num_bytes)
+
+    def write(self, path: str, image: np.ndarray, frame_timestamp: datetime.datetime, gpx_point: GpxPoint) -> int:
+        """ Encodes the image and writes it with its EXIF.
+
+        :return: number of bytes written.
+        """
+        return self.write_encoded(path, self.encode(image), frame_timestamp, gpx_point)
+
+    def write_encoded(self, path: str, jpeg: np.ndarray, frame_timestamp: datetime.datetime,
+                      gpx_point: GpxPoint) -> int:
+        """ Writes an already encoded JPEG adding the EXIF of the frame.
+
+        :return: number of bytes written.
+        """
+        data = memoryview(jpeg).cast('B')
+        if bytes(data[:2]) != JPEG_SOI:
+            raise ValueError('The encoded frame is not a JPEG image.')
+
+        # The JFIF segment is dropped as piexif does when inserting EXIF
+        body_start = 2
+        if bytes(data[2:4]) == JPEG_APP0:
+            body_start = 4 + struct.unpack('>H', data[4:6])[0]
+
+        started = self.metrics.start()
+        exif_segment = build_exif_segment(frame_timestamp, gpx_point, self.make, self.model)
+        self.metrics.stop('exif', started)
+
+        logger.trace('Saving image in `{}`', path)
+        started = self.metrics.start()
+        self._store(path, [JPEG_SOI, exif_segment, data[body_start:]])
+        self.metrics.stop('write', started)
+
+        num_bytes = 2 + len(exif_segment) + len(data) - body_start
+        self._count(num_bytes)
+        return num_bytes
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import numpy as np
+from loguru import logger
+
+from src.atomic_file import atomic_write
+from src.gpx_reader import read_gpx, local_utc_offset
+from src.gpx_track import GpxTrack
+
+DEFAULT_CACHE_PATH = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache'), 'action_cam_2_street_view', 'gpx')
+
+DEFAULT_CACHE_SIZE = 512 * 1024 * 1024
+
+INDEX_FILE_NAME = 'index.json'
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(path: Union[str, Path]) -> str:
+    """ Returns the hexadecimal BLAKE2 digest of the content of a file. """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class GpxCache:
+    """ Persistent cache of parsed GPX tracks.
+
+    Every track is stored as a `.npy` file with a 4xN float64 array (UTC time, latitude, longitude and
+    elevation) named after the hash of the GPX content, so it can be memory-mapped when loaded.
+    An index maps the path, size and modification time of the GPX files to their hash, which avoids
+    hashing unchanged files again.
+
+    The cache is bounded in size: when it grows over `max_bytes` the least recently used tracks are
+    removed.
+    """
+
+    def __init__(self, directory: Union[str, Path] = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_CACHE_SIZE):
+        """
+        :param directory: folder where the parsed tracks are stored.
+        :param max_bytes: maximum size of the stored tracks.
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def read(self, gpx_path: Union[str, Path], local_time: bool = True) -> GpxTrack:
+        """ Returns the track of a GPX file, parsing it only if it is not in the cache.
+
+        :param gpx_path: path of the GPX file.
+        :param local_time: converts the UTC times of the file to the local time of the machine.
+        """
+        track = self.load(gpx_path)
+        if track is None:
+            track = read_gpx(gpx_path, local_time=False)
+            self.store(gpx_path, track)
+
+        if local_time:
+            track = GpxTrack(track.times + local_utc_offset(), track.latitudes, track.longitudes, track.altitudes)
+        return track
+
+    def load(self, gpx_path: Union[str, Path]) -> Optional[GpxTrack]:
+        """ Returns the cached track, with UTC times, of a GPX file or None if it is not cached. """
+        content_hash = self._content_hash(gpx_path)
+        track_path = self._track_path(content_hash)
+        if not track_path.is_file():
+            logger.debug('The GPX file {} is not cached.', gpx_path)
+            return None
+
+        try:
+            data = np.load(track_path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            logger.warning('Ignoring corrupted cached track {}: {}', track_path, e)
+            return None
+
+        # The modification time is used to know which tracks were used recently
+        os.utime(track_path)
+        logger.debug('Loaded the GPX file {} from the cache {}.', gpx_path, track_path)
+        return GpxTrack(data[0], data[1], data[2], data[3])
+
+    def store(self, gpx_path: Union[str, Path], track: GpxTrack) -> None:
+        """ Stores the track, with UTC times, parsed from a GPX file. """
+        content_hash = self._content_hash(gpx_path)
+        track_path = self._track_path(content_hash)
+        data = np.stack((track.times, track.latitudes, track.longitudes, track.altitudes))
+
+        with atomic_write(track_path, 'wb') as output_file:
+            np.save(output_file, data)
+        logger.debug('Stored the GPX file {} in the cache {}.', gpx_path, track_path)
+
+        self.evict()
+
+    def evict(self) -> None:
+        """ Removes the least recently used tracks until the cache fits in its maximum size. """
+        tracks = [(track_path.stat(), track_path) for track_path in self.directory.glob('*.npy')]
+        total = sum(stat.st_size for stat, _ in tracks)
+        for stat, track_path in sorted(tracks, key=lambda item: item[0].st_mtime):
+            if total <= self.max_bytes:
+                break
+            logger.debug('Removing {} from the GPX cache.', track_path)
+            track_path.unlink(missing_ok=True)
+            total -= stat.st_size
+
+    def clear(self) -> None:
+        """ Removes every cached track and the index. """
+        logger.info('Clearing the GPX cache in {}.', self.directory)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _track_path(self, content_hash: str) -> Path:
+        return Path(self.directory, f'{content_hash}.npy')
+
+    def _content_hash(self, gpx_path: Union[str, Path]) -> str:
+        gpx_path = Path(gpx_path).resolve()
+        stat = gpx_path.stat()
+        key = f'{gpx_path}|{stat.st_size}|{stat.st_mtime_ns}'
+
+        index = self._read_index()
+        if key not in index:
+            # Entries of evicted tracks are dropped when the index changes
+            index = {entry: content_hash for entry, content_hash in index.items()
+                     if self._track_path(content_hash).is_file()}
+            index[key] = file_hash(gpx_path)
+            self._write_index(index)
+        return index[key]
+
+    def _read_index(self) -> Dict[str, str]:
+        try:
+            with open(Path(self.directory, INDEX_FILE_NAME)) as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index: Dict[str, str]) -> None:
+        with atomic_write(Path(self.directory, INDEX_FILE_NAME)) as index_file:
+            json.dump(index, index_file)
@@ -0,0 +1,248 @@
+import datetime
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from loguru import logger
+
+from src.atomic_file import atomic_write
+from src.cam_geo_referencer import VIDEO_TIME_FORMAT
+from src.gpx_cache import GpxCache
+from src.gpx_reader import read_gpx, local_utc_offset
+from src.gpx_track import to_epoch
+from src.video_decoder import OpenCVDecoder
+
+LIBRARY_INDEX_FILE_NAME = '.gpx_index.json'
+LIBRARY_INDEX_VERSION = 1
+
+GPX_EXTENSION = '.gpx'
+
+
+class GpxEntry:
+    """ Summary of a GPX file of the library. The times are UTC seconds since the epoch. """
+
+    def __init__(self, path: str, size: int, mtime_ns: int, points: int, start: Optional[float] = None,
+                 end: Optional[float] = None, bbox: Optional[List[float]] = None):
+        """
+        :param path: path of the file relative to the library folder.
+        :param size: size of the file when it was indexed.
+        :param mtime_ns: modification time of the file when it was indexed.
+        :param points: number of points with time.
+        :param start: time of the first point.
+        :param end: time of the last point.
+        :param bbox: bounding box of the points as [min latitude, min longitude, max latitude, max longitude].
+        """
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.points = points
+        self.start = start
+        self.end = end
+        self.bbox = bbox
+
+    def overlap(self, start: float, end: float) -> float:
+        """ Seconds of the interval [start, end] covered by the track. """
+        return max(0.0, min(end, self.end) - max(start, self.start))
+
+    def __repr__(self) -> str:
+        return f'GpxEntry({self.path}, {self.points} points, {self.start} - {self.end})'
+
+
+class IntervalTree:
+    """ Static interval tree answering which intervals overlap a query interval.
+
+    The intervals are sorted by start and stored as an implicit balanced binary tree where every node,
+    the middle of a range, keeps the maximum end of its subtree. A query visits only the subtrees that
+    can contain overlapping intervals, so it costs O(log n + k) for k results.
+    """
+
+    def __init__(self, intervals: List[Tuple[float, float, object]]):
+        """
+        :param intervals: (start, end, value) of every interval.
+        """
+        intervals = sorted(intervals, key=lambda interval: interval[0])
+        self.starts = np.array([interval[0] for interval in intervals], dtype=np.float64)
+        self.ends = np.array([interval[1] for interval in intervals], dtype=np.float64)
+        self.values = [interval[2] for interval in intervals]
+        self.max_ends = np.empty_like(self.ends)
+        self._build(0, len(intervals))
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def _build(self, low: int, high: int) -> float:
+        if low >= high:
+            return -np.inf
+        middle = (low + high) // 2
+        self.max_ends[middle] = max(self.ends[middle], self._build(low, middle), self._build(middle + 1, high))
+        return self.max_ends[middle]
+
+    def overlapping(self, start: float, end: float) -> List[object]:
+        """ Values of the intervals that overlap [start, end], sorted by the start of the intervals. """
+        found: List[int] = []
+        stack = [(0, len(self.values))]
+        while stack:
+            low, high = stack.pop()
+            if low >= high:
+                continue
+            middle = (low + high) // 2
+            # No interval of the subtree ends after the query starts
+            if self.max_ends[middle] < start:
+                continue
+            stack.append((low, middle))
+            # The intervals to the right start after the middle one
+            if self.starts[middle] <= end:
+                if self.ends[middle] >= start:
+                    found.append(middle)
+                stack.append((middle + 1, high))
+        return [self.values[i] for i in sorted(found)]
+
+
+class GpxLibrary:
+    """ Index of the GPX files in a folder to find the tracks recorded during a video.
+
+    The start and end time, number of points and bounding box of every file are stored in an index
+    inside the folder. When the library is refreshed only the new or modified files are parsed, and
+    the removed ones are dropped.
+    """
+
+    def __init__(self, directory: Union[str, Path], gpx_cache: Optional[GpxCache] = None):
+        """
+        :param directory: folder with the GPX files. The subfolders are included.
+        :param gpx_cache: cache used to parse the GPX files. None to parse them directly.
+        """
+        self.directory = Path(directory)
+        if not self.directory.is_dir():
+            raise FileNotFoundError(f'The GPX folder could not be found. Search path: {directory}.')
+        self.gpx_cache = gpx_cache
+        self.entries: Dict[str, GpxEntry] = self._read_index()
+        self._tree: Optional[IntervalTree] = None
+
+    @property
+    def index_path(self) -> Path:
+        return Path(self.directory, LIBRARY_INDEX_FILE_NAME)
+
+    def refresh(self) -> None:
+        """ Updates the index with the files added, modified or removed since the last refresh. """
+        entries = {}
+        parsed = 0
+        for gpx_path in sorted(self.directory.rglob('*')):
+            if gpx_path.suffix.lower() != GPX_EXTENSION or not gpx_path.is_file():
+                continue
+            name = gpx_path.relative_to(self.directory).as_posix()
+            stat = gpx_path.stat()
+            entry = self.entries.get(name)
+            if entry is None or entry.size != stat.st_size or entry.mtime_ns != stat.st_mtime_ns:
+                try:
+                    entry = self._index_file(gpx_path, name, stat)
+                except Exception as e:
+                    # Kept without points so it is not parsed again until it changes
+                    logger.warning('Ignoring the GPX file {}, it could not be read: {}', gpx_path, e)
+                    entry = GpxEntry(name, stat.st_size, stat.st_mtime_ns, 0)
+                parsed += 1
+            entries[name] = entry
+
+        changed = parsed > 0 or entries.keys() != self.entries.keys()
+        self.entries = entries
+        self._tree = None
+        if changed:
+            self._write_index()
+        logger.info('GPX library {} has {} files, {} of them indexed again.', self.directory, len(entries), parsed)
+
+    def find(self, start: float, end: float) -> List[GpxEntry]:
+        """ Returns the tracks overlapping an interval, the most overlapping first.
+
+        :param start: start of the interval as UTC seconds since the epoch.
+        :param end: end of the interval as UTC seconds since the epoch.
+        """
+        if self._tree is None:
+            self._tree = IntervalTree([(entry.start, entry.end, entry) for entry in self.entries.values()
+                                       if entry.points > 0])
+        entries = self._tree.overlapping(start, end)
+        return sorted(entries, key=lambda entry: entry.overlap(start, end), reverse=True)
+
+    def find_for_video(self, video_path: Union[str, Path], time_lapse: float = 1,
+                       sync_error: float = 0) -> List[GpxEntry]:
+        """ Returns the tracks recorded during a video, the most overlapping first.
+
+        The start of the video is taken from its name, see `VIDEO_TIME_FORMAT`, and its duration is the
+        number of frames multiplied by the time between frames.
+
+        :param video_path: path of the video.
+        :param time_lapse: time between frames in the video.
+        :param sync_error: synchronization error between the video and GPX files in seconds.
+        """
+        video_path = Path(video_path)
+        video_creation_time = datetime.datetime.strptime(video_path.stem, VIDEO_TIME_FORMAT)
+        cap = OpenCVDecoder(video_path)
+        duration = cap.frame_count * time_lapse
+        cap.release()
+
+        # The videos are named with the local time and the index is in UTC
+        start = to_epoch(video_creation_time) + sync_error - local_utc_offset()
+        return self.find(start, start + duration)
+
+    def path(self, entry: GpxEntry) -> Path:
+        return Path(self.directory, entry.path)
+
+    def _index_file(self, gpx_path: Path, name: str, stat: os.stat_result) -> GpxEntry:
+        if self.gpx_cache is not None:
+            track = self.gpx_cache.read(gpx_path, local_time=False)
+        else:
+            track = read_gpx(gpx_path, local_time=False)
+
+        if len(track) == 0:
+            return GpxEntry(name, stat.st_size, stat.st_mtime_ns, 0)
+        bbox = [float(np.nanmin(track.latitudes)), float(np.nanmin(track.longitudes)),
+                float(np.nanmax(track.latitudes)), float(np.nanmax(track.longitudes))]
+        return GpxEntry(name, stat.st_size, stat.st_mtime_ns, len(track), float(track.times[0]),
+                        float(track.times[-1]), bbox)
+
+    def _read_index(self) -> Dict[str, GpxEntry]:
+        try:
+            with open(self.index_path) as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+        if index.get('version') != LIBRARY_INDEX_VERSION:
+            return {}
+        return {entry['path']: GpxEntry(**entry) for entry in index['entries']}
+
+    def _write_index(self) -> None:
+        index = {'version': LIBRARY_INDEX_VERSION, 'entries': [vars(entry) for entry in self.entries.values()]}
+        try:
+            with atomic_write(self.index_path) as index_file:
+                json.dump(index, index_file)
+        except OSError as e:
+            logger.warning('The index of the GPX library could not be written in {}: {}', self.index_path, e)
+
+
+def resolve_gpx_path(video_path: Union[str, Path], gpx_path: Union[str, Path], time_lapse: float = 1,
+                     sync_error: float = 0, gpx_cache: Optional[GpxCache] = None) -> Path:
+    """ Returns the GPX file to use with a video.
+
+    If `gpx_path` is a file, it is returned as is. If it is a folder, the file whose track overlaps the
+    most with the video is chosen from the library in that folder.
+
+    :param video_path: path of the video.
+    :param gpx_path: path of a GPX file or of a folder with GPX files.
+    :param time_lapse: time between frames in the video.
+    :param sync_error: synchronization error between the video and GPX files in seconds.
+    :param gpx_cache: cache used to parse the GPX files.
+    """
+    gpx_path = Path(gpx_path)
+    if not gpx_path.is_dir():
+        return gpx_path
+
+    library = GpxLibrary(gpx_path, gpx_cache)
+    library.refresh()
+    entries = library.find_for_video(video_path, time_lapse, sync_error)
+    if not entries:
+        raise FileNotFoundError(f'No GPX file in {gpx_path} was recorded during the video {video_path}.')
+    if len(entries) > 1:
+        logger.warning('{} GPX files overlap with the video, using the one that covers it the most. Others: {}',
+                       len(entries), [entry.path for entry in entries[1:]])
+    logger.info('Using the GPX file {} for the video {}.', entries[0].path, video_path)
+    return library.path(entries[0])
@@ -0,0 +1,111 @@
+import numpy as np
+from loguru import logger
+
+from src.gpx_track import GpxTrack
+
+NO_MATCH = -1
+
+
+class GpxMatcher:
+    """ Matches frame timestamps with the points of a GPX track.
+
+    Each frame is matched with the point with the lowest time difference, as long as the difference
+    is not greater than the tolerance. When two points are at the same distance the later one is
+    taken. Every point is used at most once and the matching only moves forward: after a frame is
+    matched with a point, the following frames can only be matched with later points.
+
+    The matcher keeps a cursor with the first point that can still be used, so consecutive calls to
+    `match` continue where the previous one finished.
+    """
+
+    def __init__(self, track: GpxTrack, tolerance: float = 1.0):
+        """
+        :param track: GPX track with the points to match.
+        :param tolerance: maximum time difference in seconds between a frame and its point.
+        """
+        self.track = track
+        self.tolerance = tolerance
+        self.cursor = 0
+
+    def skip(self, num_points: int) -> None:
+        """ Discards the given number of points from the current cursor position. """
+        self.cursor = min(self.cursor + max(0, num_points), len(self.track))
+
+    def nearest(self, timestamps: np.ndarray) -> np.ndarray:
+        """ Returns the index of the closest point for every timestamp without any restriction.
+
+        :param timestamps: times in seconds since the epoch.
+        :return: array of indexes in the track.
+        """
+        times = self.track.times
+        right = np.searchsorted(times, timestamps, side='right')
+        right = np.clip(right, 1, len(times) - 1)
+        left = right - 1
+        # Among points with the same time the last one is taken, as it is the later in the track
+        right = np.searchsorted(times, times[right], side='right') - 1
+        left_diff = np.abs(timestamps - times[left])
+        right_diff = np.abs(times[right] - timestamps)
+        # In case of draw the later point wins
+        return np.where(right_diff <= left_diff, right, left)
+
+    def match(self, timestamps: np.ndarray) -> np.ndarray:
+        """ Matches a batch of increasing frame timestamps with the track.
+
+        :param timestamps: times of the frames in seconds since the epoch.
+        :return: array with the index of the matched point for every frame or `NO_MATCH`.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        result = np.full(len(timestamps), NO_MATCH, dtype=np.int64)
+        if len(timestamps) == 0 or self.cursor >= len(self.track):
+            return result
+
+        if len(self.track) == 1:
+            candidates = np.zeros(len(timestamps), dtype=np.int64)
+        else:
+            candidates = self.nearest(timestamps)
+
+        within = np.abs(self.track.times[candidates] - timestamps) <= self.tolerance
+        matched = np.flatnonzero(within)
+        matched_points = candidates[matched]
+
+        if len(matched) == 0:
+            return result
+
+        if matched_points[0] >= self.cursor and np.all(np.diff(matched_points) > 0):
+            # Fast path: no point is claimed by two frames, so the nearest point is the final match
+            result[matched] = matched_points
+            self.cursor = int(matched_points[-1]) + 1
+        else:
+            self._match_sequentially(timestamps, candidates, within, result)
+
+        logger.debug('Matched {} of {} frames with the GPX track.', int(np.count_nonzero(result != NO_MATCH)),
+                     len(timestamps))
+        return result
+
+    def _match_sequentially(self, timestamps: np.ndarray, candidates: np.ndarray, within: np.ndarray,
+                            result: np.ndarray) -> None:
+        # Frames without any point within the tolerance can never be matched, the rest is resolved one
+        # match at a time. Before the first frame whose nearest point is still available, frames can only
+        # be matched with the point at the cursor, which is the closest remaining one.
+        times = self.track.times
+        num_points = len(times)
+        frames = np.flatnonzero(within)
+        frame_times = timestamps[frames]
+        frame_points = candidates[frames]
+
+        cursor, position = self.cursor, 0
+        while position < len(frames) and cursor < num_points:
+            available = max(position, int(np.searchsorted(frame_points, cursor, side='left')))
+            closest = max(position, int(np.searchsorted(frame_times, times[cursor] - self.tolerance, side='left')))
+            if closest < available and abs(times[cursor] - frame_times[closest]) <= self.tolerance:
+                frame = closest
+                point = int(np.searchsorted(times, times[cursor], side='right')) - 1
+            elif available < len(frames):
+                frame = available
+                point = int(frame_points[available])
+            else:
+                break
+
+            result[frames[frame]] = point
+            cursor, position = point + 1, frame + 1
+        self.cursor = cursor
@@ -0,0 +1,128 @@
+import datetime
+import re
+import xml.etree.ElementTree as ElementTree
+from array import array
+from pathlib import Path
+from typing import Dict, List, Union
+
+import numpy as np
+from loguru import logger
+
+from src.gpx_track import GpxTrack
+
+POINT_TAGS = ('trkpt', 'wpt')
+
+TIME_BATCH_SIZE = 65536
+
+_TIME_ZONE_RE = re.compile(r'(Z|[+-]\d{2}:?\d{2})$')
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def local_utc_offset() -> float:
+    """ Seconds to add to a UTC time to obtain the local time of the machine. """
+    now = datetime.datetime.now()
+    return round((now - datetime.datetime.utcnow()).total_seconds())
+
+
+def parse_gpx_times(texts: List[str]) -> np.ndarray:
+    """ Converts ISO 8601 times, as written in GPX files, to UTC seconds since the epoch.
+
+    The times without time zone are considered UTC.
+
+    :param texts: times in text format.
+    :return: float64 array with the times.
+    """
+    offsets = np.zeros(len(texts))
+    naive_texts = []
+    for i, text in enumerate(texts):
+        text = text.strip()
+        if text.endswith('Z'):
+            naive_texts.append(text[:-1])
+            continue
+
+        zone = _TIME_ZONE_RE.search(text[10:])
+        if zone:
+            suffix = zone.group(1)
+            if suffix != 'Z':
+                sign = -1 if suffix[0] == '-' else 1
+                digits = suffix[1:].replace(':', '')
+                offsets[i] = sign * (int(digits[:2]) * 3600 + int(digits[2:]) * 60)
+            text = text[:len(text) - len(suffix)]
+        naive_texts.append(text)
+
+    microseconds = np.array(naive_texts, dtype='datetime64[us]').astype(np.int64)
+    return microseconds / 1e6 - offsets
+
+
+def read_gpx(path: Union[str, Path], local_time: bool = True) -> GpxTrack:
+    """ Reads the points of a GPX file incrementally into a `GpxTrack`.
+
+    The file is parsed as a stream and every point is removed from the tree once it has been read,
+    so the memory used does not depend on the size of the file apart from the compact arrays with
+    the result. The points of every track and segment are read, as well as the waypoints. Points
+    without time are ignored.
+
+    :param path: path of the GPX file.
+    :param local_time: converts the UTC times of the file to the local time of the machine, which is
+     the time used by the cameras to name the videos.
+    :return: track with all the points sorted by time.
+    """
+    latitudes, longitudes, altitudes = array('d'), array('d'), array('d')
+    time_chunks: List[np.ndarray] = []
+    pending_times: List[str] = []
+
+    # The local name of every tag, without the namespace, is computed only once
+    names: Dict[str, str] = {}
+    open_elements = []
+    for event, element in ElementTree.iterparse(str(path), events=('start', 'end')):
+        if event == 'start':
+            open_elements.append(element)
+            continue
+
+        open_elements.pop()
+        tag = element.tag
+        name = names.get(tag)
+        if name is None:
+            name = names[tag] = _local_name(tag)
+
+        if name in POINT_TAGS:
+            time_text, elevation = None, 'nan'
+            for child in element:
+                child_name = names.get(child.tag)
+                if child_name is None:
+                    child_name = names[child.tag] = _local_name(child.tag)
+                if child_name == 'time':
+                    time_text = child.text
+                elif child_name == 'ele' and child.text:
+                    elevation = child.text
+
+            if time_text:
+                attributes = element.attrib
+                latitudes.append(float(attributes['lat']))
+                longitudes.append(float(attributes['lon']))
+                altitudes.append(float(elevation))
+                pending_times.append(time_text)
+                if len(pending_times) >= TIME_BATCH_SIZE:
+                    time_chunks.append(parse_gpx_times(pending_times))
+                    pending_times = []
+
+            # The parent only holds points already read, so they are released at once
+            if open_elements:
+                open_elements[-1].clear()
+        elif name == 'trk' and open_elements:
+            open_elements[-1].clear()
+
+    if pending_times:
+        time_chunks.append(parse_gpx_times(pending_times))
+    times = np.concatenate(time_chunks) if time_chunks else np.zeros(0)
+    if local_time:
+        times += local_utc_offset()
+
+    logger.debug('Read {} points from the GPX file {}.', len(times), path)
+    return GpxTrack(times,
+                    np.frombuffer(latitudes, dtype=np.float64),
+                    np.frombuffer(longitudes, dtype=np.float64),
+                    np.frombuffer(altitudes, dtype=np.float64))
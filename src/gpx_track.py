@@ -0,0 +1,194 @@
+import datetime
+from typing import Optional, Tuple
+
+import numpy as np
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+EARTH_RADIUS = 6371008.8
+
+LINEAR_INTERPOLATION = 'linear'
+GREAT_CIRCLE_INTERPOLATION = 'great-circle'
+INTERPOLATION_MODES = (LINEAR_INTERPOLATION, GREAT_CIRCLE_INTERPOLATION)
+
+GpxPoint = Tuple[datetime.datetime, float, float, float]
+
+
+def to_epoch(timestamp: datetime.datetime) -> float:
+    """ Converts a naive datetime, as used for the video and the GPX times, to seconds since the epoch. """
+    return (timestamp - EPOCH).total_seconds()
+
+
+def from_epoch(seconds: float) -> datetime.datetime:
+    """ Converts seconds since the epoch to a naive datetime. """
+    return EPOCH + datetime.timedelta(seconds=float(seconds))
+
+
+def haversine(lat_a: np.ndarray, lon_a: np.ndarray, lat_b: np.ndarray, lon_b: np.ndarray) -> np.ndarray:
+    """ Great-circle distance in meters between two arrays of coordinates in degrees. """
+    lat_a, lon_a, lat_b, lon_b = map(np.radians, (lat_a, lon_a, lat_b, lon_b))
+    a = np.sin((lat_b - lat_a) / 2) ** 2 + np.cos(lat_a) * np.cos(lat_b) * np.sin((lon_b - lon_a) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def bearing(lat_a: np.ndarray, lon_a: np.ndarray, lat_b: np.ndarray, lon_b: np.ndarray) -> np.ndarray:
+    """ Initial bearing in degrees, clockwise from the north, from the first array of coordinates to the second. """
+    lat_a, lon_a, lat_b, lon_b = map(np.radians, (lat_a, lon_a, lat_b, lon_b))
+    x = np.sin(lon_b - lon_a) * np.cos(lat_b)
+    y = np.cos(lat_a) * np.sin(lat_b) - np.sin(lat_a) * np.cos(lat_b) * np.cos(lon_b - lon_a)
+    return np.degrees(np.arctan2(x, y)) % 360
+
+
+class FramePositions:
+    """ Positions assigned to a batch of frames.
+
+    Frames without position are marked as not valid and their coordinates are NaN.
+    """
+
+    def __init__(self, times: np.ndarray, latitudes: np.ndarray, longitudes: np.ndarray, altitudes: np.ndarray,
+                 valid: np.ndarray):
+        self.times = times
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.altitudes = altitudes
+        self.valid = valid
+
+    def __len__(self) -> int:
+        return len(self.valid)
+
+    def segment(self, start: int, stop: int) -> 'FramePositions':
+        """ Positions of the frames between `start` and `stop`. """
+        return FramePositions(self.times[start:stop], self.latitudes[start:stop], self.longitudes[start:stop],
+                              self.altitudes[start:stop], self.valid[start:stop])
+
+    def point(self, index: int) -> Optional[GpxPoint]:
+        """ Returns the position of the frame as a (time, latitude, longitude, altitude) tuple or None. """
+        if not self.valid[index]:
+            return None
+        return (from_epoch(self.times[index]), float(self.latitudes[index]), float(self.longitudes[index]),
+                float(self.altitudes[index]))
+
+
+class GpxTrack:
+    """ Columnar representation of a GPX track.
+
+    The points are stored in four NumPy arrays sorted by time: the time as seconds since the
+    epoch, the latitude, the longitude and the elevation of every point.
+    """
+
+    def __init__(self, times: np.ndarray, latitudes: np.ndarray, longitudes: np.ndarray, altitudes: np.ndarray):
+        if np.any(times[1:] < times[:-1]):
+            order = np.argsort(times, kind='stable')
+            times, latitudes, longitudes, altitudes = times[order], latitudes[order], longitudes[order], \
+                altitudes[order]
+        self.times = np.ascontiguousarray(times, dtype=np.float64)
+        self.latitudes = np.ascontiguousarray(latitudes, dtype=np.float64)
+        self.longitudes = np.ascontiguousarray(longitudes, dtype=np.float64)
+        self.altitudes = np.ascontiguousarray(altitudes, dtype=np.float64)
+        self._distances: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def point(self, index: int) -> GpxPoint:
+        """ Returns the point in the given position as a (time, latitude, longitude, altitude) tuple. """
+        return (from_epoch(self.times[index]), float(self.latitudes[index]), float(self.longitudes[index]),
+                float(self.altitudes[index]))
+
+    @property
+    def distances(self) -> np.ndarray:
+        """ Distance in meters travelled from the first point of the track until every point. """
+        if self._distances is None:
+            steps = haversine(self.latitudes[:-1], self.longitudes[:-1], self.latitudes[1:], self.longitudes[1:])
+            self._distances = np.concatenate(([0.0], np.cumsum(steps)))
+        return self._distances
+
+    def distance_at(self, timestamps: np.ndarray) -> np.ndarray:
+        """ Distance in meters travelled from the start of the track until every timestamp.
+
+        :param timestamps: times in seconds since the epoch.
+        """
+        if len(self) == 0:
+            return np.zeros(len(timestamps))
+        return np.interp(timestamps, self.times, self.distances)
+
+    def take(self, indexes: np.ndarray) -> FramePositions:
+        """ Returns the positions of the points in the given indexes. Negative indexes mean no point.
+
+        :param indexes: index in the track for every frame, e.g. the result of a `GpxMatcher`.
+        """
+        valid = indexes >= 0
+        safe_indexes = np.where(valid, indexes, 0)
+        return FramePositions(np.where(valid, self.times[safe_indexes], np.nan),
+                              np.where(valid, self.latitudes[safe_indexes], np.nan),
+                              np.where(valid, self.longitudes[safe_indexes], np.nan),
+                              np.where(valid, self.altitudes[safe_indexes], np.nan),
+                              valid)
+
+    def interpolate(self, timestamps: np.ndarray, max_gap: float = 5.0,
+                    mode: str = LINEAR_INTERPOLATION) -> FramePositions:
+        """ Computes the position at every timestamp interpolating between the surrounding points.
+
+        Timestamps out of the track, or between two points separated by more than `max_gap`
+        seconds, do not get a position. The altitude is always interpolated linearly.
+
+        :param timestamps: times in seconds since the epoch.
+        :param max_gap: maximum time in seconds between the two points used to interpolate.
+        :param mode: `linear` interpolates the coordinates directly and `great-circle` follows
+         the shortest path over the sphere between both points.
+        """
+        if mode not in INTERPOLATION_MODES:
+            raise ValueError(f'Unknown interpolation mode `{mode}`. Available modes: {INTERPOLATION_MODES}.')
+
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        nan = np.full(len(timestamps), np.nan)
+        if len(self) < 2:
+            return FramePositions(timestamps, nan, nan.copy(), nan.copy(), np.zeros(len(timestamps), dtype=bool))
+
+        right = np.clip(np.searchsorted(self.times, timestamps, side='right'), 1, len(self) - 1)
+        left = right - 1
+        gap = self.times[right] - self.times[left]
+        valid = (timestamps >= self.times[0]) & (timestamps <= self.times[-1]) & \
+                ((gap <= max_gap) | (timestamps == self.times[left]) | (timestamps == self.times[right]))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = np.where(gap > 0, (timestamps - self.times[left]) / gap, 0.0)
+        fraction = np.clip(fraction, 0.0, 1.0)
+
+        if mode == GREAT_CIRCLE_INTERPOLATION:
+            latitudes, longitudes = _slerp(self.latitudes[left], self.longitudes[left],
+                                           self.latitudes[right], self.longitudes[right], fraction)
+        else:
+            latitudes = self.latitudes[left] + fraction * (self.latitudes[right] - self.latitudes[left])
+            longitudes = self.longitudes[left] + fraction * (self.longitudes[right] - self.longitudes[left])
+        altitudes = self.altitudes[left] + fraction * (self.altitudes[right] - self.altitudes[left])
+
+        return FramePositions(timestamps,
+                              np.where(valid, latitudes, np.nan),
+                              np.where(valid, longitudes, np.nan),
+                              np.where(valid, altitudes, np.nan),
+                              valid)
+
+
+def _to_unit_vectors(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    lat, lon = np.radians(latitudes), np.radians(longitudes)
+    return np.stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)), axis=-1)
+
+
+def _slerp(lat_a: np.ndarray, lon_a: np.ndarray, lat_b: np.ndarray, lon_b: np.ndarray,
+           fraction: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Spherical linear interpolation between two arrays of coordinates. """
+    vector_a, vector_b = _to_unit_vectors(lat_a, lon_a), _to_unit_vectors(lat_b, lon_b)
+    omega = np.arccos(np.clip(np.sum(vector_a * vector_b, axis=-1), -1.0, 1.0))
+    sin_omega = np.sin(omega)
+
+    # For very close points the linear weights are used to avoid dividing by zero
+    close = sin_omega < 1e-12
+    safe_sin = np.where(close, 1.0, sin_omega)
+    weight_a = np.where(close, 1.0 - fraction, np.sin((1.0 - fraction) * omega) / safe_sin)
+    weight_b = np.where(close, fraction, np.sin(fraction * omega) / safe_sin)
+
+    vector = weight_a[:, None] * vector_a + weight_b[:, None] * vector_b
+    latitudes = np.degrees(np.arctan2(vector[:, 2], np.hypot(vector[:, 0], vector[:, 1])))
+    longitudes = np.degrees(np.arctan2(vector[:, 1], vector[:, 0]))
+    return latitudes, longitudes
@@ -0,0 +1,198 @@
+import importlib
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Optional, Set
+
+from loguru import logger
+
+from src.frame_pipeline import FrameConsumer
+
+# The folder of the upload scripts is not a valid module name
+upload_scripts = importlib.import_module('upload-scripts')
+constants = upload_scripts.constants
+LoginController = upload_scripts.LoginController
+OSCAPISubDomain = upload_scripts.OSCAPISubDomain
+OSCPhoto = upload_scripts.OSCPhoto
+OSCSequence = upload_scripts.OSCSequence
+OnlineIDDiscoverer = upload_scripts.OnlineIDDiscoverer
+OSCUploadProgressDiscoverer = upload_scripts.OSCUploadProgressDiscoverer
+sequence_container = upload_scripts.sequence_container
+
+SEQUENCE_ID_FILE_NAME = 'osc_sequence_id.txt'
+
+UPLOAD_WORKERS = 10
+UPLOAD_RETRIES = 10
+MAX_PENDING_UPLOADS = 100
+
+_STOP = object()
+
+
+class KartaViewStreamUploader(FrameConsumer):
+    """ Uploads the frames to KartaView while the video is still being geo-referenced.
+
+    The frames are uploaded with the position already computed for them, so the folder is not
+    discovered again and the EXIF of the images is not read. The online sequence is created with the
+    first frame, and the sequence id and the uploaded indexes are stored in the same files used by
+    `osc_tools.py upload`, so an interrupted upload can be resumed by both.
+
+    `submit` only queues the frames, the sequence is created and the frames are uploaded by the threads
+    of the uploader, so the ordered callback of the frame pipeline never waits for the network. At most
+    `max_pending` frames wait in the queue, `submit` blocks when there are more, so the disk usage stays
+    bounded when the uploaded frames are deleted.
+    """
+
+    def __init__(self, sequence_path: str, login_controller: Optional[LoginController] = None,
+                 workers: int = UPLOAD_WORKERS, max_pending: int = MAX_PENDING_UPLOADS,
+                 delete_uploaded: bool = False):
+        """
+        :param sequence_path: folder where the frames of the sequence are written.
+        :param login_controller: logged in controller of the KartaView API. None to log in production.
+        :param workers: number of concurrent uploads.
+        :param max_pending: maximum number of frames submitted and not uploaded yet.
+        :param delete_uploaded: deletes the frames once they are uploaded. They are not written again when
+         the geo-referencing is resumed.
+        """
+        self.sequence_path = str(sequence_path)
+        self.login_controller = login_controller or LoginController(OSCAPISubDomain.PRODUCTION)
+        self.user = self.login_controller.login()
+        self.osc_api = self.login_controller.osc_api
+        self.delete_uploaded = delete_uploaded
+
+        os.makedirs(self.sequence_path, exist_ok=True)
+        self.online_id = OnlineIDDiscoverer.discover(self.sequence_path)
+        self.progress = set(OSCUploadProgressDiscoverer.discover(self.sequence_path))
+
+        self.frames_uploaded = 0
+        self.bytes_uploaded = 0
+        self.failed = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._sequence_lock = threading.Lock()
+        self._sequence_error: Optional[Exception] = None
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._threads = [threading.Thread(target=self._run, name=f'kartaview-upload-{i}', daemon=True)
+                         for i in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def finished(self) -> bool:
+        return constants.UPLOAD_FINISHED in self.progress
+
+    @property
+    def succeeded(self) -> bool:
+        """ Whether every submitted frame was uploaded and the sequence finished, once the uploader is closed. """
+        return self.failed == 0 and (self.finished or self.online_id is None)
+
+    def removed_frames(self) -> Set[int]:
+        return {int(index) for index in self.progress if index.isdigit()}
+
+    def submit(self, index: int, path: str, frame_timestamp: Any, gpx_point: Any,
+               heading: Optional[float] = None) -> None:
+        if str(index) in self.progress:
+            return
+        self._queue.put((index, path, gpx_point[1], gpx_point[2], heading))
+
+    def close(self, complete: bool) -> None:
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        logger.info('{} frames uploaded to KartaView, {:.1f} MB at {:.2f} MB/s. {} uploads failed.',
+                    self.frames_uploaded, self.bytes_uploaded / 1e6, self.bytes_uploaded / 1e6 / elapsed, self.failed)
+
+        if not complete or self.online_id is None or self.finished:
+            return
+        if self.failed > 0:
+            logger.warning('The KartaView sequence {} is not finished, run `osc_tools.py upload -p {}` to retry the '
+                           'failed uploads.', self.online_id, self.sequence_path)
+            return
+
+        sequence = OSCSequence()
+        sequence.online_id = self.online_id
+        finished, _ = self.osc_api.finish_upload(sequence, self.user.access_token)
+        if finished:
+            self._persist_progress(constants.UPLOAD_FINISHED)
+            logger.info('KartaView sequence {} uploaded.', self.online_id)
+        else:
+            logger.warning('The KartaView sequence {} could not be finished.', self.online_id)
+
+    def _run(self) -> None:
+        while True:
+            frame = self._queue.get()
+            if frame is _STOP:
+                return
+            self._upload(*frame)
+
+    def _ensure_sequence(self, latitude: float, longitude: float) -> None:
+        """ Creates the online sequence with the first uploaded frame. A failure fails the rest of the frames. """
+        with self._sequence_lock:
+            if self._sequence_error is not None:
+                raise ConnectionError('The KartaView sequence could not be created.') from self._sequence_error
+            if self.online_id is None:
+                try:
+                    self._create_sequence(latitude, longitude)
+                except Exception as e:
+                    self._sequence_error = e
+                    raise
+
+    def _create_sequence(self, latitude: float, longitude: float) -> None:
+        osc_sequence = OSCSequence()
+        osc_sequence.local_id = self.sequence_path
+        osc_sequence.latitude = latitude
+        osc_sequence.longitude = longitude
+        online_id, error = self.osc_api.create_sequence(osc_sequence, self.user.access_token)
+        if error or online_id is None:
+            raise ConnectionError(f'The KartaView sequence could not be created: {error}')
+
+        self.online_id = online_id
+        with open(os.path.join(self.sequence_path, SEQUENCE_ID_FILE_NAME), 'w') as sequence_file:
+            json.dump({'id': str(online_id)}, sequence_file)
+        logger.info('KartaView sequence {} created.', online_id)
+
+    def _upload(self, index: int, path: str, latitude: float, longitude: float, heading: Optional[float]) -> None:
+        try:
+            self._ensure_sequence(latitude, longitude)
+
+            osc_photo = OSCPhoto()
+            osc_photo.image_name = f'{index}.jpg'
+            osc_photo.latitude = latitude
+            osc_photo.longitude = longitude
+            osc_photo.compass = heading
+            osc_photo.sequence_index = index
+
+            # The frame can be a file or a frame of a container
+            num_bytes = sequence_container.photo_size(path)
+            uploaded = False
+            for _ in range(UPLOAD_RETRIES):
+                uploaded, _ = self.osc_api.upload_photo(self.user.access_token, self.online_id, osc_photo, path)
+                if uploaded:
+                    break
+                logger.debug('Retrying the upload of {}.', path)
+
+            if not uploaded:
+                logger.warning('The frame {} could not be uploaded to KartaView.', path)
+                with self._lock:
+                    self.failed += 1
+                return
+
+            self._persist_progress(str(index))
+            with self._lock:
+                self.frames_uploaded += 1
+                self.bytes_uploaded += num_bytes
+            if self.delete_uploaded:
+                os.remove(path)
+        except Exception as e:
+            logger.warning('The frame {} could not be uploaded to KartaView: {}', path, e)
+            with self._lock:
+                self.failed += 1
+
+    def _persist_progress(self, index: str) -> None:
+        with self._lock:
+            self.progress.add(index)
+            with open(os.path.join(self.sequence_path, constants.PROGRESS_FILE_NAME), 'a') as progress_file:
+                progress_file.write(f'{index};')
@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+
+from src.atomic_file import atomic_write
+
+# Histogram buckets are powers of two of microseconds, the last one takes everything longer
+HISTOGRAM_BUCKETS = 32
+
+
+class StageTimes:
+    """ Cumulative time and histogram of the durations of a processing stage. """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+        # The bucket b holds the durations between 2 ** (b - 1) and 2 ** b microseconds
+        self.histogram[min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def percentile(self, fraction: float) -> float:
+        """ Upper bound, in seconds, of the bucket that contains the given fraction of the durations. """
+        if self.count == 0:
+            return 0.0
+        target = fraction * self.count
+        accumulated = 0
+        for bucket, count in enumerate(self.histogram):
+            accumulated += count
+            if accumulated >= target:
+                return min((1 << bucket) / 1e6, self.max_seconds)
+        return self.max_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'count': self.count,
+                'seconds': round(self.seconds, 6),
+                'mean_ms': round(self.seconds / self.count * 1000, 4) if self.count else 0.0,
+                'p50_ms': round(self.percentile(0.5) * 1000, 4),
+                'p95_ms': round(self.percentile(0.95) * 1000, 4),
+                'max_ms': round(self.max_seconds * 1000, 4),
+                # Upper bound in microseconds of every non-empty bucket
+                'histogram_us': {str(1 << bucket): count for bucket, count in enumerate(self.histogram) if count}}
+
+
+class StageMetrics:
+    """ Timings per processing stage and counters of a run, e.g. decode, encode, EXIF and disk writes.
+
+    A stage is timed with the value returned by `start` and a later call to `stop`:
+
+        started = metrics.start()
+        image = decode()
+        metrics.stop('decode', started)
+
+    When the metrics are disabled, `start` does not read the clock and `stop` and `count` return
+    immediately, so the instrumentation can stay in the per-frame code. The stages and counters can
+    be updated from several threads.
+    """
+
+    def __init__(self, enabled: bool = True):
+        """
+        :param enabled: whether the timings and counters are recorded.
+        """
+        self.enabled = enabled
+        self.stages: Dict[str, StageTimes] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> float:
+        return time.perf_counter() if self.enabled else 0.0
+
+    def stop(self, stage: str, started: float) -> None:
+        """ Records the time elapsed since `started` in a stage. """
+        if not self.enabled:
+            return
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            times = self.stages.get(stage)
+            if times is None:
+                times = self.stages[stage] = StageTimes()
+            times.add(elapsed)
+
+    def count(self, counter: str, value: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def timed(self, iterable: Iterable[Tuple[int, Any]], stage: str, skipped_stage: str) -> Iterator[Tuple[int, Any]]:
+        """ Times every step of an iterator of (position, image), as the one of `sample_frames`.
+
+        :param iterable: iterator to time.
+        :param stage: stage of the steps that return an image.
+        :param skipped_stage: stage of the steps that return None as the image.
+        """
+        if not self.enabled:
+            return iter(iterable)
+        return self._timed(iter(iterable), stage, skipped_stage)
+
+    def _timed(self, iterator: Iterator[Tuple[int, Any]], stage: str, skipped_stage: str) -> Iterator[Tuple[int, Any]]:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.stop(stage if item[1] is not None else skipped_stage, started)
+            yield item
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'stages': {name: times.to_dict() for name, times in self.stages.items()},
+                    'counters': dict(self.counters)}
+
+    def summary(self) -> str:
+        """ Formats the timings as a table with a row per stage, followed by the counters. """
+        metrics = self.to_dict()
+        total = metrics['stages'].get('total', {}).get('seconds', 0.0)
+        lines: List[str] = [f'{"stage":<12} {"count":>8} {"seconds":>9} {"mean ms":>9} {"p50 ms":>9} '
+                            f'{"p95 ms":>9} {"max ms":>9} {"%":>6}']
+        for name, times in metrics['stages'].items():
+            share = times['seconds'] / total * 100 if total > 0 else 0.0
+            lines.append(f'{name:<12} {times["count"]:>8} {times["seconds"]:>9.3f} {times["mean_ms"]:>9.3f} '
+                         f'{times["p50_ms"]:>9.3f} {times["p95_ms"]:>9.3f} {times["max_ms"]:>9.3f} {share:>6.1f}')
+        if metrics['counters']:
+            lines.append(', '.join(f'{name}: {value}' for name, value in metrics['counters'].items()))
+        return '\n'.join(lines)
+
+    def write_json(self, path: Union[str, Path]) -> None:
+        """ Writes the timings and counters to a JSON file. """
+        path = Path(path)
+        if path.parent != Path(''):
+            os.makedirs(path.parent, exist_ok=True)
+        with atomic_write(path) as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=2)
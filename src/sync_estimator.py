@@ -0,0 +1,142 @@
+from typing import Tuple
+
+import cv2
+import numpy as np
+from loguru import logger
+
+from src.gpx_track import GpxTrack
+from src.video_decoder import VideoDecoder
+
+# Width in pixels of the frames used to compute the motion signal
+SIGNAL_FRAME_WIDTH = 64
+
+DEFAULT_MAX_OFFSET = 30.0
+DEFAULT_MAX_DURATION = 600.0
+DEFAULT_SAMPLE_INTERVAL = 1.0
+
+# Minimum correlation between the motion and the speed to trust an estimation
+MIN_CORRELATION = 0.5
+
+
+def motion_signal(cap: VideoDecoder, time_lapse: float = 1, sample_interval: float = DEFAULT_SAMPLE_INTERVAL,
+                  max_duration: float = DEFAULT_MAX_DURATION) -> Tuple[np.ndarray, np.ndarray]:
+    """ Computes the motion energy of a video as the mean absolute difference between sampled frames.
+
+    Only one frame every `sample_interval` seconds of video time is decoded into an image, which is
+    reduced to a small grayscale thumbnail before comparing it with the previous one. The rest of
+    the frames are only grabbed.
+
+    :param cap: opened video, positioned at its first frame.
+    :param time_lapse: time between frames in the video.
+    :param sample_interval: seconds of video time between the compared frames.
+    :param max_duration: seconds of video time analysed from the start.
+    :return: times in seconds from the start of the video, in the middle of every pair of compared
+     frames, and the motion energy between them.
+    """
+    step = max(1, int(round(sample_interval / time_lapse)))
+    max_frames = int(max_duration / time_lapse)
+
+    times, energies = [], []
+    previous = None
+    frame_num = 0
+    while frame_num < max_frames:
+        if frame_num % step:
+            if not cap.grab():
+                break
+            frame_num += 1
+            continue
+
+        success, image = cap.read()
+        if not success:
+            break
+        height, width = image.shape[:2]
+        size = (SIGNAL_FRAME_WIDTH, max(1, int(round(height * SIGNAL_FRAME_WIDTH / width))))
+        thumbnail = cv2.cvtColor(cv2.resize(image, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        thumbnail = thumbnail.astype(np.float32)
+
+        if previous is not None:
+            times.append((frame_num - step / 2) * time_lapse)
+            energies.append(float(np.mean(np.abs(thumbnail - previous))))
+        previous = thumbnail
+        frame_num += 1
+
+    return np.array(times), np.array(energies)
+
+
+def speed_signal(track: GpxTrack, timestamps: np.ndarray) -> np.ndarray:
+    """ Speed in meters per second of the track at every timestamp, sampled at a regular interval. """
+    distances = track.distance_at(timestamps)
+    return np.gradient(distances, timestamps) if len(timestamps) > 1 else np.zeros(len(timestamps))
+
+
+def estimate_offset(motion: np.ndarray, speed: np.ndarray, max_lag: int) -> Tuple[float, float]:
+    """ Finds the lag that best aligns the motion with the speed using an FFT cross-correlation.
+
+    `speed` has to be sampled at the same interval as `motion` and cover `max_lag` extra samples at
+    both sides, so `speed[max_lag + i]` is simultaneous with `motion[i]` when there is no offset.
+
+    :return: lag in samples, with sub-sample precision, and the Pearson correlation at that lag.
+    """
+    n = len(motion)
+    motion = motion - motion.mean()
+    motion_norm = np.sqrt(np.sum(motion ** 2))
+    if n < 3 or motion_norm == 0:
+        return 0.0, 0.0
+
+    # Cross-correlation of every window of the speed with the motion at once
+    size = 1 << int(np.ceil(np.log2(n + len(speed))))
+    correlation = np.fft.irfft(np.conj(np.fft.rfft(motion, size)) * np.fft.rfft(speed, size), size)
+    correlation = correlation[:2 * max_lag + 1]
+
+    # Normalized by the deviation of every window of the speed to obtain the Pearson coefficient
+    cumulative = np.concatenate(([0.0], np.cumsum(speed)))
+    cumulative_squares = np.concatenate(([0.0], np.cumsum(speed ** 2)))
+    window_sums = cumulative[n:n + 2 * max_lag + 1] - cumulative[:2 * max_lag + 1]
+    window_squares = cumulative_squares[n:n + 2 * max_lag + 1] - cumulative_squares[:2 * max_lag + 1]
+    window_norms = np.sqrt(np.maximum(window_squares - window_sums ** 2 / n, 0.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        coefficients = np.where(window_norms > 1e-9, correlation / (motion_norm * window_norms), 0.0)
+
+    best = int(np.argmax(coefficients))
+    lag = float(best)
+    if 0 < best < len(coefficients) - 1:
+        # Parabolic interpolation around the peak
+        before, peak, after = coefficients[best - 1:best + 2]
+        curvature = before - 2 * peak + after
+        if curvature < 0:
+            lag += 0.5 * (before - after) / curvature
+    return lag - max_lag, float(coefficients[best])
+
+
+def estimate_sync_error(cap: VideoDecoder, track: GpxTrack, video_start: float, time_lapse: float = 1,
+                        max_offset: float = DEFAULT_MAX_OFFSET, sample_interval: float = DEFAULT_SAMPLE_INTERVAL,
+                        max_duration: float = DEFAULT_MAX_DURATION) -> Tuple[float, float]:
+    """ Estimates the synchronization error between a video and a GPX track.
+
+    The motion energy of the video is cross-correlated with the speed of the track, both sampled at
+    the same interval, looking for the offset of the video clock within `max_offset` seconds that
+    best aligns them.
+
+    :param cap: opened video, positioned at its first frame.
+    :param track: GPX track.
+    :param video_start: time of the first frame in seconds since the epoch, in the clock of the track.
+    :param time_lapse: time between frames in the video.
+    :param max_offset: maximum synchronization error searched, in seconds.
+    :param sample_interval: seconds of video time between the compared frames.
+    :param max_duration: seconds of video time analysed from the start.
+    :return: seconds to add to the video times, as `sync_error`, and the correlation of the estimation
+     between -1 and 1.
+    """
+    times, motion = motion_signal(cap, time_lapse, sample_interval, max_duration)
+    if len(motion) < 3 or len(track) < 2:
+        logger.debug('Not enough frames or GPX points to estimate the synchronization error.')
+        return 0.0, 0.0
+
+    interval = max(1, int(round(sample_interval / time_lapse))) * time_lapse
+    max_lag = int(np.ceil(max_offset / interval))
+    speed_times = video_start + times[0] + interval * np.arange(-max_lag, len(motion) + max_lag)
+    speed = speed_signal(track, speed_times)
+
+    lag, correlation = estimate_offset(motion, speed, max_lag)
+    logger.debug('Motion and speed correlation {:.3f} with an offset of {:.2f} samples.', correlation, lag)
+    return lag * interval, correlation
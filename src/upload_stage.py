@@ -0,0 +1,178 @@
+import os
+import shutil
+import subprocess
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from src.frame_pipeline import FrameCollector
+
+DONE_STATUS = 'done'
+FAILED_STATUS = 'failed'
+
+KARTAVIEW_TARGET = 'kartaview'
+MAPILLARY_TARGET = 'mapillary'
+
+FRAME_EXTENSION = '.jpg'
+
+MAPILLARY_TOOLS_COMMAND = 'mapillary_tools'
+# Folder, relative to the uploaded one, where `mapillary_tools` writes the status of every frame
+MAPILLARY_LOGS_FOLDER = Path('.mapillary', 'logs')
+MAPILLARY_UPLOAD_FAILED = 'upload_failed'
+
+
+def frame_files(output_path: str, collector: Optional[FrameCollector] = None) -> List[str]:
+    """ Paths of the frames of a processed video.
+
+    :param output_path: folder of the frames.
+    :param collector: frames submitted by `geo_reference`. When it does not contain every frame, e.g.
+     after resuming a run, the folder is listed instead.
+    """
+    if collector is not None and collector.complete:
+        return [path for _, path, _, _, _ in collector.frames]
+    return sorted(str(path) for path in Path(output_path).glob(f'*{FRAME_EXTENSION}'))
+
+
+def upload_kartaview(output_path: str, collector: Optional[FrameCollector] = None,
+                     login_controller: Any = None) -> bool:
+    """ Uploads the frames of a processed video to KartaView.
+
+    When the position of every frame is known, the frames are uploaded directly. Otherwise, the folder
+    is discovered and the position of the frames is read from their EXIF by the upload scripts.
+
+    :param output_path: folder of the frames.
+    :param collector: frames submitted by `geo_reference`, with their position.
+    :param login_controller: logged in controller of the KartaView API. None to log in production.
+    :return: whether the sequence was uploaded and finished.
+    """
+    # Imported only when needed, it requires the dependencies of the upload scripts
+    from src.kartaview_upload import KartaViewStreamUploader, upload_scripts
+
+    login_controller = login_controller or upload_scripts.LoginController(upload_scripts.OSCAPISubDomain.PRODUCTION)
+    if collector is not None and collector.complete:
+        uploader = KartaViewStreamUploader(output_path, login_controller)
+        for frame in collector.frames:
+            uploader.submit(*frame)
+        uploader.close(complete=True)
+        return uploader.finished
+
+    upload_manager = upload_scripts.OSCUploadManager(login_controller)
+    for discoverer in upload_scripts.SequenceDiscovererFactory.discoverers():
+        if not discoverer.ignored_for_upload:
+            upload_manager.add_sequences_to_upload(discoverer.discover(output_path))
+    upload_manager.start_upload()
+    return upload_scripts.constants.UPLOAD_FINISHED in upload_scripts.OSCUploadProgressDiscoverer.discover(output_path)
+
+
+def upload_mapillary(output_path: str, user_name: str) -> bool:
+    """ Processes and uploads the frames of a processed video to Mapillary with the `mapillary_tools` command line.
+
+    Unlike KartaView, which is uploaded from this process, the upload runs in a `mapillary_tools process_and_upload`
+    subprocess, so the command has to be installed and the frames are read again from the folder.
+
+    :param output_path: folder of the frames.
+    :param user_name: Mapillary user.
+    :return: whether the command succeeded and every frame was uploaded.
+    """
+    command = shutil.which(MAPILLARY_TOOLS_COMMAND)
+    if command is None:
+        raise FileNotFoundError(f'The `{MAPILLARY_TOOLS_COMMAND}` command is not installed.')
+
+    process = subprocess.run([command, 'process_and_upload', '--import_path', str(output_path),
+                              '--user_name', user_name])
+    if process.returncode != 0:
+        logger.error('`{} process_and_upload` exited with the code {}.', MAPILLARY_TOOLS_COMMAND, process.returncode)
+        return False
+
+    # The command logs the result of every frame instead of failing when some of them are not uploaded
+    failed = list(Path(output_path, MAPILLARY_LOGS_FOLDER).glob(f'*/{MAPILLARY_UPLOAD_FAILED}'))
+    if failed:
+        logger.error('{} frames could not be uploaded to Mapillary.', len(failed))
+        return False
+    return True
+
+
+def run_upload(target: str, upload: Callable[[], bool], files: Sequence[str]) -> Dict[str, Any]:
+    """ Runs the upload to a target. Any error is returned in the result instead of raised.
+
+    :param target: name of the target.
+    :param upload: function uploading the frames, returning whether it succeeded.
+    :param files: frames uploaded, to measure the throughput.
+    :return: status, frames, bytes, seconds and error of the upload.
+    """
+    start = time.perf_counter()
+    result = {'target': target, 'status': DONE_STATUS, 'frames': len(files),
+              'bytes': sum(os.path.getsize(path) for path in files if os.path.isfile(path)),
+              'seconds': 0.0, 'error': None}
+    try:
+        if not upload():
+            result.update(status=FAILED_STATUS, error='The upload did not finish, check the logs.')
+    except (Exception, SystemExit) as e:
+        # The command line tools exit on some errors
+        logger.debug(traceback.format_exc())
+        result.update(status=FAILED_STATUS, error=f'{type(e).__name__}: {e}')
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_uploads(uploads: Dict[str, Callable[[], bool]], files: Sequence[str]) -> List[Dict[str, Any]]:
+    """ Uploads the frames to every target at the same time, each one in its own thread.
+
+    :param uploads: function uploading the frames to every target.
+    :param files: frames uploaded.
+    :return: result of every target, in the same order as `uploads`.
+    """
+    logger.info('Uploading {} frames to {}.', len(files), ', '.join(uploads))
+    with ThreadPoolExecutor(max_workers=max(1, len(uploads)), thread_name_prefix='upload') as executor:
+        futures = [executor.submit(run_upload, target, upload, files) for target, upload in uploads.items()]
+        results = [future.result() for future in futures]
+
+    for result in results:
+        if result['status'] == DONE_STATUS:
+            logger.info('Successfully uploaded to {}.', result['target'])
+        else:
+            logger.error('Error uploading data to {}: {}', result['target'], result['error'])
+    return results
+
+
+def format_upload_summary(results: List[Dict[str, Any]]) -> str:
+    """ Formats the results of the uploads as a table with a row per target. """
+    lines = [f'{"target":<10} {"status":<8} {"frames":>8} {"MB":>10} {"seconds":>9} {"MB/s":>8}']
+    for result in results:
+        done = result['status'] == DONE_STATUS and result['seconds'] > 0
+        throughput = result['bytes'] / 1e6 / result['seconds'] if done else 0.0
+        lines.append(f'{result["target"]:<10} {result["status"]:<8} {result["frames"]:>8} '
+                     f'{result["bytes"] / 1e6:>10.1f} {result["seconds"]:>9.1f} {throughput:>8.2f}')
+    return '\n'.join(lines)
+
+
+def upload_frames(output_path: str, collector: Optional[FrameCollector] = None, mapillary_user: Optional[str] = None,
+                  kartaview: bool = True) -> Tuple[List[Dict[str, Any]], bool]:
+    """ Uploads the frames of a processed video to Mapillary and KartaView at the same time.
+
+    The KartaView login is done before starting the uploads, as it may ask for the credentials.
+
+    :param output_path: folder of the frames.
+    :param collector: frames submitted by `geo_reference`.
+    :param mapillary_user: Mapillary user. None to not upload to Mapillary.
+    :param kartaview: uploads to KartaView.
+    :return: result of every target and whether all of them succeeded.
+    """
+    uploads: Dict[str, Callable[[], bool]] = {}
+    if mapillary_user is not None:
+        uploads[MAPILLARY_TARGET] = lambda: upload_mapillary(output_path, mapillary_user)
+    if kartaview:
+        from src.kartaview_upload import upload_scripts
+        login_controller = upload_scripts.LoginController(upload_scripts.OSCAPISubDomain.PRODUCTION)
+        login_controller.login()
+        uploads[KARTAVIEW_TARGET] = lambda: upload_kartaview(output_path, collector, login_controller)
+    if not uploads:
+        return [], True
+
+    results = run_uploads(uploads, frame_files(output_path, collector))
+    logger.info('Upload summary:\n{}', format_upload_summary(results))
+    return results, all(result['status'] == DONE_STATUS for result in results)
@@ -0,0 +1,222 @@
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import cv2
+import numpy as np
+from loguru import logger
+
+OPENCV_BACKEND = 'opencv'
+FFMPEG_BACKEND = 'ffmpeg'
+DECODER_BACKENDS = (OPENCV_BACKEND, FFMPEG_BACKEND)
+
+
+class VideoDecoder:
+    """ Minimal interface of the video decoders, modelled after `cv2.VideoCapture`.
+
+    `grab` advances to the next frame without converting it to an image and `retrieve` returns
+    the image of the last grabbed frame, so frames that are not needed skip the color conversion.
+    Like in OpenCV, `retrieve` and `read` can decode into an existing image of the right size
+    instead of allocating a new one.
+
+    The frames are addressed by their number and the time of a frame is derived from it, so only videos
+    with a constant frame rate are supported, as the ones recorded by the action cams.
+    """
+
+    @property
+    def frame_count(self) -> int:
+        """ Number of frames announced by the container. """
+        raise NotImplementedError
+
+    @property
+    def fps(self) -> float:
+        raise NotImplementedError
+
+    @property
+    def frame_size(self) -> Tuple[int, int]:
+        """ Width and height of the retrieved images. """
+        raise NotImplementedError
+
+    def seek(self, frame_num: int) -> None:
+        """ Moves the decoder so the next grabbed frame is `frame_num`. """
+        raise NotImplementedError
+
+    def grab(self) -> bool:
+        raise NotImplementedError
+
+    def retrieve(self, image: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray]]:
+        raise NotImplementedError
+
+    def read(self, image: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray]]:
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def release(self) -> None:
+        raise NotImplementedError
+
+
+class OpenCVDecoder(VideoDecoder):
+    """ Decoder based on `cv2.VideoCapture`. """
+
+    def __init__(self, path: Union[str, Path]):
+        self.cap = cv2.VideoCapture(str(path))
+        if not self.cap.isOpened():
+            raise IOError(f'The video could not be opened. Path: {path}.')
+
+    @property
+    def frame_count(self) -> int:
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    @property
+    def fps(self) -> float:
+        return self.cap.get(cv2.CAP_PROP_FPS)
+
+    @property
+    def frame_size(self) -> Tuple[int, int]:
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def seek(self, frame_num: int) -> None:
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+
+    def grab(self) -> bool:
+        return self.cap.grab()
+
+    def retrieve(self, image: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray]]:
+        return self.cap.retrieve(image)
+
+    def read(self, image: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray]]:
+        return self.cap.read(image)
+
+    def release(self) -> None:
+        self.cap.release()
+
+
+class FFmpegDecoder(VideoDecoder):
+    """ Decoder based on the libavcodec bindings of PyAV.
+
+    Unlike OpenCV, it allows to choose the number of decoding threads, which are used both for frame
+    and slice threading, and to downscale the frames in the same pass that converts them to BGR.
+    It requires the optional dependency `av`.
+    """
+
+    def __init__(self, path: Union[str, Path], threads: int = 0, max_size: Optional[int] = None):
+        """
+        :param path: path of the video.
+        :param threads: number of decoding threads. With 0, libavcodec chooses them from the CPU count.
+        :param max_size: maximum size of the longest side of the retrieved frames. None to keep the original.
+        """
+        try:
+            import av
+        except ImportError as e:
+            raise ImportError('The ffmpeg decoder needs PyAV. Install it with `pip install av`.') from e
+
+        self.container = av.open(str(path))
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+        self.stream.thread_count = threads
+
+        self.width, self.height = self.stream.codec_context.width, self.stream.codec_context.height
+        if max_size and max(self.width, self.height) > max_size:
+            scale = max_size / max(self.width, self.height)
+            self.width, self.height = int(round(self.width * scale)), int(round(self.height * scale))
+
+        self._frames = self.container.decode(self.stream)
+        self._frame = None
+        self._pending = None
+        logger.debug('FFmpeg decoder opened {} with {} threads and output size {}x{}.', path,
+                     threads or 'auto', self.width, self.height)
+
+    @property
+    def frame_count(self) -> int:
+        if self.stream.frames:
+            return self.stream.frames
+        if self.stream.duration is not None:
+            return int(self.stream.duration * self.stream.time_base * self.fps)
+        return 0
+
+    @property
+    def fps(self) -> float:
+        rate = self.stream.average_rate or self.stream.guessed_rate
+        return float(rate) if rate else 0.0
+
+    @property
+    def frame_size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def seek(self, frame_num: int) -> None:
+        # Seek to the previous keyframe, or to the start of the stream, and decode forward until the requested frame
+        start_time = self.stream.start_time or 0
+        target_time = max(0, frame_num) / self.fps
+        self.container.seek(start_time + int(target_time / self.stream.time_base), stream=self.stream,
+                            backward=True, any_frame=False)
+        self._frames = self.container.decode(self.stream)
+        self._pending = None
+
+        first_time = float(start_time * self.stream.time_base)
+        while self.grab():
+            # The presentation time only locates the requested frame, assuming a constant frame rate
+            if self._frame.pts is None or \
+                    float(self._frame.pts * self.stream.time_base) - first_time >= target_time - 0.5 / self.fps:
+                # The requested frame is returned by the next grab
+                self._pending = self._frame
+                break
+
+    def grab(self) -> bool:
+        if self._pending is not None:
+            self._frame, self._pending = self._pending, None
+            return True
+        try:
+            self._frame = next(self._frames)
+        except StopIteration:
+            self._frame = None
+            return False
+        return True
+
+    def retrieve(self, image: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray]]:
+        # PyAV always converts into a new array, so `image` is not reused
+        if self._frame is None:
+            return False, None
+        return True, self._frame.to_ndarray(width=self.width, height=self.height, format='bgr24')
+
+    def release(self) -> None:
+        self.container.close()
+
+
+def keyframes(path: Union[str, Path]) -> Optional[np.ndarray]:
+    """ Frame numbers of the keyframes of a video, read from its packets without decoding them.
+
+    :param path: path of the video.
+    :return: sorted frame numbers, or None when PyAV is not installed.
+    """
+    try:
+        import av
+    except ImportError:
+        return None
+
+    with av.open(str(path)) as container:
+        stream = container.streams.video[0]
+        start_time = stream.start_time or 0
+        rate = stream.average_rate or stream.guessed_rate
+        if not rate:
+            return None
+        frames = [int(round(float((packet.pts - start_time) * stream.time_base * rate)))
+                  for packet in container.demux(stream) if packet.is_keyframe and packet.pts is not None]
+    return np.unique(np.array(frames, dtype=np.int64))
+
+
+def open_decoder(path: Union[str, Path], backend: str = OPENCV_BACKEND, threads: int = 0,
+                 max_size: Optional[int] = None) -> VideoDecoder:
+    """ Opens a video with the given decoder backend.
+
+    :param path: path of the video.
+    :param backend: `opencv` or `ffmpeg`.
+    :param threads: number of decoding threads of the `ffmpeg` backend.
+    :param max_size: maximum size of the longest side of the frames of the `ffmpeg` backend.
+    """
+    if backend == OPENCV_BACKEND:
+        if threads or max_size:
+            logger.warning('The opencv decoder ignores the number of threads and the maximum size.')
+        return OpenCVDecoder(path)
+    if backend == FFMPEG_BACKEND:
+        return FFmpegDecoder(path, threads, max_size)
+    raise ValueError(f'Unknown decoder backend `{backend}`. Available backends: {DECODER_BACKENDS}.')
@@ -0,0 +1,80 @@
+from src.checkpoint import Checkpoint
+from src.frame_writer import EncodingProfile
+
+PARAMETERS = {'video': 'video.mp4', 'time_lapse': 1, 'encoding': vars(EncodingProfile('original')), 'crop': (0, 0, 8, 8)}
+
+
+def _write_frames(checkpoint: Checkpoint, frame_nums, size: int = 10) -> None:
+    for frame_num in frame_nums:
+        path = checkpoint.directory / f'{frame_num:06d}.jpg'
+        path.write_bytes(b'x' * size)
+        checkpoint.add(frame_num, path, size)
+
+
+def test_interrupted_run_resumes_at_the_next_frame(tmp_path):
+    checkpoint = Checkpoint(tmp_path, PARAMETERS, batch_size=2, interval=3600)
+    checkpoint.write()
+    _write_frames(checkpoint, [0, 3, 6, 9, 12])
+
+    # The last frame was added after the last write of the manifest, the interrupted run loses it
+    resumed = Checkpoint(tmp_path, PARAMETERS)
+    assert resumed.restore()
+    assert not resumed.finished
+    assert resumed.next_frame == 10
+    assert [frame_num for frame_num, _, _ in resumed.frames] == [0, 3, 6, 9]
+
+    _write_frames(resumed, [12, 15])
+    resumed.finish()
+    finished = Checkpoint(tmp_path, PARAMETERS)
+    assert finished.restore()
+    assert finished.finished
+    assert [frame_num for frame_num, _, _ in finished.frames] == [0, 3, 6, 9, 12, 15]
+
+
+def test_missing_frame_truncates_the_manifest(tmp_path):
+    checkpoint = Checkpoint(tmp_path, PARAMETERS)
+    _write_frames(checkpoint, [0, 2, 4, 6, 8])
+    checkpoint.finish()
+    (tmp_path / '000004.jpg').unlink()
+    # A frame with a different size is as incomplete as a missing one
+    (tmp_path / '000006.jpg').write_bytes(b'x' * 3)
+
+    resumed = Checkpoint(tmp_path, PARAMETERS)
+    assert resumed.restore()
+    assert not resumed.finished
+    assert resumed.next_frame == 4
+    assert [frame_num for frame_num, _, _ in resumed.frames] == [0, 2]
+
+    # The frames after the missing one are written again and replace it in the log
+    _write_frames(resumed, [4, 6, 8], size=12)
+    resumed.finish()
+    finished = Checkpoint(tmp_path, PARAMETERS)
+    assert finished.restore()
+    assert finished.frames == [(0, '000000.jpg', 10), (2, '000002.jpg', 10), (4, '000004.jpg', 12),
+                               (6, '000006.jpg', 12), (8, '000008.jpg', 12)]
+
+
+def test_removed_frames_are_not_processed_again(tmp_path):
+    checkpoint = Checkpoint(tmp_path, PARAMETERS)
+    _write_frames(checkpoint, [0, 2, 4])
+    checkpoint.finish()
+    (tmp_path / '000002.jpg').unlink()
+
+    resumed = Checkpoint(tmp_path, PARAMETERS)
+    assert resumed.restore(removed={1})
+    assert resumed.finished
+    assert len(resumed.frames) == 3
+
+
+def test_other_encoding_parameters_invalidate_the_checkpoint(tmp_path):
+    checkpoint = Checkpoint(tmp_path, PARAMETERS)
+    _write_frames(checkpoint, [0, 1])
+    checkpoint.finish()
+
+    assert Checkpoint(tmp_path, dict(PARAMETERS)).restore()
+    for encoding in (EncodingProfile('original', jpg_quality=90), EncodingProfile('original', crop=(0, 0, 4, 4)),
+                     EncodingProfile('original', progressive=True)):
+        resumed = Checkpoint(tmp_path, {**PARAMETERS, 'encoding': vars(encoding)})
+        assert not resumed.restore()
+        assert resumed.next_frame == 0
+        assert not resumed.frames
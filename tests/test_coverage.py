@@ -0,0 +1,49 @@
+import numpy as np
+
+from src.coverage import CoverageIndex, SECONDS_PER_DAY, frame_headings
+from src.gpx_track import FramePositions
+
+VIDEO_A, VIDEO_B = 1, 2
+
+
+def _drive(num_frames: int = 100, northwards: bool = True) -> FramePositions:
+    """ Frames every 10 meters along a meridian. """
+    latitudes = 40.0 + np.arange(num_frames) * 10 / 111_320.0
+    if not northwards:
+        latitudes = latitudes[::-1].copy()
+    return FramePositions(np.arange(num_frames, dtype=float), latitudes, np.full(num_frames, -3.7),
+                          np.zeros(num_frames), np.ones(num_frames, dtype=bool))
+
+
+def _record(coverage: CoverageIndex, positions: FramePositions, frame_times: np.ndarray, source: int) -> None:
+    keys, _ = coverage.cell_keys(positions, frame_headings(positions))
+    for key, frame_time in zip(keys.tolist(), frame_times):
+        coverage.add(key, frame_time, source)
+
+
+def test_frames_are_covered_by_other_videos_in_the_same_heading(tmp_path):
+    frame_times = 100 * SECONDS_PER_DAY + np.arange(100.0)
+    coverage = CoverageIndex(tmp_path / 'coverage.npz')
+    _record(coverage, _drive(), frame_times, VIDEO_A)
+    coverage.save()
+
+    coverage = CoverageIndex(tmp_path / 'coverage.npz')
+    keys, near_keys = coverage.cell_keys(_drive(), frame_headings(_drive()))
+    assert coverage.covered(keys, near_keys, frame_times, 3, VIDEO_B).all()
+    # The frames of the same video, recorded too long ago or in the other direction are not covered
+    assert not coverage.covered(keys, near_keys, frame_times, 3, VIDEO_A).any()
+    assert not coverage.covered(keys, near_keys, frame_times + 4 * SECONDS_PER_DAY, 3, VIDEO_B).any()
+    backwards = _drive(northwards=False)
+    keys, near_keys = coverage.cell_keys(backwards, frame_headings(backwards))
+    assert not coverage.covered(keys, near_keys, frame_times, 3, VIDEO_B).any()
+
+
+def test_saving_merges_the_cells_saved_by_other_processes(tmp_path):
+    path = tmp_path / 'coverage.npz'
+    first, second = CoverageIndex(path), CoverageIndex(path)
+    _record(first, _drive(), np.full(100, 10.0 * SECONDS_PER_DAY), VIDEO_A)
+    _record(second, _drive(northwards=False), np.full(100, 10.0 * SECONDS_PER_DAY), VIDEO_B)
+    expected = set(first.cells) | set(second.cells)
+    first.save()
+    second.save()
+    assert set(CoverageIndex(path).cells) == expected and len(expected) > len(first.cells)
@@ -0,0 +1,104 @@
+import importlib
+import os
+import tarfile
+
+import pytest
+
+from src.atomic_file import atomic_write
+from src.frame_container import FRAMES_CONTAINER_NAME, FrameContainer
+
+FRAMES = {f'2021_0501_1200{second:02d}_000.jpg': bytes([second]) * (700 + 300 * second) for second in range(6)}
+
+
+@pytest.fixture
+def container(tmp_path) -> FrameContainer:
+    container = FrameContainer(tmp_path / FRAMES_CONTAINER_NAME)
+    for name, data in FRAMES.items():
+        # Chunks as written by the frame writer, the headers and the encoded image
+        assert container.append(name, [data[:10], memoryview(data[10:])]) == len(data)
+    container.close()
+    return container
+
+
+def test_frames_are_read_back_and_the_archive_is_a_tar_file(container):
+    assert container.names == sorted(FRAMES)
+    assert all(container.read(name) == data for name, data in FRAMES.items())
+    assert container.read(0) == FRAMES[container.names[0]]
+
+    with tarfile.open(container.path) as tar_file:
+        assert {member.name: tar_file.extractfile(member).read() for member in tar_file} == FRAMES
+
+
+def test_last_copy_of_a_frame_is_read(container):
+    name = container.names[2]
+    container.append(name, [b'new frame'])
+    container.close()
+
+    assert FrameContainer(container.path).read(name) == b'new frame'
+    assert len(FrameContainer(container.path)) == len(FRAMES)
+
+
+def test_upload_scripts_read_the_frames(container):
+    importlib.import_module('upload-scripts')
+    sequence_container = importlib.import_module('sequence_container')
+
+    paths = sequence_container.container_photos(str(container.path.parent))
+    assert [os.path.basename(path) for path in paths] == sorted(FRAMES)
+    name = container.names[3]
+    assert sequence_container.photo_size(str(container.frame_path(name))) == len(FRAMES[name])
+    assert sequence_container.open_photo(str(container.frame_path(name))).read() == FRAMES[name]
+
+
+def test_missing_index_is_rebuilt(container):
+    index = container.index_path.read_bytes()
+    os.remove(container.index_path)
+
+    rebuilt = FrameContainer(container.path)
+    assert rebuilt.names == sorted(FRAMES)
+    assert all(rebuilt.read(name) == data for name, data in FRAMES.items())
+    assert container.index_path.read_bytes() == index
+
+
+def test_index_is_rebuilt_after_truncating_the_archive(container):
+    names = list(FRAMES)
+    offset, _ = container._entries[names[4]]
+    # The archive ends in the middle of the fifth frame and the index was lost
+    with open(container.path, 'r+b') as tar_file:
+        tar_file.truncate(offset + 100)
+    os.remove(container.index_path)
+
+    rebuilt = FrameContainer(container.path)
+    assert rebuilt.names == names[:4]
+    assert all(rebuilt.read(name) == FRAMES[name] for name in names[:4])
+
+    # The incomplete frame is overwritten by the next one appended
+    rebuilt.append(names[4], [FRAMES[names[4]]])
+    rebuilt.close()
+    with tarfile.open(container.path) as tar_file:
+        assert tar_file.getnames() == names[:5]
+    assert FrameContainer(container.path).read(names[4]) == FRAMES[names[4]]
+
+
+def test_index_entries_after_the_end_of_the_archive_are_ignored(container):
+    names = list(FRAMES)
+    offset, _ = container._entries[names[3]]
+    with open(container.path, 'r+b') as tar_file:
+        tar_file.truncate(offset + 10)
+
+    truncated = FrameContainer(container.path)
+    assert truncated.names == names[:3]
+    assert truncated.size(names[3]) is None
+
+
+def test_atomic_write_keeps_the_previous_file_on_errors(tmp_path):
+    path = tmp_path / 'index.json'
+    with atomic_write(path) as output_file:
+        output_file.write('first')
+
+    with pytest.raises(ValueError):
+        with atomic_write(path, sync=True) as output_file:
+            output_file.write('second')
+            raise ValueError('interrupted')
+
+    assert path.read_text() == 'first'
+    assert os.listdir(tmp_path) == ['index.json']
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+from src.frame_pipeline import FramePipeline
+
+
+def _run_with_timeout(function, timeout: float = 10.0) -> BaseException:
+    """ Runs a function in a thread and returns the error it raised. Fails if it does not end in time. """
+    errors = []
+
+    def target():
+        try:
+            function()
+        except BaseException as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'The pipeline is blocked.'
+    assert errors, 'The pipeline did not raise the error of the callback.'
+    return errors[0]
+
+
+@pytest.mark.parametrize('fail_at', [0, 5])
+def test_error_in_on_done_is_raised_instead_of_blocking(fail_at):
+    done = []
+
+    def on_done(job):
+        if job.index == fail_at:
+            raise ConnectionError('consumer failed')
+        done.append(job.index)
+
+    def process():
+        pipeline = FramePipeline(lambda job: None, lambda job: None, workers=2, queue_size=2, on_done=on_done)
+        try:
+            for i in range(100):
+                pipeline.submit(i)
+        finally:
+            pipeline.close()
+
+    error = _run_with_timeout(process)
+    assert isinstance(error, RuntimeError)
+    assert isinstance(error.__cause__, ConnectionError)
+    # The jobs after the failure are not handed to the callback
+    assert done == list(range(fail_at))
+
+
+def test_jobs_are_finished_in_order():
+    done = []
+    with FramePipeline(lambda job: None, lambda job: None, workers=3, on_done=lambda job: done.append(job.index)) \
+            as pipeline:
+        for i in range(50):
+            pipeline.submit(i)
+    assert done == list(range(50))
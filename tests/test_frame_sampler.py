@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from src.frame_sampler import FrameSelector
+
+
+def _accepted(frame_times, distances, candidates, interval, min_distance):
+    selector = FrameSelector(interval, min_distance)
+    return np.array([bool(candidate) and selector.accept(frame_time, distance)
+                     for frame_time, distance, candidate in zip(frame_times, distances, candidates)])
+
+
+def test_interval_and_distance_chain_on_the_extracted_frames():
+    selector = FrameSelector(interval=1, min_distance=10)
+    selected = selector.select(np.array([0, 0.5, 1.2, 2.5]), np.array([0, 10, 15, 19.0]), np.ones(4, dtype=bool))
+    # The frame at 0.5 s is in the slot of the first one, the one at 2.5 s is 4 m after the one at 1.2 s
+    assert np.flatnonzero(selected).tolist() == [0, 2]
+
+
+@pytest.mark.parametrize('interval, min_distance', [(0, 0), (1.5, 0), (0, 12.0), (1.5, 12.0), (0.7, 30.0)])
+def test_select_is_the_same_as_accepting_every_frame(interval, min_distance):
+    rng = np.random.default_rng(0)
+    frame_times = 1000 + np.cumsum(rng.uniform(0.1, 1.0, 500))
+    distances = np.cumsum(rng.choice([0.0, 2.0, 9.0, 25.0], 500))
+    candidates = rng.random(500) > 0.2
+
+    expected = _accepted(frame_times, distances, candidates, interval, min_distance)
+    assert np.array_equal(FrameSelector(interval, min_distance).select(frame_times, distances, candidates), expected)
+
+    # Selecting in batches continues from the last extracted frame
+    selector = FrameSelector(interval, min_distance)
+    batches = [selector.select(frame_times[i:i + 77], distances[i:i + 77], candidates[i:i + 77])
+               for i in range(0, 500, 77)]
+    assert np.array_equal(np.concatenate(batches), expected)
@@ -0,0 +1,76 @@
+import datetime
+import importlib
+import struct
+
+import numpy as np
+import piexif
+import pytest
+
+from src.frame_writer import EncodingProfile, FrameWriter, JPEG_APP0, JPEG_APP1, JPEG_SOI
+
+# The upload scripts import each other by name, importing the package adds its folder to the search path
+importlib.import_module('upload-scripts')
+exif_processing = importlib.import_module('exif_processing')
+
+FRAME_TIME = datetime.datetime(2021, 5, 1, 12, 0, 3, 250000)
+
+
+def _segments(data: bytes) -> list:
+    """ Markers of the segments of a JPEG file until the start of the scan. """
+    markers, position = [], 2
+    while data[position:position + 2] != b'\xff\xda':
+        markers.append(data[position:position + 2])
+        position += 2 + struct.unpack('>H', data[position + 2:position + 4])[0]
+    return markers
+
+
+def _dms(values) -> float:
+    (degrees, degrees_den), (minutes, minutes_den), (seconds, seconds_den) = values
+    return degrees / degrees_den + minutes / minutes_den / 60 + seconds / seconds_den / 3600
+
+
+@pytest.mark.parametrize('latitude, longitude, altitude', [(40.4168, -3.7038, 657.25), (-33.8688, 151.2093, -4.5)])
+def test_exif_is_read_by_piexif_and_the_upload_scripts(tmp_path, latitude, longitude, altitude):
+    path = str(tmp_path / 'frame.jpg')
+    image = np.random.default_rng(0).integers(0, 256, size=(48, 64, 3), dtype=np.uint8)
+    writer = FrameWriter()
+    jpeg = writer.encode(image)
+    # OpenCV writes a JFIF segment, which is replaced by the EXIF one
+    assert bytes(memoryview(jpeg).cast('B')[2:4]) == JPEG_APP0
+    num_bytes = writer.write_encoded(path, jpeg, FRAME_TIME, (FRAME_TIME, latitude, longitude, altitude))
+
+    with open(path, 'rb') as frame_file:
+        data = frame_file.read()
+    assert len(data) == num_bytes
+    assert data[:2] == JPEG_SOI
+    markers = _segments(data)
+    assert markers[0] == JPEG_APP1
+    assert markers.count(JPEG_APP1) == 1 and JPEG_APP0 not in markers
+
+    exif = piexif.load(path)
+    assert exif['Exif'][piexif.ExifIFD.DateTimeOriginal] == b'2021:05:01 12:00:03.250'
+    gps = exif['GPS']
+    assert gps[piexif.GPSIFD.GPSLatitudeRef] == (b'N' if latitude > 0 else b'S')
+    assert gps[piexif.GPSIFD.GPSLongitudeRef] == (b'E' if longitude > 0 else b'W')
+    assert _dms(gps[piexif.GPSIFD.GPSLatitude]) == pytest.approx(abs(latitude), abs=1e-6)
+    assert _dms(gps[piexif.GPSIFD.GPSLongitude]) == pytest.approx(abs(longitude), abs=1e-6)
+    assert gps[piexif.GPSIFD.GPSAltitude] == (int(abs(altitude) * 100), 100)
+    assert gps[piexif.GPSIFD.GPSAltitudeRef] == (0 if altitude > 0 else 1)
+
+    tags = exif_processing.all_tags(path)
+    assert exif_processing.gps_latitude(tags) == pytest.approx(latitude, abs=1e-6)
+    assert exif_processing.gps_longitude(tags) == pytest.approx(longitude, abs=1e-6)
+    # The upload scripts compare the reference tag with an integer, so they always read the absolute altitude
+    assert exif_processing.gps_altitude(tags) == pytest.approx(abs(altitude))
+    assert exif_processing.timestamp(tags) == pytest.approx(FRAME_TIME.timestamp())
+
+
+@pytest.mark.parametrize('crop', [(0, 0, 64, 48), (16, 8, 32, 32)])
+def test_crop_inside_the_frames_is_accepted(crop):
+    EncodingProfile('crop', crop=crop).check_crop(64, 48)
+
+
+@pytest.mark.parametrize('crop', [(40, 0, 32, 32), (0, 20, 32, 32), (-1, 0, 32, 32), (0, 0, 65, 48)])
+def test_crop_out_of_the_frames_is_rejected(crop):
+    with pytest.raises(ValueError, match='64x48'):
+        EncodingProfile('crop', crop=crop).check_crop(64, 48)
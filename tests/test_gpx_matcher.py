@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from src.gpx_matcher import GpxMatcher, NO_MATCH
+from src.gpx_track import GpxTrack
+
+
+def greedy_match(times, timestamps, discard_gpx_points=0):
+    """ Matching of the original `ActionCamGeoReferencer.get_matching_gpx_point`, one frame at a time.
+
+    The points are scanned from the first one still available while they are before the frame or the
+    time difference decreases, taking the last point with the lowest difference within one second. The
+    matched point and the previous ones are removed.
+    """
+    remaining = list(range(discard_gpx_points, len(times)))
+    result = []
+    for timestamp in timestamps:
+        index, best_index, time_diff, diff_reduced = 0, None, 1.0, True
+        while diff_reduced and index < len(remaining):
+            gpx_time = times[remaining[index]]
+            diff = abs(gpx_time - timestamp)
+            if time_diff >= diff:
+                time_diff, best_index = diff, index
+            elif timestamp <= gpx_time:
+                diff_reduced = False
+            index += 1
+
+        if best_index is None:
+            result.append(NO_MATCH)
+        else:
+            result.append(remaining[best_index])
+            remaining = remaining[best_index + 1:]
+    return result
+
+
+def _track(times) -> GpxTrack:
+    times = np.asarray(times, dtype=np.float64)
+    return GpxTrack(times, np.zeros(len(times)), np.zeros(len(times)), np.zeros(len(times)))
+
+
+def _match(times, timestamps, discard_gpx_points=0):
+    matcher = GpxMatcher(_track(times))
+    matcher.skip(discard_gpx_points)
+    return matcher.match(np.asarray(timestamps, dtype=np.float64)).tolist()
+
+
+def test_window_edges():
+    times = [10.0, 12.0, 14.0]
+    # Exactly one second away is a match, the point after the frame wins a draw
+    timestamps = [9.0, 11.0, 13.0, 15.0]
+    assert _match(times, timestamps) == greedy_match(times, timestamps) == [0, 1, 2, NO_MATCH]
+    timestamps = [8.75, 10.0, 11.25, 15.25]
+    assert _match(times, timestamps) == greedy_match(times, timestamps) == [NO_MATCH, 0, 1, NO_MATCH]
+
+
+def test_timestamps_before_and_after_the_track():
+    times = [100.0, 101.0, 102.0]
+    timestamps = [90.0, 95.0, 99.5, 100.5, 101.5, 103.0, 110.0]
+    assert _match(times, timestamps) == greedy_match(times, timestamps)
+    assert _match(times, [50.0, 60.0]) == [NO_MATCH, NO_MATCH]
+    assert _match(times, [150.0, 160.0]) == [NO_MATCH, NO_MATCH]
+
+
+@pytest.mark.parametrize('discard_gpx_points', [0, 1, 5, 40])
+def test_discarded_points(discard_gpx_points):
+    times = np.arange(0, 30, 0.75)
+    timestamps = np.arange(-2, 35, 1.0)
+    assert _match(times, timestamps, discard_gpx_points) == greedy_match(times, timestamps, discard_gpx_points)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_same_as_greedy_matching(seed):
+    rng = np.random.default_rng(seed)
+    # Irregular track with gaps and repeated times, frames at least as dense as the points
+    times = np.cumsum(rng.choice([0.0, 0.25, 0.5, 1.0, 1.5, 3.0], size=60))
+    timestamps = rng.uniform(-2, times[-1] + 2, size=80).round(2) if seed % 2 else \
+        np.arange(-2, times[-1] + 2, rng.choice([0.5, 1.0, 2.0]))
+    timestamps = np.sort(timestamps)
+    discard_gpx_points = int(rng.integers(0, 5))
+    assert _match(times, timestamps, discard_gpx_points) == greedy_match(times, timestamps, discard_gpx_points)
@@ -0,0 +1,89 @@
+import datetime
+import threading
+from types import SimpleNamespace
+
+from src.kartaview_upload import KartaViewStreamUploader
+
+FRAME_TIME = datetime.datetime(2021, 5, 1, 12, 0, 0)
+
+
+class FakeApi:
+    """ KartaView API recording the calls, in the thread that made them, instead of sending them. """
+
+    def __init__(self, sequence_id=42, uploaded=True):
+        self.sequence_id = sequence_id
+        self.uploaded = uploaded
+        self.sequence_created = threading.Event()
+        self.release_sequence = threading.Event()
+        self.release_sequence.set()
+        self.threads = set()
+        self.photos = []
+        self.finished = False
+
+    def create_sequence(self, sequence, token):
+        self.threads.add(threading.current_thread())
+        self.sequence_created.set()
+        self.release_sequence.wait(5)
+        return self.sequence_id, None if self.sequence_id else ConnectionError('offline')
+
+    def upload_photo(self, token, sequence_id, photo, path):
+        self.threads.add(threading.current_thread())
+        self.photos.append((photo.sequence_index, photo.compass, sequence_id))
+        return self.uploaded, None
+
+    def finish_upload(self, sequence, token):
+        self.finished = True
+        return True, None
+
+
+def _uploader(tmp_path, api: FakeApi, **kwargs) -> KartaViewStreamUploader:
+    login_controller = SimpleNamespace(osc_api=api, login=lambda: SimpleNamespace(access_token='token'))
+    return KartaViewStreamUploader(str(tmp_path), login_controller, **kwargs)
+
+
+def _submit(uploader: KartaViewStreamUploader, tmp_path, count: int) -> None:
+    for index in range(count):
+        path = tmp_path / f'{index}.jpg'
+        path.write_bytes(b'x' * 10)
+        uploader.submit(index, str(path), 0.0, (FRAME_TIME, 40.0, -3.7, 650.0), None if index == 0 else 90.0 * index)
+
+
+def test_frames_are_uploaded_by_the_threads_of_the_uploader(tmp_path):
+    api = FakeApi()
+    api.release_sequence.clear()
+    uploader = _uploader(tmp_path, api, workers=2)
+
+    # The sequence is still being created, submitting the frames does not wait for it
+    _submit(uploader, tmp_path, 3)
+    assert api.sequence_created.wait(5)
+    assert not api.photos
+    api.release_sequence.set()
+    uploader.close(complete=True)
+
+    assert threading.current_thread() not in api.threads
+    assert sorted(api.photos) == [(0, None, 42), (1, 90.0, 42), (2, 180.0, 42)]
+    assert api.finished
+    assert uploader.finished and uploader.succeeded
+    assert uploader.frames_uploaded == 3
+
+
+def test_failed_sequence_fails_every_frame(tmp_path):
+    api = FakeApi(sequence_id=None)
+    uploader = _uploader(tmp_path, api)
+    _submit(uploader, tmp_path, 3)
+    uploader.close(complete=True)
+
+    assert not api.photos
+    assert uploader.failed == 3
+    assert not uploader.succeeded
+
+
+def test_failed_upload_does_not_finish_the_sequence(tmp_path):
+    api = FakeApi(uploaded=False)
+    uploader = _uploader(tmp_path, api)
+    _submit(uploader, tmp_path, 2)
+    uploader.close(complete=True)
+
+    assert uploader.failed == 2
+    assert not api.finished
+    assert not uploader.succeeded
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from src.gpx_track import EARTH_RADIUS, GpxTrack
+from src.sync_estimator import estimate_sync_error
+from src.video_decoder import VideoDecoder
+
+VIDEO_START = 1_619_870_400.0
+METERS_PER_DEGREE = EARTH_RADIUS * np.pi / 180
+
+
+def _speed(times: np.ndarray) -> np.ndarray:
+    """ Irregular speed profile in meters per second, so a single lag aligns it with itself. """
+    return 8 + 5 * np.sin(2 * np.pi * times / 37) + 3 * np.sin(2 * np.pi * times / 11 + 1) \
+        + 2 * np.sin(2 * np.pi * times / 5.3 + 2)
+
+
+def _track() -> GpxTrack:
+    """ Track heading north at the speed of `_speed`, a point per second around the video. """
+    times = np.arange(-120.0, 420.0)
+    distances = np.concatenate(([0.0], np.cumsum((_speed(times[:-1]) + _speed(times[1:])) / 2)))
+    return GpxTrack(VIDEO_START + times, 40.0 + distances / METERS_PER_DEGREE, np.full(len(times), -3.7),
+                    np.zeros(len(times)))
+
+
+class SyntheticVideo(VideoDecoder):
+    """ Video whose frames change as much as the speed of the track `offset` seconds after their video time.
+
+    The frames alternate between brighter and darker than the mid gray in proportion to the speed, so the
+    difference between two consecutive frames grows with the speed between them.
+    """
+
+    def __init__(self, offset: float, num_frames: int = 240, time_lapse: float = 1):
+        speeds = _speed(np.arange(num_frames) * time_lapse + offset)
+        signs = np.where(np.arange(num_frames) % 2, 1, -1)
+        self.levels = np.clip(128 + signs * 5 * speeds, 0, 255).astype(np.uint8)
+        self.frame_num = -1
+
+    @property
+    def frame_count(self) -> int:
+        return len(self.levels)
+
+    @property
+    def fps(self) -> float:
+        return 1.0
+
+    def grab(self) -> bool:
+        self.frame_num += 1
+        return self.frame_num < len(self.levels)
+
+    def retrieve(self, image=None):
+        return True, np.full((48, 64, 3), self.levels[self.frame_num], dtype=np.uint8)
+
+    def release(self) -> None:
+        pass
+
+
+@pytest.mark.parametrize('offset', [7.4, -4.6, 0.0, 21.0])
+def test_known_offset_is_recovered_with_its_sign(offset):
+    sync_error, correlation = estimate_sync_error(SyntheticVideo(offset), _track(), VIDEO_START, max_offset=30)
+
+    # The frame times plus the estimated sync error are the times of the track
+    assert sync_error == pytest.approx(offset, abs=0.3)
+    assert correlation > 0.9
+
+
+def test_static_video_has_no_correlation():
+    video = SyntheticVideo(0.0)
+    video.levels[:] = 128
+    assert estimate_sync_error(video, _track(), VIDEO_START) == (0.0, 0.0)
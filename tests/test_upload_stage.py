@@ -0,0 +1,53 @@
+import subprocess
+
+import pytest
+
+from src import upload_stage
+from src.upload_stage import DONE_STATUS, FAILED_STATUS, MAPILLARY_LOGS_FOLDER, MAPILLARY_UPLOAD_FAILED, \
+    run_upload, upload_mapillary
+
+
+@pytest.fixture
+def mapillary_tools(monkeypatch):
+    """ Replaces the `mapillary_tools` command with one exiting with the code stored in the returned dict. """
+    command = {'returncode': 0, 'arguments': None}
+
+    def run(arguments, **kwargs):
+        command['arguments'] = arguments
+        return subprocess.CompletedProcess(arguments, command['returncode'])
+
+    monkeypatch.setattr(upload_stage.shutil, 'which', lambda name: f'/usr/bin/{name}')
+    monkeypatch.setattr(upload_stage.subprocess, 'run', run)
+    return command
+
+
+def test_mapillary_upload_succeeds(mapillary_tools, tmp_path):
+    assert upload_mapillary(str(tmp_path), 'user')
+    assert mapillary_tools['arguments'][1:] == ['process_and_upload', '--import_path', str(tmp_path),
+                                                '--user_name', 'user']
+
+
+def test_mapillary_upload_fails_when_the_command_fails(mapillary_tools, tmp_path):
+    mapillary_tools['returncode'] = 1
+    assert not upload_mapillary(str(tmp_path), 'user')
+
+    result = run_upload('mapillary', lambda: upload_mapillary(str(tmp_path), 'user'), [])
+    assert result['status'] == FAILED_STATUS
+
+
+def test_mapillary_upload_fails_when_a_frame_is_not_uploaded(mapillary_tools, tmp_path):
+    log_path = tmp_path / MAPILLARY_LOGS_FOLDER / '2021_0501_120000_000000'
+    log_path.mkdir(parents=True)
+    (log_path / MAPILLARY_UPLOAD_FAILED).touch()
+    assert not upload_mapillary(str(tmp_path), 'user')
+
+
+def test_mapillary_upload_fails_without_the_command(monkeypatch, tmp_path):
+    monkeypatch.setattr(upload_stage.shutil, 'which', lambda name: None)
+    result = run_upload('mapillary', lambda: upload_mapillary(str(tmp_path), 'user'), [])
+    assert result['status'] == FAILED_STATUS
+    assert 'FileNotFoundError' in result['error']
+
+
+def test_successful_upload_is_done(mapillary_tools, tmp_path):
+    assert run_upload('mapillary', lambda: upload_mapillary(str(tmp_path), 'user'), [])['status'] == DONE_STATUS
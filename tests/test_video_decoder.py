@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+import pytest
+
+from src.video_decoder import open_decoder, DECODER_BACKENDS, FFMPEG_BACKEND
+
+NUM_FRAMES = 40
+
+
+@pytest.fixture(scope='module')
+def video_path(tmp_path_factory):
+    """ Short video whose frames are all different. The mp4v encoder writes a keyframe every 12 frames. """
+    path = tmp_path_factory.mktemp('video') / '2021_0501_120000_000000.mp4'
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), 30.0, (64, 48))
+    rng = np.random.default_rng(0)
+    for _ in range(NUM_FRAMES):
+        writer.write(cv2.GaussianBlur(rng.integers(0, 256, size=(48, 64, 3), dtype=np.uint8), (0, 0), 2))
+    writer.release()
+    return path
+
+
+def _decode_all(path, backend):
+    cap = open_decoder(path, backend)
+    frames = []
+    while True:
+        success, image = cap.read()
+        if not success:
+            break
+        frames.append(image)
+    cap.release()
+    return frames
+
+
+@pytest.mark.parametrize('backend', DECODER_BACKENDS)
+def test_seek_returns_the_requested_frame(video_path, backend):
+    if backend == FFMPEG_BACKEND:
+        pytest.importorskip('av')
+    frames = _decode_all(video_path, backend)
+    assert len(frames) == NUM_FRAMES
+
+    cap = open_decoder(video_path, backend)
+    try:
+        for frame_num in (25, 3, 0, 13, 0, 39):
+            cap.seek(frame_num)
+            success, image = cap.read()
+            assert success
+            assert np.array_equal(image, frames[frame_num]), frame_num
+    finally:
+        cap.release()
@@ -0,0 +1,25 @@
+"""OSC tools as a package.
+
+The modules import each other by name, as they are run as scripts from this folder, so the folder is
+added to the start of the search path before importing them, where installed packages with the same
+names, e.g. `validators`, cannot shadow them. As the folder name is not a valid identifier, the
+package is imported with `importlib.import_module('upload-scripts')`."""
+
+import os
+import sys
+
+PACKAGE_PATH = os.path.dirname(os.path.realpath(__file__))
+if PACKAGE_PATH not in sys.path:
+    sys.path.insert(0, PACKAGE_PATH)
+
+# pylint: disable=wrong-import-position
+import constants
+import sequence_container
+from login_controller import LoginController
+from osc_api_config import OSCAPISubDomain
+from osc_api_models import OSCPhoto, OSCSequence
+from osc_discoverer import OnlineIDDiscoverer, OSCUploadProgressDiscoverer, SequenceDiscovererFactory
+from osc_uploader import OSCUploadManager
+
+__all__ = ['constants', 'sequence_container', 'LoginController', 'OSCAPISubDomain', 'OSCPhoto', 'OSCSequence',
+           'OnlineIDDiscoverer', 'OSCUploadProgressDiscoverer', 'SequenceDiscovererFactory', 'OSCUploadManager']
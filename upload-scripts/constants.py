@@ -4,3 +4,5 @@ PROGRESS_FILE_NAME = "osc_sequence_upload_progress.txt"
 UPLOAD_FINISHED = "finished"
 METADATA_ZIP_NAME = "track.txt.gz"
 METADATA_NAME = "track.txt"
+FRAMES_CONTAINER_NAME = "frames.tar"
+FRAMES_CONTAINER_INDEX_NAME = "frames.tar.idx"
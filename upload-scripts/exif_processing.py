@@ -6,6 +6,8 @@ from typing import Optional
 # third party
 import exifread
 import piexif
+# local
+import sequence_container
 
 MPH_TO_KMH_FACTOR = 1.60934
 """miles per hour to kilometers per hour conversion factor"""
@@ -80,7 +82,7 @@ class SpeedUnit(Enum):
 
 def all_tags(path) -> {str: str}:
     """Method to return Exif tags"""
-    file = open(path, "rb")
+    file = sequence_container.open_photo(path)
     tags = exifread.process_file(file, details=False)
     return tags
 
@@ -7,6 +7,7 @@ import logging
 import requests
 import constants
 import osc_api_config
+import sequence_container
 from osc_api_config import OSCAPISubDomain
 from osc_api_models import OSCSequence, OSCPhoto, OSCUser
 
@@ -425,7 +426,7 @@ class OSCApi:
 
             photo_upload_url = OSCApiMethods.photo_upload(self.environment)
             load_data = {'photo': (os.path.basename(photo.image_name),
-                                   open(photo_path, 'rb'),
+                                   sequence_container.open_photo(photo_path),
                                    'image/jpeg')}
             response = requests.post(photo_upload_url,
                                      data=parameters,
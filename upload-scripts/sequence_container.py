@@ -0,0 +1,123 @@
+"""This module reads the photos of a sequence stored in a single uncompressed tar file, next to an
+index with the offset of every photo, without extracting them.
+
+A photo in a container is addressed as if the container was a folder:
+<sequence folder>/frames.tar/<photo name>"""
+
+import io
+import logging
+import os
+import tarfile
+import threading
+import constants
+
+LOGGER = logging.getLogger('osc_tools.sequence_container')
+
+# container path -> ({photo name: (offset, size)}, end of the last indexed photo, sizes of the files)
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def container_photos(path: str) -> [str]:
+    """This method returns the paths of the photos in the container of a sequence folder"""
+    container = os.path.join(path, constants.FRAMES_CONTAINER_NAME)
+    if not os.path.isfile(container):
+        return []
+    names = sorted(_index(container))
+    LOGGER.debug("found %d photos in the container %s", len(names), container)
+    return [os.path.join(container, name) for name in names]
+
+
+def split_photo_path(path: str) -> (str, str):
+    """This method returns the container and the name of a photo in a container or None"""
+    container, name = os.path.split(path)
+    if os.path.basename(container) != constants.FRAMES_CONTAINER_NAME or \
+            not os.path.isfile(container):
+        return None
+    return container, name
+
+
+def open_photo(path: str):
+    """This method opens a photo file or a photo in a container for reading bytes"""
+    container_photo = split_photo_path(path)
+    if not container_photo:
+        return open(path, "rb")
+    container, name = container_photo
+    offset, size = _entry(container, name)
+    with open(container, "rb") as container_file:
+        container_file.seek(offset)
+        return io.BytesIO(container_file.read(size))
+
+
+def photo_size(path: str) -> int:
+    """This method returns the size in bytes of a photo file or of a photo in a container"""
+    container_photo = split_photo_path(path)
+    if not container_photo:
+        return os.path.getsize(path)
+    return _entry(*container_photo)[1]
+
+
+def _entry(container: str, name: str) -> (int, int):
+    entry = _index(container).get(name)
+    if entry is None:
+        raise FileNotFoundError("The photo " + name + " is not in the container " + container)
+    return entry
+
+
+def _index(container: str) -> {str: (int, int)}:
+    """The index is read again only when the container or its index grew, e.g. while they
+    are being written"""
+    index_path = os.path.join(os.path.dirname(container), constants.FRAMES_CONTAINER_INDEX_NAME)
+    size = os.path.getsize(container)
+    sizes = (size, os.path.getsize(index_path) if os.path.isfile(index_path) else -1)
+    with _INDEXES_LOCK:
+        entries, end, indexed_sizes = _INDEXES.get(container, ({}, 0, None))
+        if sizes != indexed_sizes:
+            if sizes[1] >= 0:
+                entries, end = _read_index(index_path, size)
+            else:
+                entries, end = scan_headers(container, entries, end, size)
+            _INDEXES[container] = (entries, end, sizes)
+        return entries
+
+
+def _read_index(index_path: str, size: int) -> ({str: (int, int)}, int):
+    entries = {}
+    end = 0
+    with open(index_path, "rb") as index_file:
+        data = index_file.read()
+    # the last line might be still being written
+    for line in data[:data.rfind(b"\n") + 1].decode().splitlines():
+        name, offset, photo_bytes = line.split("\t")
+        offset, photo_bytes = int(offset), int(photo_bytes)
+        if offset + photo_bytes > size:
+            break
+        entries[name] = (offset, photo_bytes)
+        end = max(end, offset + photo_bytes + (-photo_bytes % tarfile.BLOCKSIZE))
+    return entries, end
+
+
+def scan_headers(container: str, entries: {str: (int, int)}, position: int,
+                 size: int) -> ({str: (int, int)}, int):
+    """This method indexes the photos of a container reading its tar headers from position until
+    size, e.g. when there is no index. It returns the entries with the photos found and the end of
+    the last complete photo"""
+    entries = dict(entries)
+    with open(container, "rb") as container_file:
+        while position + tarfile.BLOCKSIZE <= size:
+            container_file.seek(position)
+            block = container_file.read(tarfile.BLOCKSIZE)
+            if block == bytes(tarfile.BLOCKSIZE):
+                break
+            try:
+                info = tarfile.TarInfo.frombuf(block, tarfile.ENCODING, "surrogateescape")
+            except tarfile.HeaderError:
+                LOGGER.warning("WARNING: invalid header in %s at %d", container, position)
+                break
+            offset = position + tarfile.BLOCKSIZE
+            if offset + info.size > size:
+                break
+            if info.isfile():
+                entries[info.name] = (offset, info.size)
+            position = offset + info.size + (-info.size % tarfile.BLOCKSIZE)
+    return entries, position
@@ -5,6 +5,7 @@ import os
 import logging
 import exif_processing
 import constants
+import sequence_container
 from metadata_manager import MetadataManager
 from osc_models import VisualData, Photo, Video
 from metadata_models import Photo as MetadataPhoto
@@ -46,6 +47,11 @@ class PhotoDiscovery(VisualDataDiscoverer):
                 photo = cls._photo_from_path(os.path.join(path, file_path))
                 if photo:
                     photos.append(photo)
+        # photos stored in a single container file
+        for file_path in sequence_container.container_photos(path):
+            photo = cls._photo_from_path(file_path)
+            if photo:
+                photos.append(photo)
         # Sort photo list
         cls._sort_photo_list(photos)
         # Add index to the photo objects